@@ -1,20 +1,33 @@
 # Language modeling using N-grams
 
+import itertools
 import os
 
+from metrics import NULL_METRICS
+from vocabulary import Vocabulary
+
+# Number of lines counted between updates of the metrics.
+_LINES_PER_UPDATE_ = 10000
+
 class NGram:
     """
     Builds a N-Grams based language model.
 
     For building a model, this class calculates frequency of
-    all the N-grams and N-1 grams (subgrams) in the corpus. 
+    all the N-grams and N-1 grams (subgrams) in the corpus. Counts for
+    all the lower orders (1..N) are gathered in the same pass and are
+    available through get_counts.
+
+    Tokens are interned in a Vocabulary and the count tables are keyed
+    by tuples of token ids. The string based getters are kept for
+    compatibility and convert keys on the fly.
     """
 
     # Marker for start and end of the sentence.
     _START_MARKER_ = "_START_"
     _END_MARKER_ = "_END_"
 
-    def __init__(self, inputfile, N=3):
+    def __init__(self, inputfile, N=3, vocabulary=None):
         """Initializes the instance.
 
         param:
@@ -22,63 +35,308 @@ class NGram:
         inputfile: Path of input file. This file should contain each
             sentence per line. For more details, see util.preprocess_text
         N: Size of Markov memory, must be greater than 1.
+        vocabulary: Vocabulary to use for interning tokens. It can be
+            shared between several models so that they use the same ids.
         """
         if N <= 1:
             raise ValueError("Can not create unigram")
 
-        self._grams_count = {}
-        self._subgrams_count = {}
+        # Count table of order n is at index n - 1.
+        self._counts = [{} for n in range(N)]
+        self._grams_count = self._counts[N - 1]
+        self._subgrams_count = self._counts[N - 2]
+
+        if vocabulary is None:
+            vocabulary = Vocabulary()
+        self._vocabulary = vocabulary
+        self._start_id = vocabulary.add(NGram._START_MARKER_)
+        self._end_id = vocabulary.add(NGram._END_MARKER_)
+        self._starters = (self._start_id,) * (N - 1)
 
         self._inputfile = inputfile
         self._window_size = N
 
+    def get_vocabulary(self):
+        """Returns the vocabulary used for interning tokens."""
+        return self._vocabulary
+
+    def _get_options(self):
+        """Returns the constructor arguments other than the input file,
+        N and the vocabulary, see _new_model."""
+        return {}
+
+    def _new_model(self, inputfile=None, vocabulary=None):
+        """Returns an empty model of the same kind and options.
+
+        Partial counts, e.g. of a shard or of new sentences, are counted
+        with it so that they can be merged into this model.
+        """
+        return self.__class__(inputfile, self._window_size, vocabulary,
+                **self._get_options())
+
     def get_ngrams(self):
         """Returns all N-grams"""
-        return self._grams_count.keys()
+        decode = self._vocabulary.decode
+        return [decode(k) for k in self._grams_count]
 
     def get_subgrams(self):
         """Returns all N-1 grams."""
-        return self._subgrams_count.keys()
+        decode = self._vocabulary.decode
+        return [decode(k) for k in self._subgrams_count]
 
-    def get_ngrams_frequency(self, ngram):
-        """Returns frequency count for n-gram"""
-        if ngram not in self._grams_count.keys():
+    def get_ngrams_counts(self):
+        """Returns the N-gram count table keyed by tuples of token ids."""
+        return self._grams_count
+
+    def get_subgrams_counts(self):
+        """Returns the N-1 gram count table keyed by tuples of token ids."""
+        return self._subgrams_count
+
+    def get_order(self):
+        """Returns N."""
+        return self._window_size
+
+    def get_counts(self, order=None):
+        """Returns the count table keyed by tuples of token ids.
+
+        param
+        ----
+        order: Order of the n-grams, between 1 and N. Defaults to N.
+        """
+        if order is None:
+            order = self._window_size
+        if not 1 <= order <= self._window_size:
+            raise ValueError("Order must be between 1 and N")
+
+        return self._counts[order - 1]
+
+    def set_counts(self, table, order=None):
+        """Replaces the count table of an order, see get_counts."""
+        if order is None:
+            order = self._window_size
+        if not 1 <= order <= self._window_size:
+            raise ValueError("Order must be between 1 and N")
+
+        self._counts[order - 1] = table
+        self._grams_count = self._counts[self._window_size - 1]
+        self._subgrams_count = self._counts[self._window_size - 2]
+
+    def get_frequency(self, ngram):
+        """Returns frequency count for n-gram of any order up to N."""
+        key = self._to_key(ngram)
+        if key is None or not 1 <= len(key) <= self._window_size:
             return 0
-        else:
-            return self._grams_count[ngram]
+        return self._counts[len(key) - 1].get(key, 0)
+
+    def get_ngrams_frequency(self, ngram):
+        """Returns frequency count for n-gram.
+
+        The n-gram can either be a space separated string or a tuple
+        of token ids.
+        """
+        return NGram._get_frequency(self._grams_count,
+                self._to_key(ngram))
 
     def get_subgrams_frequency(self, subgram):
         """Returns frequency count for n-1 gram"""
-        if subgram not in self._subgrams_count.keys():
+        return NGram._get_frequency(self._subgrams_count,
+                self._to_key(subgram))
+
+    def _to_key(self, ngram):
+        if isinstance(ngram, tuple):
+            return ngram
+        return self._vocabulary.encode(ngram)
+
+    @staticmethod
+    def _get_frequency(counts, key):
+        if key is None:
             return 0
-        else:
-            return self._subgrams_count[subgram]
+        return counts.get(key, 0)
 
-    def build_ngrams(self):
+    def build_ngrams(self, processes=None, shard_size=None, metrics=None,
+            use_corpus=False):
+        """
+        Calculates the frequncy of all the n-grams of order 1 to N.
+
+        param
+        ----
+        processes: Number of worker processes. If it is more than 1,
+            the input file is split into byte range shards which are
+            counted in parallel, see count_ngrams.
+        shard_size: Size of each shard in bytes.
+        metrics: metrics.Metrics to which the lines, tokens and bytes
+            read and the table sizes are reported.
+        use_corpus: Count from the pre-tokenized corpus file of the
+            input file, which is written on first use and whenever the
+            input file changes, see corpus.load_corpus.
         """
-        Calculates the frequncy of N-grams and N-1 subgrams.
+        if metrics is None:
+            metrics = NULL_METRICS
+
+        if use_corpus:
+            from corpus import load_corpus
+
+            corpus = load_corpus(self._inputfile)
+            try:
+                if processes is not None and processes > 1:
+                    count_ngrams([corpus], self._window_size, processes,
+                            shard_size, language_model=self, metrics=metrics)
+                    return
+
+                with metrics.timer("build_ngrams"):
+                    self.count_corpus(corpus)
+                metrics.increment("lines", len(corpus))
+                metrics.increment("tokens", corpus.get_token_count())
+                self._set_size_gauges(metrics)
+                metrics.report()
+            finally:
+                corpus.close()
+            return
+
+        if processes is not None and processes > 1:
+            count_ngrams([self._inputfile], self._window_size, processes,
+                    shard_size, language_model=self, metrics=metrics)
+            return
+
+        with metrics.timer("build_ngrams"), open(self._inputfile) as f:
+            if not metrics:
+                self._count_lines(f)
+                return
+
+            while True:
+                lines = list(itertools.islice(f, _LINES_PER_UPDATE_))
+                if not lines:
+                    break
+                self._count_lines(lines)
+
+                metrics.increment("lines", len(lines))
+                metrics.increment("tokens",
+                        sum(len(l.split()) for l in lines))
+                metrics.increment("bytes", sum(len(l) for l in lines))
+                self._set_size_gauges(metrics)
+                metrics.maybe_report()
+
+        metrics.report()
+
+    def _set_size_gauges(self, metrics):
+        for n, table in enumerate(self._counts, 1):
+            metrics.set_gauge("ngrams_%d" % n, len(table))
+        metrics.set_gauge("vocabulary", len(self._vocabulary))
+
+    def merge(self, other):
+        """Adds the counts of other model to this one.
+
+        The models can use different vocabularies, the ids of other
+        are translated to the ids of this model. Merging is associative,
+        so partial counts can be combined in any grouping.
+
+        param
+        ----
+        other: NGram with the same N.
+
+        return
+        ----
+        This model.
         """
+        if other._window_size != self._window_size:
+            raise ValueError("Can not merge models with different N")
 
-        import util
+        mapping = None
+        if other._vocabulary is not self._vocabulary:
+            add = self._vocabulary.add
+            mapping = [add(t) for t in other._vocabulary.get_tokens()]
 
-        with open(self._inputfile) as f:
-            for l in f:
+        for table, other_table in zip(self._counts, other._counts):
+            for key, count in other_table.iteritems():
+                if mapping is not None:
+                    key = tuple([mapping[i] for i in key])
+                table[key] = table.get(key, 0) + count
 
-                # Get N-grams
-                ngrams = util.get_ngrams_from_line(l, self._window_size,
-                        NGram._START_MARKER_, NGram._END_MARKER_)
-                for n in ngrams:
-                    if not self._grams_count.has_key(n):
-                        self._grams_count[n] = 0
-                    self._grams_count[n] += 1
+        return self
 
-                # Get N-1 Grams
-                subgrams = util.get_ngrams_from_line(l, self._window_size - 1,
-                        NGram._START_MARKER_, NGram._END_MARKER_)
-                for n in subgrams:
-                    if not self._subgrams_count.has_key(n):
-                        self._subgrams_count[n] = 0
-                    self._subgrams_count[n] += 1
+    def update(self, lines):
+        """Adds the counts of new sentences to the model.
+
+        The new sentences are counted on their own and merged, so only
+        the n-grams which occur in them are touched.
+
+        param
+        ----
+        lines: Iterable of preprocessed sentences, one per line.
+
+        return
+        ----
+        Model of the same kind with the counts of the new sentences
+        only. Its tables can be given to the update method of a
+        distribution.
+        """
+        delta = self._new_model(vocabulary=self._vocabulary)
+        delta._count_lines(lines)
+        self.merge(delta)
+        return delta
+
+    def update_from_file(self, path):
+        """Adds the counts of the sentences in a file, see update."""
+        with open(path) as f:
+            return self.update(f)
+
+    def _count_lines(self, lines):
+        """Adds the n-grams of all orders in lines to the count tables.
+
+        Each line is padded and split only once. A window of N ids
+        slides over it and the n-gram of order n is the suffix of length
+        n of the current window, which gives the same n-grams as
+        util.get_ngrams_from_line with window size n.
+
+        The n-grams made only of start markers are counted once per line
+        as well, so that every history of the N-grams has a count.
+        """
+        self._count_padded(self._encode_lines(lines))
+
+    def _count_padded(self, sentences):
+        """Counts sentences given as tuples of ids padded with markers."""
+        N = self._window_size
+        tables = [(N - order, self._counts[order - 1])
+                for order in range(1, N + 1)]
+        start_grams = [(self._starters[:order], self._counts[order - 1])
+                for order in range(1, N)]
+
+        for padded in sentences:
+            for gram, table in start_grams:
+                table[gram] = table.get(gram, 0) + 1
+
+            for index in xrange(len(padded) - N + 1):
+                window = padded[index : index + N]
+                for offset, table in tables:
+                    gram = window[offset:]
+                    table[gram] = table.get(gram, 0) + 1
+
+    def count_corpus(self, corpus, start=0, end=None):
+        """Adds the counts of the sentences of a pre-tokenized corpus.
+
+        The ids of the corpus are translated to the ids of this model
+        once per block of sentences, no text is split.
+
+        param
+        ----
+        corpus: corpus.Corpus, see corpus.load_corpus.
+        start: First sentence to count.
+        end: Sentence after the last one to count, defaults to all.
+        """
+        starters = self._starters
+        ender = (self._end_id,)
+        self._count_padded(starters + ids + ender for ids in
+                corpus.iter_sentences(self._vocabulary, True, start, end))
+
+    def _encode_lines(self, lines):
+        """Yields each line as a tuple of ids padded with the markers."""
+        add = self._vocabulary.add
+
+        starters = self._starters
+        ender = (self._end_id,)
+
+        for l in lines:
+            yield starters + tuple([add(t) for t in l.split()]) + ender
 
     def dump_data(self, output_dir):
         """Dumps ngram and subgram counts in json format.
@@ -90,19 +348,25 @@ class NGram:
         import json
 
         output_path_pattern = output_dir + "{0}_N_{1}.json"
+        decode = self._vocabulary.decode
 
         with open(output_path_pattern.format("ngrams",
             self._window_size), "w") as f:
-            json.dump(self._grams_count, f)
+            json.dump(dict((decode(k), v) for k, v in
+                self._grams_count.iteritems()), f)
 
         with open(output_path_pattern.format("subgrams",
             self._window_size), "w") as f:
-            json.dump(self._subgrams_count, f)
+            json.dump(dict((decode(k), v) for k, v in
+                self._subgrams_count.iteritems()), f)
 
-def calculates_frequency(files):
+def calculates_frequency(files, processes=None, metrics=None):
     """Util function for calculating data frequency."""
     import glob
 
+    if metrics is None:
+        metrics = NULL_METRICS
+
     for f in files:
         d, s = os.path.split(f)
         outdir = os.path.join(d, "json_train/")
@@ -110,6 +374,148 @@ def calculates_frequency(files):
             os.mkdir(outdir)
 
         language_model = NGram(f, N=2)
-        language_model.build_ngrams()
-        language_model.dump_data(outdir)
+        language_model.build_ngrams(processes=processes, metrics=metrics)
+        with metrics.timer("dump_data"):
+            language_model.dump_data(outdir)
+        metrics.increment("files")
+
+    metrics.report()
+
+# Default size of a shard for parallel counting (64 MB).
+_SHARD_SIZE_ = 64 * 1024 * 1024
+
+def get_shards(files, shard_size=None):
+    """Splits files into byte ranges.
+
+    A line belongs to the shard in which it starts, so the shards can
+    be read independently without splitting any sentence.
+
+    return
+    ----
+    A list of (path, start, end) tuples.
+    """
+    if shard_size is None:
+        shard_size = _SHARD_SIZE_
+
+    shards = []
+    for path in files:
+        size = os.path.getsize(path)
+        for start in range(0, max(size, 1), shard_size):
+            shards.append((path, start, min(start + shard_size, size)))
+
+    return shards
+
+def read_shard(path, start, end):
+    """Yields the lines which start in the byte range [start, end)."""
+    with open(path, "rb") as f:
+        if start > 0:
+            # Skip the line which started in the previous shard.
+            f.seek(start - 1)
+            f.readline()
+
+        while f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            yield line
+
+def _count_shard(args):
+    """Counts a single shard in a worker process.
+
+    The partial model is an instance of model_class created with N and
+    options, see NGram._new_model.
+    """
+    path, start, end, N, is_corpus, model_class, options = args
+    if is_corpus:
+        return _count_corpus_shard(path, start, end, N, model_class, options)
+
+    language_model = model_class(path, N, **options)
+    language_model._count_lines(read_shard(path, start, end))
+    return language_model
+
+def _count_corpus_shard(path, start, end, N, model_class, options):
+    """Counts a range of sentences of a corpus file."""
+    from corpus import Corpus
+
+    corpus = Corpus(path)
+    try:
+        language_model = model_class(None, N, corpus.get_vocabulary(),
+                **options)
+        language_model.count_corpus(corpus, start, end)
+    finally:
+        corpus.close()
+    return language_model
+
+def count_ngrams(files, N=3, processes=None, shard_size=None,
+        language_model=None, metrics=None):
+    """Counts n-grams of one or many files with a process pool.
+
+    The files are split into byte range shards (see get_shards) and each
+    shard is counted by a worker. The partial models are merged in
+    shard order, so the result is the same as counting the files
+    sequentially.
+
+    param
+    ----
+    files: Paths of the input files, see NGram, or corpus.Corpus
+        instances, which are split into ranges of sentences that the
+        workers read from the corpus file.
+    N: Size of Markov memory.
+    processes: Number of worker processes, defaults to the number of CPUs.
+    shard_size: Size of each shard in bytes.
+    language_model: NGram to add the counts to. A new one is created
+        if it is not given. The shards are counted by models of the
+        same kind, e.g. sketch.ApproximateNGram.
+    metrics: metrics.Metrics to which the progress is reported after
+        merging each shard.
+
+    return
+    ----
+    NGram containing the counts of all the files.
+    """
+    import multiprocessing
+
+    if metrics is None:
+        metrics = NULL_METRICS
+
+    if language_model is None:
+        language_model = NGram(files[0] if len(files) == 1 and
+                isinstance(files[0], basestring) else None, N)
+
+    if shard_size is None:
+        shard_size = _SHARD_SIZE_
+    model = (language_model.__class__, language_model._get_options())
+    shards = []
+    for f in files:
+        if isinstance(f, basestring):
+            shards.extend((path, start, end, N, False) + model
+                    for path, start, end in get_shards([f], shard_size))
+        else:
+            shards.extend((f.get_path(), start, end, N, True) + model
+                    for start, end in f.get_shards(shard_size))
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        with metrics.timer("build_ngrams"):
+            for shard, partial_model in itertools.izip(shards,
+                    pool.imap(_count_shard, shards)):
+                language_model.merge(partial_model)
+
+                # Every line has one end marker and one start unigram.
+                unigrams = partial_model._counts[0]
+                lines = unigrams.get((partial_model._end_id,), 0)
+                metrics.increment("shards")
+                metrics.increment("lines", lines)
+                metrics.increment("tokens",
+                        sum(unigrams.itervalues()) - 2 * lines)
+                if not shard[4]:
+                    metrics.increment("bytes", shard[2] - shard[1])
+                language_model._set_size_gauges(metrics)
+                metrics.maybe_report()
+    finally:
+        pool.close()
+        pool.join()
+
+    metrics.report()
+    return language_model
 
@@ -0,0 +1,292 @@
+# Benchmarks of the training and scoring stages.
+#
+# Synthetic corpora are drawn from a Zipf distribution over a fixed
+# vocabulary with a fixed seed, so a run is reproducible on the same
+# machine. Each stage is timed and its resident memory is sampled, and
+# the results are written as JSON, which compare_results reads back to
+# find the stages which became slower.
+
+import bisect
+import json
+import os
+import platform
+import random
+import shutil
+import tempfile
+import threading
+import time
+
+import NGrams
+import evaluation
+import metrics
+import probability
+import quantization
+import util
+
+def generate_corpus(path, sentences, vocabulary_size=10000, exponent=1.1,
+        mean_length=15, seed=0):
+    """Writes a preprocessed corpus of Zipf distributed words.
+
+    param
+    ----
+    path: Path of the output file.
+    sentences: Number of sentences, one per line.
+    vocabulary_size: Number of distinct words.
+    exponent: Exponent s of Zipf's law, the word of rank r has a
+        probability proportional to 1 / r^s.
+    mean_length: Mean number of words in a sentence.
+    seed: Seed of the random number generator.
+    """
+    rng = random.Random(seed)
+
+    cumulative_weights = []
+    total = 0.
+    for rank in xrange(1, vocabulary_size + 1):
+        total += 1. / rank ** exponent
+        cumulative_weights.append(total)
+
+    with open(path, "w") as f:
+        for i in xrange(sentences):
+            length = max(1, int(rng.expovariate(1. / mean_length)))
+            words = ["w%d" % bisect.bisect_left(cumulative_weights,
+                rng.random() * total) for j in xrange(length)]
+            f.write(" ".join(words) + "\n")
+
+def measure(name, function, profile_dir=None, sample_interval=0.01):
+    """Runs a stage and measures it.
+
+    The resident memory is read before and after the stage and sampled
+    by a thread while it runs. The peak of the samples is the peak of
+    the stage, unlike the peak of the process which never goes down.
+
+    param
+    ----
+    name: Name of the stage.
+    function: Function without arguments running the stage.
+    profile_dir: If given, the stage runs under cProfile and the stats
+        are written to name.prof in this directory.
+    sample_interval: Seconds between two samples of the memory.
+
+    return
+    ----
+    Dictionary of the measurements and the value returned by function.
+    The memory is in kilobytes, None if it can not be read, see
+    metrics.get_memory.
+    """
+    rss_before = metrics.get_memory()
+    samples = [rss_before]
+    done = threading.Event()
+
+    def sample():
+        while not done.wait(sample_interval):
+            samples.append(metrics.get_memory())
+
+    sampler = None
+    if rss_before is not None:
+        sampler = threading.Thread(target=sample)
+        sampler.daemon = True
+        sampler.start()
+
+    profiler = None
+    if profile_dir is not None:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    start_time = time.time()
+    value = function()
+    elapsed = time.time() - start_time
+
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(os.path.join(profile_dir, name + ".prof"))
+
+    done.set()
+    if sampler is not None:
+        sampler.join()
+    rss_after = metrics.get_memory()
+
+    result = {"stage": name, "seconds": elapsed,
+            "rss_before_kb": rss_before, "rss_after_kb": rss_after,
+            "peak_rss_kb": None}
+    if rss_before is not None:
+        result["peak_rss_kb"] = max(samples + [rss_after])
+
+    return result, value
+
+def _get_distributions(language_model):
+    """Returns the distributions to benchmark with their build functions."""
+    N = language_model.get_order()
+    vocabulary = language_model.get_vocabulary()
+    start_id = vocabulary.get_id(NGrams.NGram._START_MARKER_)
+    ngrams = language_model.get_ngrams_counts()
+    subgrams = language_model.get_subgrams_counts()
+    counts = [language_model.get_counts(n) for n in range(1, N + 1)]
+
+    def build(distribution, *args, **kwargs):
+        def run():
+            distribution.build_probability(*args, **kwargs)
+            return distribution
+        return run
+
+    return [
+            ("ml", build(probability.ProbabilityDistribution(
+                len(vocabulary)), ngrams, subgrams)),
+            ("laplace", build(probability.LaplaceSmoothedDistribution(
+                len(vocabulary)), ngrams, subgrams)),
+            ("good_turing", build(probability.GoodTuringDistribution(),
+                ngrams)),
+            ("katz", build(probability.KatzBackoffDistribution(),
+                counts, start=start_id)),
+            ("kneser_ney", build(probability.KneserNeyDistribution(),
+                counts, start=start_id))]
+
+def run_benchmarks(sizes=(1000, 10000), orders=(2, 3), vocabulary_size=10000,
+        lookups=100000, workdir=None, outputfile=None, profile_dir=None,
+        preprocess=False, seed=0):
+    """Benchmarks every stage for each corpus size and N.
+
+    param
+    ----
+    sizes: Numbers of training sentences. The test corpus is a tenth
+        of the training corpus.
+    orders: Values of N.
+    vocabulary_size: Number of distinct words of the corpora.
+    lookups: Number of get_probability calls timed per distribution.
+    workdir: Directory for the corpora, a temporary one by default.
+    outputfile: If given, the results are written to it as JSON.
+    profile_dir: Directory for cProfile stats, see measure.
+    preprocess: Benchmark util.preprocess_text as well, it requires the
+        NLTK punkt and WordNet data.
+    seed: Seed of the corpora.
+
+    return
+    ----
+    Dictionary with the environment and the list of results, each with
+    the stage, the corpus size and N. The evaluation stages also have
+    the log perplexity and the size of the tables in bytes, so the cost
+    of quantization can be read from them.
+    """
+    results = []
+
+    def record(size, N, name, function):
+        result, value = measure("%s_%d_%s" % (name, size, N), function,
+                profile_dir)
+        result.update({"stage": name, "sentences": size, "N": N})
+        results.append(result)
+        return value
+
+    tmpdir = workdir if workdir is not None else tempfile.mkdtemp()
+    try:
+        for size in sizes:
+            trainfile = os.path.join(tmpdir, "train_%d" % size)
+            testfile = os.path.join(tmpdir, "test_%d" % size)
+            generate_corpus(trainfile, size, vocabulary_size, seed=seed)
+            generate_corpus(testfile, max(1, size // 10), vocabulary_size,
+                    seed=seed + 1)
+
+            if preprocess:
+                record(size, 0, "preprocess_text",
+                        lambda: util.preprocess_text(trainfile,
+                            trainfile + ".processed"))
+
+            with open(trainfile) as f:
+                lines = f.readlines()
+
+            for N in orders:
+                record(size, N, "get_ngrams_from_line",
+                        lambda: [util.get_ngrams_from_line(l, N,
+                            NGrams.NGram._START_MARKER_,
+                            NGrams.NGram._END_MARKER_) for l in lines])
+
+                language_model = NGrams.NGram(trainfile, N)
+                record(size, N, "build_ngrams", language_model.build_ngrams)
+                vocabulary = language_model.get_vocabulary()
+
+                with open(testfile) as f:
+                    test_ngrams = [key for l in f
+                            for key in util.get_ngram_ids_from_line(
+                                evaluation.encode_sentence(l, vocabulary), N,
+                                vocabulary.get_id(NGrams.NGram._START_MARKER_),
+                                vocabulary.get_id(NGrams.NGram._END_MARKER_))]
+                sample = (test_ngrams * (lookups // len(test_ngrams) + 1))[
+                        :lookups]
+
+                for name, build in _get_distributions(language_model):
+                    distribution = record(size, N,
+                            "build_probability_" + name, build)
+                    record(size, N, "get_probability_" + name,
+                            lambda: [distribution.get_probability(k)
+                                for k in sample])
+                    result = record(size, N, "evaluate_perplexity_" + name,
+                            lambda: evaluation.evaluate_perplexity(testfile,
+                                distribution, vocabulary, N))
+                    results[-1]["perplexity"] = result.get_perplexity()
+                    results[-1]["size"] = \
+                            quantization.get_distribution_memory(distribution)
+
+                    # Cost of storing the distribution in 8 bits.
+                    quantized = record(size, N, "quantize_" + name,
+                            lambda: quantization.quantize_distribution(
+                                distribution, 8))
+                    result = record(size, N,
+                            "evaluate_perplexity_quantized_" + name,
+                            lambda: evaluation.evaluate_perplexity(testfile,
+                                quantized, vocabulary, N))
+                    results[-1]["perplexity"] = result.get_perplexity()
+                    results[-1]["size"] = \
+                            quantization.get_distribution_memory(quantized)
+
+                # calculate_perplexity works on string keyed tables.
+                string_distribution = probability.LaplaceSmoothedDistribution(
+                        len(vocabulary))
+                string_distribution.build_probability(
+                        dict((vocabulary.decode(k), f) for k, f in
+                            language_model.get_ngrams_counts().iteritems()),
+                        dict((vocabulary.decode(k), f) for k, f in
+                            language_model.get_subgrams_counts().iteritems()))
+                record(size, N, "calculate_perplexity",
+                        lambda: util.calculate_perplexity(testfile,
+                            string_distribution, N))
+    finally:
+        if workdir is None:
+            shutil.rmtree(tmpdir)
+
+    report = {"python": platform.python_version(),
+            "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "results": results}
+    if outputfile is not None:
+        with open(outputfile, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    return report
+
+def compare_results(baseline, current, tolerance=0.1):
+    """Finds the stages which became slower than in a baseline run.
+
+    param
+    ----
+    baseline: Report of run_benchmarks or the path of its JSON file.
+    current: Report or path to compare with the baseline.
+    tolerance: Allowed relative increase of the time.
+
+    return
+    ----
+    List of (stage, sentences, N, baseline seconds, current seconds) of
+    the slower stages.
+    """
+    reports = []
+    for report in [baseline, current]:
+        if isinstance(report, basestring):
+            with open(report) as f:
+                report = json.load(f)
+        reports.append(dict(((r["stage"], r["sentences"], r["N"]),
+            r["seconds"]) for r in report["results"]))
+
+    baseline_times, current_times = reports
+    slower = []
+    for key in sorted(set(baseline_times) & set(current_times)):
+        if current_times[key] > baseline_times[key] * (1 + tolerance):
+            slower.append(key + (baseline_times[key], current_times[key]))
+    return slower
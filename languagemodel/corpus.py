@@ -0,0 +1,242 @@
+# Pre-tokenized binary corpus files.
+#
+# A preprocessed corpus is converted once to token ids, so counting and
+# evaluation at every order read ids instead of splitting and interning
+# the text again. Layout of a corpus file (little-endian):
+#
+#   header      magic, version, vocabulary size, number of sentences and
+#               tokens, size and modification time of the source file,
+#               offsets of the sentence offsets and of the vocabulary.
+#   ids         32 bit token id of every token, sentence after sentence.
+#   offsets     64 bit index of the first token of each sentence in ids,
+#               followed by the number of tokens.
+#   vocabulary  tokens ordered by id, separated by newline.
+#
+# The arrays are accessed through mmap. The source size and time are
+# compared with the source file by load_corpus to rebuild stale files.
+
+import mmap
+import os
+import struct
+
+from vocabulary import Vocabulary
+
+_MAGIC_ = "LMCORPUS"
+_VERSION_ = 1
+
+_HEADER_ = struct.Struct("<8sHHIQQQdQQ")
+
+# Number of sentences converted to lists of ids at a time.
+_SENTENCES_PER_BLOCK_ = 10000
+
+def write_corpus(inputfile, path):
+    """Converts a preprocessed file to a corpus file.
+
+    Tokens are given ids in order of first appearance. The file is
+    written under a temporary name and renamed when it is complete, so
+    that a reader never maps a partial file.
+
+    param
+    ----
+    inputfile: Path of the preprocessed file, one sentence per line.
+    path: Path of the corpus file.
+    """
+    import numpy as np
+    import tempfile
+
+    vocabulary = Vocabulary()
+    add = vocabulary.add
+    offsets = []
+
+    stat = os.stat(inputfile)
+    token_count = 0
+    descriptor, temp_path = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with open(inputfile) as f_in, os.fdopen(descriptor, "wb") as f:
+            f.write("\x00" * _HEADER_.size)
+
+            for l in f_in:
+                offsets.append(token_count)
+                ids = np.array([add(t) for t in l.split()], dtype="<u4")
+                ids.tofile(f)
+                token_count += len(ids)
+            offsets.append(token_count)
+
+            f.write("\x00" * (-f.tell() % 8))
+            offsets_offset = f.tell()
+            for start in xrange(0, len(offsets), _SENTENCES_PER_BLOCK_):
+                block = offsets[start : start + _SENTENCES_PER_BLOCK_]
+                f.write(struct.pack("<%dQ" % len(block), *block))
+
+            vocabulary_offset = f.tell()
+            f.write("\n".join(vocabulary.get_tokens()))
+
+            f.seek(0)
+            f.write(_HEADER_.pack(_MAGIC_, _VERSION_, 0, len(vocabulary),
+                len(offsets) - 1, token_count, stat.st_size,
+                stat.st_mtime, offsets_offset, vocabulary_offset))
+
+        os.rename(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+class Corpus(object):
+    """Read only corpus backed by a memory-mapped corpus file."""
+
+    def __init__(self, path):
+        """Opens the corpus file.
+
+        param
+        ----
+        path: Path of a file written by write_corpus.
+        """
+        import numpy as np
+
+        self._path = path
+        self._file = open(path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0,
+                access=mmap.ACCESS_READ)
+
+        (magic, version, reserved, vocabulary_size, sentence_count,
+                token_count, source_size, source_mtime, offsets_offset,
+                vocabulary_offset) = _HEADER_.unpack_from(self._map, 0)
+        if magic != _MAGIC_:
+            raise ValueError("Not a corpus file: " + path)
+        if version != _VERSION_:
+            raise ValueError("Unsupported corpus file version: %d" % version)
+
+        self._source = (source_size, source_mtime)
+        self._ids = np.frombuffer(self._map, dtype="<u4", count=token_count,
+                offset=_HEADER_.size)
+        self._offsets = np.frombuffer(self._map, dtype="<u8",
+                count=sentence_count + 1, offset=offsets_offset)
+
+        tokens = []
+        if vocabulary_size > 0:
+            tokens = self._map[vocabulary_offset:].split("\n")
+        self._vocabulary = Vocabulary(tokens)
+
+    def close(self):
+        # The arrays must not be used after closing.
+        self._ids = self._offsets = None
+        self._map.close()
+        self._file.close()
+
+    def __len__(self):
+        """Returns the number of sentences."""
+        return len(self._offsets) - 1
+
+    def get_path(self):
+        return self._path
+
+    def get_token_count(self):
+        return len(self._ids)
+
+    def get_vocabulary(self):
+        """Returns the vocabulary of the ids stored in the file."""
+        return self._vocabulary
+
+    def get_ids(self):
+        """Returns the ids of all the tokens as a numpy array."""
+        return self._ids
+
+    def get_offsets(self):
+        """Returns the index of the first token of each sentence."""
+        return self._offsets
+
+    def is_current(self, source):
+        """Tells if source did not change since the corpus was written."""
+        stat = os.stat(source)
+        return self._source == (stat.st_size, stat.st_mtime)
+
+    def get_shards(self, shard_size):
+        """Splits the sentences into ranges of about shard_size bytes.
+
+        return
+        ----
+        A list of (start, end) sentence ranges.
+        """
+        import numpy as np
+
+        count = len(self)
+        tokens_per_shard = max(1, shard_size // 4)
+        bounds = np.searchsorted(self._offsets[:-1],
+                np.arange(0, max(self.get_token_count(), 1),
+                    tokens_per_shard))
+        bounds = sorted(set(bounds.tolist()) | set([0, count]))
+        return zip(bounds[:-1], bounds[1:])
+
+    def _get_mapping(self, vocabulary, add):
+        """Returns the array translating ids to ids of vocabulary."""
+        import numpy as np
+
+        tokens = self._vocabulary.get_tokens()
+        if vocabulary is None or vocabulary.get_tokens()[:len(tokens)] == \
+                tokens:
+            return None
+
+        if add:
+            mapping = [vocabulary.add(t) for t in tokens]
+        else:
+            get_id = vocabulary.get_id
+            mapping = [get_id(t) for t in tokens]
+            mapping = [-1 if i is None else i for i in mapping]
+        return np.array(mapping, dtype=np.int64)
+
+    def iter_sentences(self, vocabulary=None, add=False, start=0, end=None):
+        """Yields the sentences as tuples of token ids.
+
+        param
+        ----
+        vocabulary: Vocabulary whose ids to use instead of the ones of
+            the file, e.g. of a model trained on another corpus.
+        add: Add the tokens which are not in vocabulary, like NGram does
+            while counting. Otherwise, they have the id given by
+            vocabulary.get_id, or -1 if it is None.
+        start: First sentence.
+        end: Sentence after the last one, defaults to all.
+        """
+        if end is None:
+            end = len(self)
+
+        mapping = self._get_mapping(vocabulary, add)
+        for block_start in xrange(start, end, _SENTENCES_PER_BLOCK_):
+            block_end = min(end, block_start + _SENTENCES_PER_BLOCK_)
+            offsets = self._offsets[block_start : block_end + 1].tolist()
+            ids = self._ids[offsets[0] : offsets[-1]]
+            if mapping is not None:
+                ids = mapping[ids]
+            ids = ids.tolist()
+
+            base = offsets[0]
+            for i in xrange(len(offsets) - 1):
+                yield tuple(ids[offsets[i] - base : offsets[i + 1] - base])
+
+def load_corpus(inputfile, path=None):
+    """Opens the corpus file of a preprocessed file.
+
+    The corpus file is written first if it does not exist or if the
+    preprocessed file changed since it was written.
+
+    param
+    ----
+    inputfile: Path of the preprocessed file.
+    path: Path of the corpus file, defaults to inputfile + ".corpus".
+
+    return
+    ----
+    Corpus.
+    """
+    if path is None:
+        path = inputfile + ".corpus"
+
+    if os.path.exists(path):
+        corpus = Corpus(path)
+        if corpus.is_current(inputfile):
+            return corpus
+        corpus.close()
+
+    write_corpus(inputfile, path)
+    return Corpus(path)
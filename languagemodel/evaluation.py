@@ -0,0 +1,421 @@
+# Evaluation of language models on test data.
+
+import copy
+import math
+import os
+import time
+
+import NGrams
+import util
+
+# Number of n-grams scored at a time.
+_BATCH_SIZE_ = 10000
+
+# Smallest default shard in bytes, see evaluate_perplexity.
+_MIN_SHARD_SIZE_ = 1024 * 1024
+
+class EvaluationResult(object):
+    """Log probabilities and token counts of an evaluated test set.
+
+    The values are kept per sentence in the order of the test file. Like
+    util.calculate_perplexity, perplexities are given as log values.
+    """
+
+    def __init__(self, log_probs, token_counts, elapsed):
+        """Initiates the class.
+        param
+        ----
+        log_probs: Sum of the log probabilities of each sentence.
+        token_counts: Number of tokens of each sentence.
+        elapsed: Time taken for evaluation in seconds.
+        """
+        self.log_probs = log_probs
+        self.token_counts = token_counts
+        self.elapsed = elapsed
+
+        # math.fsum is exact, so the total does not depend on how the
+        # test set was split into batches or shards.
+        self.log_prob_sum = math.fsum(log_probs)
+        self.token_count = sum(token_counts)
+
+    def get_perplexity(self):
+        """Returns the log value of perplexity of the whole test set."""
+        return -1. / self.token_count * self.log_prob_sum
+
+    def get_sentence_perplexities(self):
+        """Returns the log value of perplexity of each sentence."""
+        return [-1. / c * p if c > 0 else 0.
+                for p, c in zip(self.log_probs, self.token_counts)]
+
+    def get_throughput(self):
+        """Returns the number of tokens evaluated per second."""
+        if self.elapsed <= 0:
+            return float("inf")
+        return self.token_count / self.elapsed
+
+class StreamScorer(object):
+    """Scores a stream of tokens as they arrive.
+
+    The state is the last N-1 token ids and the running sums, so each
+    token costs a single get_probability call and copy is cheap, e.g. to
+    branch the state for each candidate of a beam search.
+    """
+
+    def __init__(self, prob_distribution, vocabulary, window_size):
+        """Initiates the class.
+        param
+        ----
+        prob_distribution: Distribution built from the id keyed tables of
+            the training model, see NGram.get_ngrams_counts.
+        vocabulary: Vocabulary of the training model.
+        window_size: The N of N-grams.
+        """
+        self._distribution = prob_distribution
+        self._vocabulary = vocabulary
+        self._window_size = window_size
+        self._starters = (vocabulary.get_id(NGrams.NGram._START_MARKER_),) \
+                * (window_size - 1)
+        self._end_id = vocabulary.get_id(NGrams.NGram._END_MARKER_)
+
+        self._history = self._starters
+        self._log_prob_sum = 0.
+        self._token_count = 0
+
+    def copy(self):
+        """Returns an independent scorer with the same state."""
+        # The distribution and vocabulary are shared, only the state of
+        # the stream is duplicated.
+        other = copy.copy(self)
+        other._history = tuple(self._history)
+        other._log_prob_sum = self._log_prob_sum
+        other._token_count = self._token_count
+        return other
+
+    def push(self, token):
+        """Scores the next token of the stream.
+
+        return
+        ----
+        The log probability of token given the previous N-1 tokens.
+        """
+        token_id = self._vocabulary.get_id(token)
+        if token_id is None:
+            token_id = -1
+        return self.push_id(token_id)
+
+    def push_id(self, token_id):
+        """Scores the next token given as id, -1 for an unknown token."""
+        ngram = self._history + (token_id,)
+        prob = self._distribution.get_probability(ngram)
+        log_prob = math.log(prob) if prob > 0 else float("-inf")
+
+        self._history = ngram[1:]
+        self._log_prob_sum += log_prob
+        self._token_count += 1
+        return log_prob
+
+    def end_sentence(self):
+        """Scores the end marker and starts a new sentence.
+
+        return
+        ----
+        The log probability of the end marker.
+        """
+        log_prob = self.push_id(self._end_id)
+        self._history = self._starters
+        return log_prob
+
+    def get_history(self):
+        """Returns the ids of the last N-1 tokens, with start markers."""
+        return self._history
+
+    def get_log_prob(self):
+        """Returns the sum of the log probabilities of the stream."""
+        return self._log_prob_sum
+
+    def get_token_count(self):
+        """Returns the number of scored tokens, including end markers."""
+        return self._token_count
+
+    def get_perplexity(self):
+        """Returns the log value of perplexity of the stream so far.
+
+        Unlike evaluate_perplexity, every scored token is counted, since
+        a stream is scored before its sentences are complete.
+        """
+        if self._token_count == 0:
+            return 0.
+        return -1. / self._token_count * self._log_prob_sum
+
+def evaluate_perplexity(filename, prob_distribution, vocabulary, window_size,
+        batch_size=None, processes=None, shard_size=None):
+    """Evaluates the perplexity of test data.
+
+    The test file is read in batches of n-grams which are scored with
+    get_log_probabilities of the distribution. With more than one
+    process, the file is split into shards (see NGrams.get_shards) and
+    the shards are evaluated by a process pool.
+
+    The test data can also be a pre-tokenized corpus, whose ids are
+    read instead of the text, see corpus.load_corpus.
+
+    The result is the same as of util.calculate_perplexity, except for
+    sentences shorter than N - 2 tokens: calculate_perplexity also
+    scores their n-grams shorter than N (see
+    util.get_ngram_ids_from_line). Such sentences count 0 tokens in
+    both, see util.get_token_count.
+
+    param
+    ----
+    filename: Input file name. It is assumed that the file has been
+        preprocessed so that each line contains a single complete sentence.
+        Or a corpus.Corpus of the test data.
+    prob_distribution: Distribution built from the id keyed tables of
+        the training model, see NGram.get_ngrams_counts.
+    vocabulary: Vocabulary of the training model.
+    window_size: The N of N-grams.
+    batch_size: Number of n-grams to score at a time.
+    processes: Number of worker processes.
+    shard_size: Size of each shard in bytes. By default, the data is
+        split evenly among the processes, in shards of at least
+        _MIN_SHARD_SIZE_.
+
+    returns
+    ----
+    EvaluationResult.
+    """
+    start_time = time.time()
+
+    if batch_size is None:
+        batch_size = _BATCH_SIZE_
+
+    is_corpus = not isinstance(filename, basestring)
+    if shard_size is None:
+        if is_corpus:
+            size = filename.get_token_count() * 4
+        else:
+            size = os.path.getsize(filename)
+        shard_size = max(size // (processes or 1) + 1, _MIN_SHARD_SIZE_)
+
+    if is_corpus:
+        shards = [(filename.get_path(), start, end, window_size, batch_size,
+            True) for start, end in filename.get_shards(shard_size)]
+    else:
+        shards = [(path, start, end, window_size, batch_size, False) for
+                path, start, end in NGrams.get_shards([filename], shard_size)]
+
+    log_probs = []
+    token_counts = []
+    if processes is not None and processes > 1:
+        import multiprocessing
+
+        pool = multiprocessing.Pool(processes, _set_model,
+                (prob_distribution, vocabulary))
+        try:
+            for shard_log_probs, shard_token_counts in pool.imap(
+                    _evaluate_shard, shards):
+                log_probs.extend(shard_log_probs)
+                token_counts.extend(shard_token_counts)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        _set_model(prob_distribution, vocabulary)
+        for shard in shards:
+            shard_log_probs, shard_token_counts = _evaluate_shard(shard)
+            log_probs.extend(shard_log_probs)
+            token_counts.extend(shard_token_counts)
+
+    return EvaluationResult(log_probs, token_counts,
+            time.time() - start_time)
+
+# Distribution and vocabulary used by _evaluate_shard, set once for
+# each worker process.
+_model = None
+
+def _set_model(prob_distribution, vocabulary):
+    global _model
+    _model = (prob_distribution, vocabulary)
+
+def _evaluate_shard(args):
+    path, start, end, window_size, batch_size, is_corpus = args
+    prob_distribution, vocabulary = _model
+
+    corpus = None
+    if is_corpus:
+        from corpus import Corpus
+
+        corpus = Corpus(path)
+        batches = iter_id_batches(corpus.iter_sentences(vocabulary, False,
+            start, end), vocabulary, window_size, batch_size)
+    else:
+        batches = iter_ngram_batches(NGrams.read_shard(path, start, end),
+                vocabulary, window_size, batch_size)
+
+    log_probs = []
+    token_counts = []
+    for ids, sentence_lengths in batches:
+        log_probs.extend(sum_sentences(
+            prob_distribution.get_log_probabilities(ids), sentence_lengths))
+
+        token_counts.extend([util.get_token_count(l, window_size)
+            for l in sentence_lengths])
+
+    if corpus is not None:
+        corpus.close()
+    return log_probs, token_counts
+
+def encode_sentence(line, vocabulary):
+    """Returns the token ids of a line, -1 for unknown tokens.
+
+    With a frozen vocabulary, unknown tokens get the id of their unknown
+    word class instead.
+    """
+    get_id = vocabulary.get_id
+    token_ids = [get_id(t) for t in line.split()]
+    return [-1 if i is None else i for i in token_ids]
+
+def iter_ngram_batches(lines, vocabulary, window_size, batch_size):
+    """Yields the n-grams of lines as arrays of token ids.
+
+    param
+    ----
+    lines: Iterable of preprocessed sentences.
+    vocabulary: Vocabulary of the training model.
+    window_size: The N of N-grams.
+    batch_size: Number of n-grams in a batch. Sentences are not split,
+        so a batch can be larger.
+
+    return
+    ----
+    Yields a 2-D array of token ids and the number of n-grams of each
+    sentence in the batch.
+    """
+    return iter_id_batches((encode_sentence(line, vocabulary)
+        for line in lines), vocabulary, window_size, batch_size)
+
+def iter_id_batches(sentences, vocabulary, window_size, batch_size):
+    """Yields the n-grams of encoded sentences, see iter_ngram_batches.
+
+    param
+    ----
+    sentences: Iterable of sequences of token ids, without the markers.
+    """
+    import numpy as np
+
+    start_id = vocabulary.get_id(NGrams.NGram._START_MARKER_)
+    end_id = vocabulary.get_id(NGrams.NGram._END_MARKER_)
+
+    rows = []
+    sentence_lengths = []
+    for ids in sentences:
+        ngrams = util.get_ngram_ids_from_line(ids, window_size, start_id,
+                end_id)
+        rows.extend(ngrams)
+        sentence_lengths.append(len(ngrams))
+
+        if len(rows) >= batch_size:
+            yield np.array(rows, dtype=np.int64), sentence_lengths
+            rows = []
+            sentence_lengths = []
+
+    if sentence_lengths:
+        yield (np.array(rows, dtype=np.int64).reshape(-1, window_size),
+                sentence_lengths)
+
+def sum_sentences(values, sentence_lengths):
+    """Returns the sums of consecutive runs of values."""
+    sums = []
+    offset = 0
+    for l in sentence_lengths:
+        sums.append(math.fsum(values[offset : offset + l]))
+        offset += l
+    return sums
+
+def classify_documents(documents, distributions, labels, vocabulary,
+        window_size, batch_size=None):
+    """Labels each document with the model of the lowest perplexity.
+
+    Each document is split into n-grams only once. The n-grams of many
+    documents are put into a single batch, which is scored against all
+    the distributions, so the distributions must be built from tables
+    using the same vocabulary (see the vocabulary argument of NGram).
+
+    param
+    ----
+    documents: Iterable of documents, each an iterable of preprocessed
+        sentences.
+    distributions: Distributions built from id keyed tables, one per label.
+    labels: Label of each distribution, e.g. the author.
+    vocabulary: Vocabulary shared by all the models.
+    window_size: The N of N-grams.
+    batch_size: Minimum number of n-grams to score at a time.
+
+    returns
+    ----
+    A list with the label and the log perplexities under each of the
+    distributions for every document.
+    """
+    import numpy as np
+
+    if batch_size is None:
+        batch_size = _BATCH_SIZE_
+
+    start_id = vocabulary.get_id(NGrams.NGram._START_MARKER_)
+    end_id = vocabulary.get_id(NGrams.NGram._END_MARKER_)
+
+    results = []
+
+    def score(rows, lengths, token_counts):
+        ids = np.array(rows, dtype=np.int64).reshape(-1, window_size)
+        scores = [[] for l in lengths]
+        for prob_distribution in distributions:
+            log_probs = sum_sentences(
+                    prob_distribution.get_log_probabilities(ids), lengths)
+            for i, log_prob in enumerate(log_probs):
+                scores[i].append(-1. / token_counts[i] * log_prob
+                        if token_counts[i] > 0 else 0.)
+
+        for document_scores in scores:
+            best = min(range(len(labels)), key=document_scores.__getitem__)
+            results.append((labels[best], document_scores))
+
+    rows = []
+    lengths = []
+    token_counts = []
+    for document in documents:
+        length = 0
+        token_count = 0
+        for line in document:
+            ngrams = util.get_ngram_ids_from_line(
+                    encode_sentence(line, vocabulary), window_size, start_id,
+                    end_id)
+            rows.extend(ngrams)
+            length += len(ngrams)
+            token_count += util.get_token_count(len(ngrams), window_size)
+
+        lengths.append(length)
+        token_counts.append(token_count)
+
+        if len(rows) >= batch_size:
+            score(rows, lengths, token_counts)
+            rows = []
+            lengths = []
+            token_counts = []
+
+    if lengths:
+        score(rows, lengths, token_counts)
+
+    return results
+
+def classify_files(filenames, distributions, labels, vocabulary,
+        window_size, batch_size=None):
+    """Labels preprocessed files, see classify_documents."""
+
+    def read_documents():
+        for filename in filenames:
+            with open(filename) as f:
+                yield f.readlines()
+
+    return classify_documents(read_documents(), distributions, labels,
+            vocabulary, window_size, batch_size)
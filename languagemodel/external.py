@@ -0,0 +1,117 @@
+# External memory n-gram counting.
+#
+# The counts are gathered in memory until the tables hold a given number
+# of entries. Then each table is sorted and written to a temporary run
+# file and the tables are emptied. At the end, the runs of each order
+# are merged with a k-way merge and the summed counts are written as a
+# model file, see modelfile.py, which keeps the keys sorted as well.
+
+import heapq
+import os
+import shutil
+import struct
+import tempfile
+
+import modelfile
+from NGrams import NGram
+
+# Number of lines counted between checks of the table sizes.
+_LINES_PER_CHECK_ = 1000
+
+def _get_record_format(order):
+    return struct.Struct("<%dIQ" % order)
+
+def _write_run(path, table, order):
+    """Writes a table sorted by key to a run file."""
+    record_format = _get_record_format(order)
+    with open(path, "wb") as f:
+        for key in sorted(table):
+            f.write(record_format.pack(*(key + (table[key],))))
+
+def _read_run(path, order):
+    """Yields (key, count) pairs of a run file."""
+    record_format = _get_record_format(order)
+    with open(path, "rb") as f:
+        while True:
+            record = f.read(record_format.size)
+            if not record:
+                break
+            values = record_format.unpack(record)
+            yield values[:-1], values[-1]
+
+def _merge_runs(runs):
+    """Merges sorted runs, summing the counts of equal keys."""
+    current_key = None
+    current_count = 0
+    for key, count in heapq.merge(*runs):
+        if key != current_key:
+            if current_key is not None:
+                yield current_key, current_count
+            current_key = key
+            current_count = 0
+        current_count += count
+
+    if current_key is not None:
+        yield current_key, current_count
+
+def count_to_model(inputfile, outputfile, N=3, max_entries=10000000,
+        tmpdir=None):
+    """Counts n-grams with bounded memory and writes a model file.
+
+    Token ids are given in order of first appearance, like NGram does, so
+    the output is the same for the same input however small the budget
+    is.
+
+    param
+    ----
+    inputfile: Path of input file, see NGram.
+    outputfile: Path of the model file, see modelfile.load_model.
+    N: Size of Markov memory.
+    max_entries: Number of n-grams of all orders to hold in memory
+        before spilling them to a run file.
+    tmpdir: Directory for the run files.
+
+    return
+    ----
+    Number of run files which were merged.
+    """
+    language_model = NGram(inputfile, N)
+    counts = [language_model.get_counts(n) for n in range(1, N + 1)]
+
+    rundir = tempfile.mkdtemp(dir=tmpdir)
+    runs = []
+
+    def spill():
+        run = len(runs)
+        for n, table in enumerate(counts, 1):
+            _write_run(os.path.join(rundir, "%d_%d" % (run, n)), table, n)
+            table.clear()
+        runs.append(run)
+
+    try:
+        with open(inputfile) as f:
+            lines = []
+            for l in f:
+                lines.append(l)
+                if len(lines) < _LINES_PER_CHECK_:
+                    continue
+
+                language_model._count_lines(lines)
+                lines = []
+                if sum(len(table) for table in counts) >= max_entries:
+                    spill()
+
+            language_model._count_lines(lines)
+        spill()
+
+        writer = modelfile.ModelWriter(outputfile, N,
+                language_model.get_vocabulary())
+        for n in range(1, N + 1):
+            writer.write_section(_merge_runs([
+                _read_run(os.path.join(rundir, "%d_%d" % (run, n)), n)
+                for run in runs]))
+        writer.close()
+    finally:
+        shutil.rmtree(rundir)
+
+    return len(runs)
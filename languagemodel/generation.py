@@ -0,0 +1,96 @@
+# Random sentence generation from n-gram counts.
+
+import array
+import bisect
+import random
+
+from NGrams import NGram
+
+class SentenceGenerator(object):
+    """Generates random sentences from the N-gram counts of a model.
+
+    For each history, the ids of the words which follow it are stored
+    contiguously along with their cumulative counts. Picking the next
+    word is then a binary search over the successors of the current
+    history instead of a scan over the count tables.
+    """
+
+    def __init__(self, language_model, seed=None):
+        """Builds the sampling index.
+
+        param
+        ----
+        language_model: NGram with calculated counts.
+        seed: Seed of the random number generator.
+        """
+        self._vocabulary = language_model.get_vocabulary()
+        self._window_size = language_model.get_order()
+        self._start_id = self._vocabulary.get_id(NGram._START_MARKER_)
+        self._end_id = self._vocabulary.get_id(NGram._END_MARKER_)
+        self._random = random.Random(seed)
+
+        # Successors of a history are at [start, end) of the arrays.
+        self._ranges = {}
+        self._successors = array.array("l")
+        self._cumulative_counts = array.array("l")
+
+        counts = language_model.get_ngrams_counts()
+        history = None
+        start = 0
+        total = 0
+        for key in sorted(counts):
+            if key[:-1] != history:
+                if history is not None:
+                    self._ranges[history] = (start, len(self._successors))
+                history = key[:-1]
+                start = len(self._successors)
+                total = 0
+
+            total += counts[key]
+            self._successors.append(key[-1])
+            self._cumulative_counts.append(total)
+
+        if history is not None:
+            self._ranges[history] = (start, len(self._successors))
+
+    def seed(self, seed):
+        """Seeds the random number generator."""
+        self._random.seed(seed)
+
+    def _draw(self, history):
+        """Returns the id of a word following history."""
+        start, end = self._ranges[history]
+        value = self._random.random() * self._cumulative_counts[end - 1]
+        index = bisect.bisect_right(self._cumulative_counts, value, start,
+                end)
+        return self._successors[index]
+
+    def generate_ids(self, max_length=100):
+        """Returns the token ids of a random sentence.
+
+        param
+        ----
+        max_length: Maximum number of tokens in the sentence.
+        """
+        history = (self._start_id,) * (self._window_size - 1)
+        ids = []
+        while len(ids) < max_length:
+            if history not in self._ranges:
+                break
+
+            token_id = self._draw(history)
+            if token_id == self._end_id:
+                break
+
+            ids.append(token_id)
+            history = history[1:] + (token_id,)
+
+        return ids
+
+    def generate(self, max_length=100):
+        """Returns a random sentence with tokens separated by space."""
+        return self._vocabulary.decode(self.generate_ids(max_length))
+
+    def generate_many(self, count, max_length=100):
+        """Returns a list of count random sentences."""
+        return [self.generate(max_length) for i in xrange(count)]
@@ -0,0 +1,183 @@
+# Progress metrics of long running jobs.
+#
+# A Metrics object holds counters (lines, tokens, bytes), gauges (table
+# sizes) and timers (phase durations). Its snapshot is given to the
+# sinks, which are callables, at most once per interval and when the
+# job is done. The functions which accept a metrics argument use
+# NULL_METRICS when it is not given, whose methods do nothing, and they
+# update the metrics once per batch of lines rather than per n-gram.
+
+import contextlib
+import json
+import logging
+import os
+import sys
+import time
+
+def get_memory():
+    """Returns the current resident memory of the process in kilobytes.
+
+    It is read from /proc and is None where /proc is not available.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            resident = int(f.read().split()[1])
+    except (IOError, IndexError, ValueError):
+        return None
+    return resident * os.sysconf("SC_PAGE_SIZE") // 1024
+
+def get_peak_memory():
+    """Returns the peak resident memory of the process in kilobytes.
+
+    It is the peak over the lifetime of the process, see get_memory for
+    the current value.
+    """
+    import resource
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        # Reported in bytes on OS X.
+        peak //= 1024
+    return peak
+
+class Metrics(object):
+    """Counters, gauges and timers reported to pluggable sinks."""
+
+    def __init__(self, sinks=None, interval=10.):
+        """Initiates the class.
+        param
+        ----
+        sinks: List of callables taking a snapshot, see get_snapshot,
+            e.g. LogSink or JSONFileSink.
+        interval: Minimum number of seconds between periodic reports.
+        """
+        self._sinks = list(sinks) if sinks is not None else []
+        self._interval = interval
+        self._start_time = time.time()
+        self._last_report = self._start_time
+        self.counters = {}
+        self.gauges = {}
+        self.timers = {}
+
+    def increment(self, name, value=1):
+        """Adds value to a counter."""
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_gauge(self, name, value):
+        """Sets the current value of a gauge."""
+        self.gauges[name] = value
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        """Adds the duration of the with block to a timer."""
+        start_time = time.time()
+        try:
+            yield
+        finally:
+            self.timers[name] = self.timers.get(name, 0.) + \
+                    time.time() - start_time
+
+    def get_snapshot(self):
+        """Returns the current values.
+
+        return
+        ----
+        Dictionary with the elapsed seconds, the peak memory in
+        kilobytes, the counters, their rates per second, the gauges and
+        the timers.
+        """
+        elapsed = time.time() - self._start_time
+        return {"elapsed": elapsed,
+                "peak_memory_kb": get_peak_memory(),
+                "counters": dict(self.counters),
+                "rates": dict((name, value / elapsed if elapsed > 0 else 0.)
+                    for name, value in self.counters.iteritems()),
+                "gauges": dict(self.gauges),
+                "timers": dict(self.timers)}
+
+    def report(self):
+        """Sends a snapshot to all the sinks."""
+        self._last_report = time.time()
+        snapshot = self.get_snapshot()
+        for sink in self._sinks:
+            sink(snapshot)
+
+    def maybe_report(self):
+        """Reports if the interval has passed since the last report."""
+        if time.time() - self._last_report >= self._interval:
+            self.report()
+
+class _NullTimer(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+class NullMetrics(object):
+    """Metrics which ignore every update."""
+
+    _timer = _NullTimer()
+
+    def __nonzero__(self):
+        # Lets callers skip work done only for the metrics.
+        return False
+
+    def increment(self, name, value=1):
+        pass
+
+    def set_gauge(self, name, value):
+        pass
+
+    def timer(self, name):
+        return NullMetrics._timer
+
+    def report(self):
+        pass
+
+    def maybe_report(self):
+        pass
+
+NULL_METRICS = NullMetrics()
+
+class LogSink(object):
+    """Writes each snapshot as a single log line."""
+
+    def __init__(self, logger=None, level=logging.INFO):
+        """Initiates the class.
+        param
+        ----
+        logger: Logger to write to, the module logger by default.
+        level: Level of the log lines.
+        """
+        self._logger = logger or logging.getLogger(__name__)
+        self._level = level
+
+    def __call__(self, snapshot):
+        fields = ["elapsed=%.1fs" % snapshot["elapsed"],
+                "peak_memory=%dkB" % snapshot["peak_memory_kb"]]
+        for name, value in sorted(snapshot["counters"].iteritems()):
+            fields.append("%s=%d (%.1f/s)" % (name, value,
+                snapshot["rates"][name]))
+        for name, value in sorted(snapshot["gauges"].iteritems()):
+            fields.append("%s=%s" % (name, value))
+        for name, value in sorted(snapshot["timers"].iteritems()):
+            fields.append("%s=%.3fs" % (name, value))
+        self._logger.log(self._level, " ".join(fields))
+
+class JSONFileSink(object):
+    """Appends each snapshot to a file as a line of JSON."""
+
+    def __init__(self, path):
+        """Initiates the class.
+        param
+        ----
+        path: Path of the output file.
+        """
+        self._path = path
+
+    def __call__(self, snapshot):
+        with open(self._path, "a") as f:
+            f.write(json.dumps(snapshot, sort_keys=True))
+            f.write("\n")
@@ -0,0 +1,500 @@
+# Binary, memory-mapped model files.
+#
+# Layout of a model file (all integers are unsigned):
+#
+#   header      magic, version, N, vocabulary flags, vocabulary size,
+#               vocabulary offset, vocabulary length, the default
+#               probability and the offset and length of the metadata.
+#   directory   for each order 1..N: number of rows and the offsets of
+#               the keys, counts, probabilities and unseen probabilities
+#               columns (0 if a column is absent).
+#   vocabulary  tokens ordered by id, separated by newline.
+#   columns     keys are rows of n big-endian 32 bit ids sorted so that a
+#               plain byte comparison orders them, counts are 64 bit and
+#               probabilities are doubles. Every column starts at an
+#               offset which is a multiple of 8.
+#
+# A backoff distribution (Katz or Kneser-Ney) stores the probabilities
+# of every order and, in the unseen column, the backoff weight of each
+# key as a history. A NaN stands for a key without a value. The kind of
+# walk over the orders is given by the "scoring" entry of the metadata.
+#   metadata    JSON object of the values given by the writer, e.g. the
+#               parameters of the model.
+#
+# Only the header, the directory and the vocabulary are read on loading,
+# the columns are accessed through mmap and so the pages are shared by
+# all the processes which open the same file.
+
+import math
+import mmap
+import struct
+
+from probability import KatzBackoffDistribution, KneserNeyDistribution
+from vocabulary import Vocabulary
+
+_MAGIC_ = "LMODEL\x00\x00"
+_VERSION_ = 3
+
+# Vocabulary flags, see Vocabulary.freeze.
+_FROZEN_ = 1
+_NONTRIVIAL_ = 2
+
+_HEADER_ = struct.Struct("<8sHHHIQQdQQ")
+_SECTION_ = struct.Struct("<QQQQQ")
+_COUNT_ = struct.Struct("<Q")
+_PROBABILITY_ = struct.Struct("<d")
+
+def _get_key_format(order):
+    return struct.Struct(">%dI" % order)
+
+def _align(f):
+    """Pads the file so that the next write starts at a multiple of 8."""
+    padding = -f.tell() % 8
+    f.write("\x00" * padding)
+    return f.tell()
+
+class ModelWriter(object):
+    """Writes a model file one order at a time.
+
+    The rows of an order are given in sorted order and can come from a
+    stream, the columns other than the keys are buffered in temporary
+    files and appended after the keys.
+    """
+
+    def __init__(self, path, order, vocabulary):
+        """Opens the file.
+
+        param
+        ----
+        path: Path of the output file.
+        order: N of the model.
+        vocabulary: Vocabulary of the model.
+        """
+        self._file = open(path, "wb")
+        self._order = order
+        self._vocabulary_size = len(vocabulary)
+        self._vocabulary_flags = 0
+        if vocabulary.is_frozen():
+            self._vocabulary_flags |= _FROZEN_
+        if vocabulary.has_nontrivial_class():
+            self._vocabulary_flags |= _NONTRIVIAL_
+        self._sections = []
+
+        # Placeholders for header and directory.
+        self._file.write("\x00" * (_HEADER_.size + order * _SECTION_.size))
+
+        vocabulary_data = "\n".join(vocabulary.get_tokens())
+        self._vocabulary_offset = self._file.tell()
+        self._vocabulary_length = len(vocabulary_data)
+        self._file.write(vocabulary_data)
+
+    def write_section(self, rows, probability=None, unseen=None):
+        """Writes the table of the next order.
+
+        param
+        ----
+        rows: Iterable of (key, count) sorted by key, where key is a
+            tuple of token ids.
+        probability: Optional function giving the probability of a key.
+        unseen: Optional function giving the probability of an unseen
+            n-gram following a key.
+        """
+        import shutil
+        import tempfile
+
+        f = self._file
+        key_format = _get_key_format(len(self._sections) + 1)
+        columns = [(_COUNT_, lambda k, c: c)]
+        if probability is not None:
+            columns.append((_PROBABILITY_, lambda k, c: probability(k)))
+        if unseen is not None:
+            columns.append((_PROBABILITY_, lambda k, c: unseen(k)))
+        buffers = [tempfile.TemporaryFile() for c in columns]
+
+        keys_offset = _align(f)
+        row_count = 0
+        for key, count in rows:
+            f.write(key_format.pack(*key))
+            for (column_format, get_value), buffer in zip(columns, buffers):
+                buffer.write(column_format.pack(get_value(key, count)))
+            row_count += 1
+
+        offsets = []
+        for buffer in buffers:
+            offsets.append(_align(f))
+            buffer.seek(0)
+            shutil.copyfileobj(buffer, f)
+            buffer.close()
+
+        counts_offset = offsets[0]
+        probabilities_offset = offsets[1] if probability is not None else 0
+        unseen_offset = offsets[-1] if unseen is not None else 0
+        self._sections.append((row_count, keys_offset, counts_offset,
+            probabilities_offset, unseen_offset))
+
+    def close(self, default=0., metadata=None):
+        """Writes the header and closes the file.
+
+        param
+        ----
+        default: Probability of an N-gram with unknown history.
+        metadata: Optional dictionary of JSON serializable values, see
+            MappedModel.get_metadata.
+        """
+        import json
+
+        if len(self._sections) != self._order:
+            raise ValueError("Tables of all the orders must be written")
+
+        f = self._file
+        metadata_data = json.dumps(metadata or {})
+        metadata_offset = _align(f)
+        f.write(metadata_data)
+
+        f.seek(0)
+        f.write(_HEADER_.pack(_MAGIC_, _VERSION_, self._order,
+            self._vocabulary_flags, self._vocabulary_size,
+            self._vocabulary_offset, self._vocabulary_length, default,
+            metadata_offset, len(metadata_data)))
+        for section in self._sections:
+            f.write(_SECTION_.pack(*section))
+        f.close()
+
+def write_model(path, language_model, distribution=None):
+    """Writes the counts of a model and optionally its probabilities.
+
+    param
+    ----
+    path: Path of the output file.
+    language_model: NGram with calculated counts.
+    distribution: Distribution built from the id keyed tables of
+        language_model (see NGram.get_ngrams_counts). If given, the
+        probability of each N-gram and the probability of an unseen
+        N-gram for each N-1 gram history are stored as well. For a
+        KatzBackoffDistribution or a KneserNeyDistribution, the
+        probabilities and backoff weights of all the orders are stored
+        instead.
+    """
+    if isinstance(distribution, (KatzBackoffDistribution,
+            KneserNeyDistribution)):
+        _write_backoff_model(path, language_model, distribution)
+        return
+
+    order = language_model.get_order()
+    writer = ModelWriter(path, order, language_model.get_vocabulary())
+
+    for n in range(1, order + 1):
+        counts = language_model.get_counts(n)
+        rows = ((k, counts[k]) for k in sorted(counts))
+
+        probability = None
+        unseen = None
+        if distribution is not None and n == order:
+            probability = distribution.get_probability
+        elif distribution is not None and n == order - 1:
+            unseen = distribution.get_unseen_probability
+        writer.write_section(rows, probability, unseen)
+
+    default = 0.
+    if distribution is not None:
+        default = distribution.get_unseen_probability(None)
+    writer.close(default)
+
+def _write_backoff_model(path, language_model, distribution):
+    """Writes the tables of a Katz or Kneser-Ney distribution.
+
+    The rows of an order are its counts and the keys of its
+    probabilities and backoff weights, which can be missing from the
+    counts, e.g. after pruning.
+    """
+    order = language_model.get_order()
+    writer = ModelWriter(path, order, language_model.get_vocabulary())
+
+    if isinstance(distribution, KatzBackoffDistribution):
+        weights = distribution._alphas
+        default = distribution._unknown_probability
+        metadata = {"scoring": "katz"}
+    else:
+        weights = distribution._gammas
+        default = distribution._uniform
+        # The weight of the empty history has no row.
+        metadata = {"scoring": "kneser_ney",
+                "empty_gamma": weights[0].get(())}
+
+    nan = float("nan")
+    for n in range(1, order + 1):
+        counts = language_model.get_counts(n)
+        probs = distribution._probs[n - 1]
+        # Histories of length n, they have no weight at the highest order.
+        history_weights = weights[n] if n < order else {}
+
+        keys = set(counts)
+        keys.update(probs)
+        keys.update(history_weights)
+        rows = ((k, counts.get(k, 0)) for k in sorted(keys))
+
+        unseen = None
+        if n < order:
+            unseen = lambda k: history_weights.get(k, nan)
+        writer.write_section(rows, lambda k: probs.get(k, nan), unseen)
+
+    writer.close(default, metadata)
+
+class MappedModel(object):
+    """Read only model backed by a memory-mapped model file.
+
+    It provides the frequency getters of NGram and get_probability of
+    the stored distribution. Lookups are binary searches over the sorted
+    key column, so nothing but the vocabulary is loaded in memory.
+    """
+
+    def __init__(self, path):
+        """Opens the model file.
+
+        param
+        ----
+        path: Path of a file written by write_model.
+        """
+        self._file = open(path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0,
+                access=mmap.ACCESS_READ)
+
+        (magic, version, order, vocabulary_flags, vocabulary_size,
+                vocabulary_offset, vocabulary_length, default, metadata_offset,
+                metadata_length) = _HEADER_.unpack_from(self._map, 0)
+        if magic != _MAGIC_:
+            raise ValueError("Not a model file: " + path)
+        if version != _VERSION_:
+            raise ValueError("Unsupported model file version: %d" % version)
+
+        self._window_size = order
+        self._default = default
+        self._metadata_range = (metadata_offset,
+                metadata_offset + metadata_length)
+        metadata = self.get_metadata()
+        self._scoring = metadata.get("scoring")
+        self._empty_gamma = metadata.get("empty_gamma")
+        self._sections = [_SECTION_.unpack_from(self._map,
+            _HEADER_.size + n * _SECTION_.size) for n in range(order)]
+        self._key_formats = [_get_key_format(n)
+                for n in range(1, order + 1)]
+
+        tokens = []
+        if vocabulary_size > 0:
+            tokens = self._map[vocabulary_offset :
+                    vocabulary_offset + vocabulary_length].split("\n")
+        self._vocabulary = Vocabulary(tokens)
+        if vocabulary_flags & _FROZEN_:
+            self._vocabulary.freeze(bool(vocabulary_flags & _NONTRIVIAL_))
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def get_order(self):
+        """Returns N."""
+        return self._window_size
+
+    def get_vocabulary(self):
+        return self._vocabulary
+
+    def get_metadata(self):
+        """Returns the dictionary given to ModelWriter.close."""
+        import json
+
+        start, end = self._metadata_range
+        return json.loads(self._map[start : end])
+
+    def _to_key(self, ngram):
+        if isinstance(ngram, tuple):
+            return ngram
+        return self._vocabulary.encode(ngram)
+
+    def _bisect(self, order, target, right=False):
+        """Returns the first row whose key prefix is >= target.
+
+        With right, the first row whose key prefix is > target. The
+        prefix compared is the first len(target) bytes of the key.
+        """
+        rows, keys_offset = self._sections[order - 1][:2]
+        row_size = 4 * order
+        size = len(target)
+        low, high = 0, rows
+        while low < high:
+            middle = (low + high) // 2
+            offset = keys_offset + middle * row_size
+            value = self._map[offset : offset + size]
+            if value < target or (right and value == target):
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _find(self, key):
+        """Returns the row of key in its order's table or -1."""
+        order = len(key)
+        if not 1 <= order <= self._window_size:
+            return -1
+
+        try:
+            target = self._key_formats[order - 1].pack(*key)
+        except struct.error:
+            # Negative or too large ids can not be in the table.
+            return -1
+
+        row = self._bisect(order, target)
+        rows, keys_offset = self._sections[order - 1][:2]
+        offset = keys_offset + row * len(target)
+        if row < rows and self._map[offset : offset + len(target)] == target:
+            return row
+        return -1
+
+    def get_successors(self, history):
+        """Returns the words stored after a history.
+
+        The keys are sorted, so the n-grams starting with history are
+        a contiguous range of rows found with two binary searches.
+
+        param
+        ----
+        history: Tuple of token ids, shorter than N.
+
+        return
+        ----
+        List of (token id, value) in key order, where value is the stored
+        probability or the count if the model has no probabilities for
+        that order.
+        """
+        order = len(history) + 1
+        if order > self._window_size:
+            return []
+
+        try:
+            target = _get_key_format(len(history)).pack(*history)
+        except struct.error:
+            return []
+
+        low = self._bisect(order, target)
+        high = self._bisect(order, target, right=True)
+        column, column_format = 2, _COUNT_
+        if self._sections[order - 1][3] != 0:
+            column, column_format = 3, _PROBABILITY_
+
+        keys_offset = self._sections[order - 1][1]
+        key_format = self._key_formats[order - 1]
+        successors = []
+        for row in xrange(low, high):
+            key = key_format.unpack_from(self._map,
+                    keys_offset + row * key_format.size)
+            value = self._get_column(order, column, row, column_format)
+            # Rows of a backoff model can have no probability.
+            if value == value:
+                successors.append((key[-1], value))
+        return successors
+
+    def _get_column(self, order, column, row, column_format):
+        offset = self._sections[order - 1][column]
+        return column_format.unpack_from(self._map,
+                offset + row * column_format.size)[0]
+
+    def get_frequency(self, ngram):
+        """Returns frequency count for n-gram of any order up to N."""
+        key = self._to_key(ngram)
+        if key is None:
+            return 0
+
+        row = self._find(key)
+        if row < 0:
+            return 0
+        return self._get_column(len(key), 2, row, _COUNT_)
+
+    def get_ngrams_frequency(self, ngram):
+        """Returns frequency count for n-gram"""
+        return self.get_frequency(ngram)
+
+    def get_subgrams_frequency(self, subgram):
+        """Returns frequency count for n-1 gram"""
+        return self.get_frequency(subgram)
+
+    def get_probability(self, ngram):
+        """Returns the stored probability of N-gram.
+
+        For an unseen N-gram the stored unseen probability of its
+        history is used, and the default probability if the history is
+        unknown as well. The probability of a backoff distribution is
+        found by the same walk over the orders as its get_probability.
+        """
+        order = self._window_size
+        if self._sections[order - 1][3] == 0:
+            raise ValueError("Model file does not contain probabilities")
+
+        if self._scoring is not None:
+            if not isinstance(ngram, tuple):
+                # Unknown tokens are scored as ids of no token.
+                get_id = self._vocabulary.get_id
+                ngram = tuple([-1 if i is None else i
+                    for i in map(get_id, ngram.split())])
+            if self._scoring == "katz":
+                return self._score_katz(ngram)
+            return self._score_kneser_ney(ngram)
+
+        key = self._to_key(ngram)
+        if key is not None and len(key) == order:
+            row = self._find(key)
+            if row >= 0:
+                return self._get_column(order, 3, row, _PROBABILITY_)
+
+            row = self._find(key[:-1])
+            if row >= 0:
+                return self._get_column(order - 1, 4, row, _PROBABILITY_)
+
+        return self._default
+
+    def get_log_probability(self, ngram):
+        return math.log(self.get_probability(ngram))
+
+    def _get_value(self, key, column):
+        """Returns a probability column of key, None if it is absent."""
+        row = self._find(key)
+        if row < 0:
+            return None
+        value = self._get_column(len(key), column, row, _PROBABILITY_)
+        if math.isnan(value):
+            return None
+        return value
+
+    def _score_katz(self, key):
+        """See KatzBackoffDistribution.get_probability."""
+        weight = 1.
+        for n in range(min(len(key), self._window_size), 1, -1):
+            gram = key[len(key) - n:]
+            p = self._get_value(gram, 3)
+            if p is not None:
+                return weight * p
+
+            alpha = self._get_value(gram[:-1], 4)
+            if alpha is not None:
+                weight *= alpha
+
+        p = self._get_value(key[-1:], 3)
+        return weight * (self._default if p is None else p)
+
+    def _score_kneser_ney(self, key):
+        """See KneserNeyDistribution.get_probability."""
+        p = self._default
+        for n in range(1, min(len(key), self._window_size) + 1):
+            gram = key[len(key) - n:]
+            if n == 1:
+                gamma = self._empty_gamma
+            else:
+                gamma = self._get_value(gram[:-1], 4)
+            if gamma is None:
+                # Longer histories are unseen as well.
+                break
+            p = (self._get_value(gram, 3) or 0.) + gamma * p
+
+        return p
+
+def load_model(path):
+    """Opens a model file, see MappedModel."""
+    return MappedModel(path)
@@ -0,0 +1,153 @@
+# Next word prediction.
+#
+# For every history of order 0..N-1, the K most likely next words are
+# computed once and stored with their probabilities. A prediction is a
+# dictionary lookup, or two binary searches in a model file, and backs
+# off to shorter histories when the full one was not seen in training.
+
+import heapq
+
+from evaluation import encode_sentence
+import modelfile
+from NGrams import NGram
+
+class _Predictor(object):
+    """Prediction over an index of successors by history.
+
+    Subclasses provide _get_successors.
+    """
+
+    def predict_ids(self, history, k=None):
+        """Returns the most likely next words after a history.
+
+        The last N-1 ids of history are looked up first, then shorter
+        suffixes of it until one was seen in training, down to the empty
+        history of the unigrams.
+
+        param
+        ----
+        history: Tuple of token ids, already padded with start markers.
+        k: Number of words to return, at most the K of the index.
+
+        return
+        ----
+        List of (token id, probability) with decreasing probability.
+        """
+        if k is None:
+            k = self._k
+
+        history = tuple(history[len(history) - (self._window_size - 1):])
+        for start in range(len(history) + 1):
+            successors = self._get_successors(history[start:])
+            if successors:
+                return successors[:k]
+        return []
+
+    def predict(self, context, k=None):
+        """Returns the most likely next words after some tokens.
+
+        param
+        ----
+        context: Preprocessed tokens of the sentence so far, separated
+            by space.
+        k: Number of words to return.
+
+        return
+        ----
+        List of (token, probability) with decreasing probability.
+        """
+        history = self._starters + tuple(
+                encode_sentence(context, self._vocabulary))
+
+        get_token = self._vocabulary.get_token
+        return [(get_token(i), p) for i, p in self.predict_ids(history, k)]
+
+class NextWordIndex(_Predictor):
+    """In memory top-K successors of each history of a model."""
+
+    def __init__(self, language_model, k=10, distribution=None):
+        """Builds the index.
+
+        The successors of an N-1 gram history are ranked by the
+        probability of the distribution if given, the others by the
+        maximum likelihood estimate of their order.
+
+        param
+        ----
+        language_model: NGram with calculated counts.
+        k: Number of successors to keep for each history.
+        distribution: Distribution built from the id keyed tables of
+            language_model.
+        """
+        self._vocabulary = language_model.get_vocabulary()
+        self._window_size = language_model.get_order()
+        self._k = k
+        start_id = self._vocabulary.get_id(NGram._START_MARKER_)
+        self._starters = (start_id,) * (self._window_size - 1)
+
+        self._successors = {}
+        self._frequencies = {}
+        for n in range(1, self._window_size + 1):
+            candidates = {}
+            totals = {}
+            counts = language_model.get_counts(n)
+            for key, f in counts.iteritems():
+                # Start markers are only counts of histories.
+                if key[-1] == start_id:
+                    continue
+                candidates.setdefault(key[:-1], []).append((f, key[-1]))
+                totals[key[:-1]] = totals.get(key[:-1], 0) + f
+
+            for history, items in candidates.iteritems():
+                if distribution is not None and n == self._window_size:
+                    scored = [(-distribution.get_probability(history + (w,)),
+                        w) for f, w in items]
+                else:
+                    total = float(totals[history])
+                    scored = [(-f / total, w) for f, w in items]
+                # Ties are ordered by id, like the keys of a model file.
+                successors = [(w, -p) for p, w in heapq.nsmallest(k, scored)]
+                self._successors[history] = successors
+                self._frequencies.update((history + (w,),
+                    counts[history + (w,)]) for w, p in successors)
+
+    def _get_successors(self, history):
+        return self._successors.get(history)
+
+    def save(self, path):
+        """Writes the index as a model file, see load_index."""
+        writer = modelfile.ModelWriter(path, self._window_size,
+                self._vocabulary)
+        for n in range(1, self._window_size + 1):
+            rows = {}
+            for history, successors in self._successors.iteritems():
+                if len(history) == n - 1:
+                    rows.update((history + (w,), p) for w, p in successors)
+
+            writer.write_section(((key, self._frequencies[key])
+                for key in sorted(rows)), probability=rows.get)
+        writer.close(metadata={"k": self._k})
+
+class MappedNextWordIndex(_Predictor):
+    """Next word index backed by a memory-mapped model file."""
+
+    def __init__(self, path):
+        """Opens an index written by NextWordIndex.save."""
+        self._model = modelfile.load_model(path)
+        self._vocabulary = self._model.get_vocabulary()
+        self._window_size = self._model.get_order()
+        self._k = self._model.get_metadata()["k"]
+        start_id = self._vocabulary.get_id(NGram._START_MARKER_)
+        self._starters = (start_id,) * (self._window_size - 1)
+
+    def close(self):
+        self._model.close()
+
+    def _get_successors(self, history):
+        successors = self._model.get_successors(history)
+        successors.sort(key=lambda item: item[1], reverse=True)
+        return successors
+
+def load_index(path):
+    """Opens a next word index file, see MappedNextWordIndex."""
+    return MappedNextWordIndex(path)
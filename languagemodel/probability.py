@@ -1,6 +1,232 @@
 # Probability Distributions for language models.
 
-class ProbabilityDistribution(object):
+def _get_history(ngram):
+    """Returns the (n-1) gram prefix of given n-gram.
+
+    The n-gram can either be a space separated string or a tuple of
+    token ids (see NGram.get_ngrams_counts). The prefix is returned
+    in the same form.
+    """
+    if isinstance(ngram, tuple):
+        return ngram[:-1]
+    return " ".join(ngram.split()[:-1])
+
+def _as_id_array(batch):
+    """Converts a batch of n-grams to a 2-D array of token ids."""
+    import numpy as np
+
+    ids = np.asarray(batch, dtype=np.int64)
+    if ids.ndim != 2:
+        raise ValueError("Batch must be a 2-D array of token ids")
+    return ids
+
+def _pack_keys(ids, base):
+    """Returns the rows of a 2-D array of token ids as sortable keys.
+
+    If base ** order fits in 63 bits, a row is packed into a 64 bit
+    integer whose digits in base are the ids. Otherwise, it is kept as
+    the bytes of its ids as big-endian 32 bit integers, which numpy
+    sorts and compares like the rows of ids.
+    """
+    import numpy as np
+
+    order = ids.shape[1]
+    if base ** order < 2 ** 63:
+        packed = np.zeros(len(ids), dtype=np.int64)
+        for column in range(order):
+            packed = packed * base + ids[:, column]
+        return packed
+
+    rows = np.ascontiguousarray(ids, dtype=">u4")
+    return rows.view("V%d" % (4 * order)).reshape(len(ids))
+
+def _unpack_keys(packed, base, order):
+    """Returns the 2-D array of token ids of keys, see _pack_keys."""
+    import numpy as np
+
+    if packed.dtype.kind == "V":
+        return packed.view(">u4").reshape(len(packed), order).astype(
+                np.int64)
+
+    columns = []
+    for column in range(order):
+        packed, ids = np.divmod(packed, base)
+        columns.append(ids)
+    return np.column_stack(columns[::-1]).reshape(-1, order)
+
+def _find_keys(keys, ids, base):
+    """Finds the rows of ids in non-empty sorted keys of _pack_keys.
+
+    return
+    ----
+    Boolean array telling which rows were found and the positions of
+    the rows in keys (of a neighbour for the missing ones).
+    """
+    import numpy as np
+
+    # Ids outside of the table can not be packed, they are looked up
+    # as 0 and reported as missing.
+    valid = ((ids >= 0) & (ids < base)).all(axis=1)
+    packed = _pack_keys(np.where(valid[:, None], ids, 0), base)
+
+    positions = np.searchsorted(keys, packed)
+    positions = np.minimum(positions, len(keys) - 1)
+    return valid & (keys[positions] == packed), positions
+
+class KeyIndex(object):
+    """Sorted array index over a table keyed by tuples of token ids.
+
+    Each key is packed into a single 64 bit integer (the ids are the
+    digits in base of the largest id + 1), so a whole batch of n-grams
+    can be looked up with a single numpy.searchsorted. Keys which do not
+    fit in 64 bits are compared as rows of ids instead, see _pack_keys.
+    """
+
+    def __init__(self, table):
+        """Builds the index.
+        param
+        ----
+        table: Dictionary from tuples of token ids of the same length
+            to numbers, e.g. NGram.get_ngrams_counts.
+        """
+        import numpy as np
+
+        if any(not isinstance(k, tuple) for k in table):
+            raise ValueError("Index requires tables keyed by token ids")
+
+        self._table = table
+        keys = np.array(table.keys(), dtype=np.int64)
+        values = np.array(table.values(), dtype=np.float64)
+
+        self._packed = None
+        if len(keys) == 0:
+            self._order = 0
+            return
+
+        self._base = int(keys.max()) + 1
+        self._order = keys.shape[1]
+
+        packed = _pack_keys(keys, self._base)
+        order = np.argsort(packed)
+        self._packed = packed[order]
+        self._values = values[order]
+
+    def update(self, changes):
+        """Sets the values of some keys, inserting the new ones.
+
+        The table given when building must already hold the changes.
+
+        param
+        ----
+        changes: Dictionary from keys to their new values.
+
+        return
+        ----
+        False if the index could not be patched and must be rebuilt.
+        """
+        import numpy as np
+
+        if not changes:
+            return True
+        if self._packed is None:
+            return False
+
+        keys = np.array(changes.keys(), dtype=np.int64)
+        values = np.array(changes.values(), dtype=np.float64)
+        if keys.ndim != 2 or keys.shape[1] != self._order or \
+                keys.min() < 0:
+            return False
+
+        base = int(keys.max()) + 1
+        if base > self._base:
+            # New tokens, the keys are packed again with a larger base.
+            self._packed = _pack_keys(_unpack_keys(self._packed,
+                self._base, self._order), base)
+            self._base = base
+
+        packed = _pack_keys(keys, self._base)
+        positions = np.searchsorted(self._packed, packed)
+        found = positions < len(self._packed)
+        found[found] = self._packed[positions[found]] == packed[found]
+        self._values[positions[found]] = values[found]
+
+        new = ~found
+        if new.any():
+            order = np.argsort(packed[new])
+            new_packed = packed[new][order]
+            at = np.searchsorted(self._packed, new_packed)
+            self._packed = np.insert(self._packed, at, new_packed)
+            self._values = np.insert(self._values, at, values[new][order])
+        return True
+
+    def lookup(self, ids):
+        """Looks up a batch of keys.
+
+        param
+        ----
+        ids: 2-D array of token ids, one key per row.
+
+        return
+        ----
+        Boolean array telling which keys were found and an array with
+        their values (0 for the missing ones).
+        """
+        import numpy as np
+
+        if self._packed is None or ids.shape[1] != self._order:
+            values = np.array([self._table.get(tuple(k), np.nan)
+                for k in ids.tolist()], dtype=np.float64)
+            found = ~np.isnan(values)
+            values[~found] = 0
+            return found, values
+
+        found, positions = _find_keys(self._packed, ids, self._base)
+        return found, np.where(found, self._values[positions], 0.)
+
+class _BatchScoring(object):
+    """Vectorized scoring of n-grams given as arrays of token ids.
+
+    It requires the distribution to be built from id keyed tables,
+    see NGram.get_ngrams_counts. Subclasses provide the index of seen
+    n-grams and the probabilities of unseen ones.
+    """
+
+    def get_probabilities(self, batch):
+        """Returns the probabilities of a batch of n-grams.
+
+        param
+        ----
+        batch: 2-D array-like of token ids, one n-gram per row.
+
+        return
+        ----
+        numpy array of probabilities.
+        """
+        ids = _as_id_array(batch)
+        if self._index is None:
+            self._index = self._build_index()
+
+        found, probs = self._index.lookup(ids)
+        probs[found] = self._get_seen_probabilities(probs[found])
+        missing = ~found
+        if missing.any():
+            probs[missing] = self._get_unseen_probabilities(
+                    ids[missing, :-1])
+
+        return probs
+
+    def _get_seen_probabilities(self, values):
+        # The index holds the probabilities themselves by default.
+        return values
+
+    def get_log_probabilities(self, batch):
+        """Returns the natural log of the probabilities of a batch."""
+        import numpy as np
+
+        with np.errstate(divide="ignore"):
+            return np.log(self.get_probabilities(batch))
+
+class ProbabilityDistribution(_BatchScoring):
     """Base unsmoothed probability distribution class.
 
     This class builds unsmoothed probability distribution from
@@ -18,6 +244,13 @@ class ProbabilityDistribution(object):
         """
         self._vocabulary_count = vocabulary
         self._probability_distribution = {}
+        self._ngram = {}
+        self._subgram = {}
+        self._dirty_histories = set()
+        self._dirty_index = None
+        self._successors = None
+        self._new_ngrams = set()
+        self._index = None
 
     def build_probability(self, ngram, subgram):
         """Builds probability distribution for given ngrams.
@@ -35,29 +268,149 @@ class ProbabilityDistribution(object):
         --- see Ngrams.py for more details.
         """
 
+        self._ngram = ngram
+        self._subgram = subgram
         for k, f in ngram.iteritems():
             # Get (n-1) grams with common prefix.
-            sub_gram = " ".join(k.split()[:-1])
+            sub_gram = _get_history(k)
             sub_gram_f = subgram[sub_gram]
 
             self._probability_distribution[k] = float(f)/sub_gram_f
 
+        self._reset_updates()
+
+    def _reset_updates(self):
+        self._dirty_histories = set()
+        self._dirty_index = None
+        self._successors = None
+        self._new_ngrams = set()
+        self._index = None
+
     def get_probability(self, ngram):
         """Returns of the probability.
 
         param
         ----
         ngram: To determine the conditional probability of P(V|U), the ngram
-        should be string containing 'U V'.
+        should be string containing 'U V' or the equivalent tuple of
+        token ids if the distribution was built from id keyed tables.
 
         return
         ----
         Returns the probability.
         """
+        if self._dirty_histories:
+            history = _get_history(ngram)
+            if history in self._dirty_histories:
+                return self._compute_probability(ngram, history)
+
         if self._probability_distribution.has_key(ngram):
             return self._probability_distribution[ngram]
         else:
-            return 0
+            return self.get_unseen_probability(_get_history(ngram))
+
+    def _compute_probability(self, ngram, history):
+        """Returns the probability from the current counts."""
+        f = self._ngram.get(ngram)
+        if f is None:
+            return self.get_unseen_probability(history)
+        return float(f)/self._subgram[history]
+
+    def get_unseen_probability(self, history):
+        """Returns the probability of an n-gram not seen in training.
+
+        param
+        ----
+        history: The (n-1) gram prefix of the n-gram, None if the prefix
+        itself is unknown.
+        """
+        return 0
+
+    def update(self, ngram_delta, vocabulary=None):
+        """Takes into account counts added to the tables.
+
+        The count tables given to build_probability must already contain
+        the new counts, e.g. after NGram.update. The histories of the
+        changed n-grams are marked and their probabilities are computed
+        from the counts until refresh is called.
+
+        param
+        ----
+        ngram_delta: Dictionary of the changed n-grams, e.g. the n-gram
+        counts of the model returned by NGram.update.
+        vocabulary: The new size of vocabulary, if the update added
+        tokens.
+        """
+        successors = self._get_successors()
+        probability_distribution = self._probability_distribution
+        new_ngrams = self._new_ngrams
+        for k in ngram_delta:
+            history = _get_history(k)
+            self._dirty_histories.add(history)
+            if k not in probability_distribution and k not in new_ngrams:
+                new_ngrams.add(k)
+                successors.setdefault(history, []).append(k)
+
+        if vocabulary is not None:
+            self._vocabulary_count = vocabulary
+        self._dirty_index = None
+
+    def _get_successors(self):
+        """Returns the index from histories to their n-grams.
+
+        It is built on the first update and kept up to date after, so
+        that refresh only visits the n-grams of the changed histories.
+        """
+        if self._successors is None:
+            successors = {}
+            for k in self._probability_distribution:
+                successors.setdefault(_get_history(k), []).append(k)
+            self._successors = successors
+        return self._successors
+
+    def refresh(self):
+        """Stores the probabilities of the changed histories."""
+        dirty_histories = self._dirty_histories
+        if not dirty_histories:
+            return
+
+        successors = self._get_successors()
+        changes = {}
+        for history in dirty_histories:
+            for k in successors.get(history, ()):
+                changes[k] = self._compute_probability(k, history)
+        self._probability_distribution.update(changes)
+
+        # The index is patched rather than built again.
+        if self._index is not None and not self._index.update(changes):
+            self._index = None
+        self._dirty_histories = set()
+        self._dirty_index = None
+        self._new_ngrams = set()
+
+    def get_probabilities(self, batch):
+        probs = super(ProbabilityDistribution, self).get_probabilities(batch)
+        if not self._dirty_histories:
+            return probs
+
+        # Rows with a changed history are scored from the counts.
+        ids = _as_id_array(batch)
+        if self._dirty_index is None:
+            self._dirty_index = KeyIndex(
+                    dict.fromkeys(self._dirty_histories, 1))
+        dirty = self._dirty_index.lookup(ids[:, :-1])[0]
+        for row in dirty.nonzero()[0]:
+            key = tuple(ids[row].tolist())
+            probs[row] = self._compute_probability(key, key[:-1])
+
+        return probs
+
+    def _build_index(self):
+        return KeyIndex(self._probability_distribution)
+
+    def _get_unseen_probabilities(self, histories):
+        import numpy as np
+        return np.zeros(len(histories))
 
 class LaplaceSmoothedDistribution(ProbabilityDistribution):
     """Probability distribution with Laplace Smoothing.
@@ -78,168 +431,575 @@ class LaplaceSmoothedDistribution(ProbabilityDistribution):
         super(LaplaceSmoothedDistribution, self).__init__(vocabulary)
 
     def build_probability(self, ngram, subgram):
+        self._ngram = ngram
         self._subgram = subgram
         for k, f in ngram.iteritems():
             # Get (n-1) grams with common prefix.
-            sub_gram = " ".join(k.split()[:-1])
+            sub_gram = _get_history(k)
             sub_gram_f = subgram[sub_gram]
 
             prob = float(f + 1)/(sub_gram_f + self._vocabulary_count)
 
             self._probability_distribution[k] = prob
 
-    def get_probability(self, ngram):
-        """Returns of the probability.
+        self._reset_updates()
+        self._history_index = None
 
-        param
-        ----
-        ngram: To determine the conditional probability of P(V|U), the ngram
-        should be string containing 'U V'.
+    def _compute_probability(self, ngram, history):
+        """Returns the probability from the current counts."""
+        sub_gram_f = self._subgram.get(history, 0)
+        f = self._ngram.get(ngram, 0)
+        return float(f + 1)/(sub_gram_f + self._vocabulary_count)
 
-        return
+    def get_unseen_probability(self, history):
+        """Returns the probability of an n-gram not seen in training.
+
+        param
         ----
-        Returns the probability.
+        history: The (n-1) gram prefix of the n-gram, None if the prefix
+        itself is unknown.
         """
-        if self._probability_distribution.has_key(ngram):
-            return self._probability_distribution[ngram]
+        if self._subgram.has_key(history):
+            sub_gram_f = self._subgram[history]
         else:
-            # Get (n-1) grams with common prefix.
-            sub_gram = " ".join(ngram.split()[:-1])
+            # This should not happen. And, allowing probability
+            # for sub-grams which did not appear in training set
+            # might resulting in total Probability being greater
+            # than 1.0. For example, for bigrams, the vocabulary
+            # size should equal to the number of unigrams, but
+            # we are allowing 1/V probability for tokens which
+            # are not in vocabulary.
+            sub_gram_f = 0
+
+        prob = 1.0 / (sub_gram_f + self._vocabulary_count)
+
+        return prob
+
+    def update(self, ngram_delta, vocabulary=None):
+        changed = vocabulary is not None and \
+                vocabulary != self._vocabulary_count
+        super(LaplaceSmoothedDistribution, self).update(ngram_delta,
+                vocabulary)
+        if changed:
+            # Every probability depends on the size of vocabulary.
+            self._dirty_histories.update(self._get_successors())
+
+    def refresh(self):
+        dirty_histories = self._dirty_histories
+        super(LaplaceSmoothedDistribution, self).refresh()
+
+        if self._history_index is not None:
+            changes = dict((h, self._subgram[h]) for h in dirty_histories
+                    if h in self._subgram)
+            if not self._history_index.update(changes):
+                self._history_index = None
+
+    def _get_unseen_probabilities(self, histories):
+        # Denominators of all the histories are precomputed in the
+        # index, an unknown history has a count of 0.
+        if self._history_index is None:
+            self._history_index = KeyIndex(self._subgram)
+
+        found, counts = self._history_index.lookup(histories)
+        return 1.0 / (counts + self._vocabulary_count)
+
+class GoodTuringDistribution(_BatchScoring):
+    """Simple Good-Turing smoothed distribution.
+
+    The smoothed probability of an n-gram depends only on its count r,
+    so instead of storing a probability per n-gram, it keeps a reference
+    to the count table and a table from r to probability. The fit is
+    done with numpy over the frequency of frequency arrays and is
+    skipped when the frequency of frequency has not changed since the
+    previous fit.
+    """
 
-            if self._subgram.has_key(sub_gram):
-                sub_gram_f = self._subgram[sub_gram]
-            else:
-                # This should not happen. And, allowing probability
-                # for sub-grams which did not appear in training set
-                # might resulting in total Probability being greater
-                # than 1.0. For example, for bigrams, the vocabulary
-                # size should equal to the number of unigrams, but
-                # we are allowing 1/V probability for tokens which
-                # are not in vocabulary.
-                sub_gram_f = 0
+    def __init__(self):
+        self._pzero = 0
+        self._ngrams = {}
+        self._prob_by_count = {}
+        self._fitted_signature = None
+        self._frequency_count = {}
+        self._stale = False
+        self._changed_ngrams = set()
+        self._index = None
 
-            prob = 1.0 / (sub_gram_f + self._vocabulary_count)
+    def build_probability(self, ngrams):
+        import numpy as np
 
-            return prob
+        self._ngrams = ngrams
+        self._changed_ngrams = set()
+        self._index = None
 
-import math
-class GoodTuringDistribution(object):
+        r, n_r = GoodTuringDistribution._get_frequency_count(ngrams)
+        self._frequency_count = dict(zip(r.tolist(), n_r.tolist()))
+        self._fit(r, n_r)
 
-    def __init__(self):
-        self._pzero = 0
-        self._prob_values = {}
+    def update(self, ngram_delta):
+        """Takes into account counts added to the n-gram table.
 
-    def build_probability(self, ngrams):
-        frequency_of_frequency, total_count = \
-                GoodTuringDistribution._get_frequency_count(ngrams)
+        The table given to build_probability must already contain the
+        new counts, e.g. after NGram.update. Only the frequency of
+        frequency of the changed counts is adjusted, and the fit is
+        redone from it on the next lookup. The batch index is patched
+        with the changed counts at the same time.
+
+        param
+        ----
+        ngram_delta: Dictionary from the changed n-grams to their added
+        counts, e.g. the n-gram counts of the model returned by
+        NGram.update.
+        """
+        frequency_count = self._frequency_count
+        for k, added in ngram_delta.iteritems():
+            new = self._ngrams[k]
+            old = new - added
+            if old > 0:
+                frequency_count[old] -= 1
+                if frequency_count[old] == 0:
+                    del frequency_count[old]
+            frequency_count[new] = frequency_count.get(new, 0) + 1
+
+        self._changed_ngrams.update(ngram_delta)
+        self._stale = True
+
+    def refresh(self):
+        """Redoes the fit if the counts changed since the last one."""
+        import numpy as np
 
-        self._pzero = float(frequency_of_frequency[1])/total_count
+        if not self._stale:
+            return
 
-        z_vals = GoodTuringDistribution._get_z_values(frequency_of_frequency)
-        alpha, beta = GoodTuringDistribution._perform_linear_regression(
-                z_vals)
-        r_star = GoodTuringDistribution._get_r_star_values(
-                frequency_of_frequency, alpha, beta)
+        if self._index is not None:
+            # The index holds the counts of the n-grams.
+            ngrams = self._ngrams
+            changes = dict((k, ngrams[k]) for k in self._changed_ngrams)
+            if not self._index.update(changes):
+                self._index = None
+        self._changed_ngrams = set()
+
+        r = np.array(sorted(self._frequency_count), dtype=np.int64)
+        n_r = np.array([self._frequency_count[c] for c in r.tolist()],
+                dtype=np.int64)
+        self._fit(r, n_r)
 
-        self._set_probability(r_star, frequency_of_frequency, ngrams)
+    def _fit(self, r, n_r):
+        import numpy as np
+
+        self._stale = False
+        signature = (tuple(r), tuple(n_r))
+        if signature == self._fitted_signature:
+            return
+
+        total_count = np.dot(r, n_r)
+        self._pzero = float(n_r[0]) / total_count if r[0] == 1 else 0.
+
+        z_vals = GoodTuringDistribution._get_z_values(r, n_r)
+        alpha, beta = GoodTuringDistribution._perform_linear_regression(
+                r, z_vals)
+        r_star = GoodTuringDistribution._get_r_star_values(r, n_r,
+                alpha, beta)
 
+        self._set_probability(r, n_r, r_star)
+        self._fitted_signature = signature
 
     @staticmethod
     def _get_frequency_count(ngrams):
-        frequency_of_frequency = {}
-        total_count = 0
-        for count in ngrams.itervalues():
-            if not frequency_of_frequency.has_key(count):
-                frequency_of_frequency[count] = 0
-
-            frequency_of_frequency[count] += 1
-            total_count += count
+        """Returns the sorted counts r and their frequencies N_r."""
+        import numpy as np
 
-        return frequency_of_frequency, total_count
+        counts = np.fromiter(ngrams.itervalues(), dtype=np.int64,
+                count=len(ngrams))
+        return np.unique(counts, return_counts=True)
 
     @staticmethod
-    def _get_z_values(frequency_of_frequency):
-        z_vals = {}
-        sorted_r = sorted(frequency_of_frequency.keys())
-        for index, n_r in enumerate(sorted_r):
-            if index == 0:
-                q = 0
-            else:
-                q = sorted_r[index - 1]
-            if index == len(sorted_r) - 1:
-                t = 2 * n_r - q
-            else:
-                t = sorted_r[index + 1]
-
-            z_vals[n_r] = 2. * frequency_of_frequency[n_r]/(t - q)
-
-        return z_vals
+    def _get_z_values(r, n_r):
+        import numpy as np
+
+        # q and t are the previous and next non-zero r.
+        q = np.concatenate(([0], r[:-1]))
+        t = np.concatenate((r[1:], [2 * r[-1] - q[-1]]))
+
+        return 2. * n_r / (t - q)
 
     @staticmethod
-    def _perform_linear_regression(z_vals):
+    def _perform_linear_regression(r, z_vals):
         import numpy as np
-        x_vals = np.log(z_vals.keys())
-        y_vals = np.log(z_vals.values())
+        x_vals = np.log(r)
+        y_vals = np.log(z_vals)
 
         # Convert to coefficient matrix
         coeff_matrix = np.vstack([x_vals, np.ones(len(x_vals))]).T
-        m, c = np.linalg.lstsq(coeff_matrix, y_vals)[0]
+        m, c = np.linalg.lstsq(coeff_matrix, y_vals, rcond=-1)[0]
 
         return m, c
 
     @staticmethod
     def _get_smoothed_value(val, alpha, beta):
-        return math.exp(alpha * math.log(val) + beta)
+        import numpy as np
+        return np.exp(alpha * np.log(val) + beta)
 
     @staticmethod
-    def _get_r_star_values(frequency_of_frequency, alpha, beta,
-            confid_factor=1.96):
-
-        r_star = {}
-        sorted_r = sorted(frequency_of_frequency.keys())
-
-        is_using_turing_estimate = True
-
-        for r in sorted_r:
-            smoothed_r = GoodTuringDistribution._get_smoothed_value(r,
-                    alpha, beta)
-            smoothed_r_1 = GoodTuringDistribution._get_smoothed_value(r + 1,
-                    alpha, beta)
-            y = (r + 1) * smoothed_r_1 / smoothed_r
-            if r + 1 not in sorted_r:
-                is_using_turing_estimate = False
-
-            if is_using_turing_estimate:
-                val_n_r = frequency_of_frequency[r]
-                val_n_r_1 = frequency_of_frequency[r + 1]
-                x = float(r + 1) * val_n_r_1 / val_n_r
-
-                confid_1 = float(val_n_r) / (val_n_r_1**2) * \
-                        (1. + float(val_n_r_1) / val_n_r)
-                t = confid_factor * math.sqrt(((r + 1)**2) * confid_1)
-
-                if math.fabs(x - y) <= t:
-                    is_using_turing_estimate = False
-                    r_star[r] = y
-                else:
-                    r_star[r] = x
-            else:
-                r_star[r] = y
+    def _get_r_star_values(r, n_r, alpha, beta, confid_factor=1.96):
+        import numpy as np
+
+        y = (r + 1) * GoodTuringDistribution._get_smoothed_value(r + 1,
+                alpha, beta) / GoodTuringDistribution._get_smoothed_value(r,
+                        alpha, beta)
+
+        # Turing estimates, defined only where N_(r+1) is non-zero.
+        has_next = np.concatenate((r[1:] == r[:-1] + 1, [False]))
+        n_r_1 = np.concatenate((n_r[1:], [0])).astype(np.float64)
+        n_r_1[~has_next] = np.nan
 
-        return r_star
+        x = (r + 1) * n_r_1 / n_r
+        confid_1 = n_r / (n_r_1 ** 2) * (1. + n_r_1 / n_r)
+        t = confid_factor * np.sqrt(((r + 1) ** 2) * confid_1)
 
-    def _set_probability(self, r_star, frequency_of_frequency, ngrams):
-        total_val = 0
-        for r, r_s in r_star.iteritems():
-            total_val += frequency_of_frequency[r] * r_s
+        # Turing estimates are used until N_(r+1) is zero or the two
+        # estimates are close, smoothed ones from there onwards.
+        with np.errstate(invalid="ignore"):
+            switch = ~has_next | (np.abs(x - y) <= t)
+        first_smoothed = np.argmax(switch)
 
-        for ngram, count in ngrams.iteritems():
-            self._prob_values[ngram] = (1 - self._pzero) * \
-                    float(r_star[count]) / total_val
+        return np.where(np.arange(len(r)) < first_smoothed, x, y)
+
+    def _set_probability(self, r, n_r, r_star):
+        import numpy as np
+
+        total_val = np.dot(n_r, r_star)
+        probs = (1 - self._pzero) * r_star / total_val
+
+        self._prob_by_count = dict(zip(r.tolist(), probs.tolist()))
+        self._count_array = r
+        self._prob_array = probs
 
     def get_probability(self, ngram):
-        if self._prob_values.has_key(ngram):
-            return self._prob_values[ngram]
-        else:
+        self.refresh()
+        count = self._ngrams.get(ngram)
+        if count is None:
             return self._pzero
+        else:
+            return self._prob_by_count[count]
+
+    def get_unseen_probability(self, history):
+        """Returns the probability of an n-gram not seen in training."""
+        self.refresh()
+        return self._pzero
+
+    def get_probabilities(self, batch):
+        self.refresh()
+        return super(GoodTuringDistribution, self).get_probabilities(batch)
+
+    def _build_index(self):
+        return KeyIndex(self._ngrams)
+
+    def _get_seen_probabilities(self, counts):
+        import numpy as np
+        return self._prob_array[np.searchsorted(self._count_array, counts)]
+
+    def _get_unseen_probabilities(self, histories):
+        import numpy as np
+        return np.repeat(float(self._pzero), len(histories))
+
+def _as_key(ngram):
+    """Returns n-gram as a tuple, splitting space separated strings."""
+    if isinstance(ngram, tuple):
+        return ngram
+    return tuple(ngram.split())
+
+def _as_tables(counts, start=None):
+    """Converts count tables of orders 1..N to tables keyed by tuples.
+
+    N-grams ending with the start marker are left out, they are only
+    counts of histories (see NGram._count_lines).
+    """
+    tables = []
+    for table in counts:
+        if any(not isinstance(k, tuple) for k in table):
+            table = dict((_as_key(k), f) for k, f in table.iteritems())
+        if start is not None:
+            table = dict((k, f) for k, f in table.iteritems()
+                    if k[-1] != start)
+        tables.append(table)
+    return tables
+
+def _get_history_totals(table):
+    """Returns the total count and number of continuations of histories."""
+    totals = {}
+    types = {}
+    for k, f in table.iteritems():
+        h = k[:-1]
+        totals[h] = totals.get(h, 0) + f
+        types[h] = types.get(h, 0) + 1
+    return totals, types
+
+def _get_history_counts(totals, lower_table):
+    """Returns the counts of histories from the table of their order.
+
+    After pruning (see pruning.py), the successors of a history add up
+    to less than its count. Using the count keeps the probabilities of
+    the kept n-grams and leaves the mass of the pruned ones to the
+    lower order.
+    """
+    counts = dict(totals)
+    for h, total in totals.iteritems():
+        count = lower_table.get(h, 0)
+        if count > total:
+            counts[h] = count
+    return counts
+
+class _BackoffScoring(_BatchScoring):
+    """Batch scoring for distributions which combine several orders.
+
+    The probability of an n-gram is found by a walk over at most N
+    tables, so the batch is scored row by row, but without any string
+    work.
+    """
+
+    def get_probabilities(self, batch):
+        import numpy as np
 
+        ids = _as_id_array(batch)
+        score = self._score
+        return np.array([score(k) for k in map(tuple, ids.tolist())],
+                dtype=np.float64)
+
+    def get_probability(self, ngram):
+        """Returns P(w | history) for the n-gram 'history w'.
+
+        param
+        ----
+        ngram: Tuple of token ids or a space separated string if the
+        distribution was built from string keyed tables.
+        """
+        return self._score(_as_key(ngram))
+
+class KatzBackoffDistribution(_BackoffScoring):
+    """Katz backoff distribution over n-grams of orders 1..N.
+
+    Counts up to k are discounted with Good-Turing discounts of their
+    order. The mass left by the discount of a history is given to the
+    n-grams unseen after it, in proportion to the backoff distribution
+    of the shorter history. The discounted probabilities and the backoff
+    weight of every history are computed when building, so scoring looks
+    up at most two entries per order.
+    """
+
+    def __init__(self, vocabulary=None, k=5):
+        """Initiates the class.
+        param
+        ----
+        vocabulary: The size of vocabulary, including unknown words.
+            Defaults to the number of unigrams plus one.
+        k: Counts above k are not discounted.
+        """
+        self._vocabulary_count = vocabulary
+        self._k = k
+        self._probs = []
+        self._alphas = []
+        self._unknown_probability = 0.
+        self._index = None
+
+    def _get_discounts(self, table):
+        """Returns the Good-Turing discount ratios d_r for r <= k."""
+        k = self._k
+        frequency_of_frequency = {}
+        for f in table.itervalues():
+            if f <= k + 1:
+                frequency_of_frequency[f] = \
+                        frequency_of_frequency.get(f, 0) + 1
+
+        n_1 = frequency_of_frequency.get(1, 0)
+        n_k_1 = frequency_of_frequency.get(k + 1, 0)
+        if n_1 == 0:
+            return {}
+        common = float(k + 1) * n_k_1 / n_1
+
+        discounts = {}
+        for r in range(1, k + 1):
+            n_r = frequency_of_frequency.get(r, 0)
+            n_r_1 = frequency_of_frequency.get(r + 1, 0)
+            if n_r == 0 or common >= 1:
+                continue
+
+            r_star = float(r + 1) * n_r_1 / n_r
+            d = (r_star / r - common) / (1 - common)
+            # Discounts are used only when they are valid ratios.
+            if 0 < d <= 1:
+                discounts[r] = d
+
+        return discounts
+
+    def build_probability(self, counts, start=None):
+        """Builds probability distribution from counts of all orders.
+
+        params
+        ----
+        counts: List of count tables of order 1 to N, e.g.
+        [model.get_counts(n) for n in range(1, N + 1)] for an NGram.
+        start: Key of the start marker, i.e. its id for id keyed tables.
+        The n-grams ending with it are not given any probability.
+        """
+        tables = _as_tables(counts, start)
+        history_tables = _as_tables(counts)
+        self._probs = []
+        self._alphas = []
+        self._index = None
+
+        # Unigrams, the left over mass is given to unknown words.
+        unigrams = tables[0]
+        discounts = self._get_discounts(unigrams)
+        total = float(sum(unigrams.itervalues()))
+        probs = dict((k, discounts.get(f, 1.) * f / total)
+                for k, f in unigrams.iteritems())
+
+        vocabulary = self._vocabulary_count or len(unigrams) + 1
+        unknown_words = max(vocabulary - len(unigrams), 1)
+        left_over = max(1. - sum(probs.itervalues()), 0.)
+        self._unknown_probability = left_over / unknown_words
+
+        self._probs.append(probs)
+        self._alphas.append({})
+
+        for table, lower_table in zip(tables[1:], history_tables):
+            discounts = self._get_discounts(table)
+            totals = _get_history_counts(_get_history_totals(table)[0],
+                    lower_table)
+
+            probs = {}
+            seen_mass = {}
+            lower_mass = {}
+            for k, f in table.iteritems():
+                h = k[:-1]
+                p = discounts.get(f, 1.) * f / totals[h]
+                probs[k] = p
+                seen_mass[h] = seen_mass.get(h, 0.) + p
+                lower_mass[h] = lower_mass.get(h, 0.) + \
+                        self._score(k[1:])
+
+            alphas = {}
+            for h, mass in seen_mass.iteritems():
+                if lower_mass[h] < 1:
+                    alphas[h] = max(1. - mass, 0.) / (1. - lower_mass[h])
+                else:
+                    alphas[h] = 0.
+
+            self._probs.append(probs)
+            self._alphas.append(alphas)
+
+    def _score(self, key):
+        weight = 1.
+        for n in range(min(len(key), len(self._probs)), 1, -1):
+            gram = key[len(key) - n:]
+            p = self._probs[n - 1].get(gram)
+            if p is not None:
+                return weight * p
+
+            # An unseen history leaves all the mass to the lower order.
+            weight *= self._alphas[n - 1].get(gram[:-1], 1.)
+
+        return weight * self._probs[0].get(key[-1:],
+                self._unknown_probability)
+
+class KneserNeyDistribution(_BackoffScoring):
+    """Interpolated Kneser-Ney distribution over n-grams of orders 1..N.
+
+    The highest order uses the counts and the lower orders use the
+    continuation counts --- the number of distinct words seen before the
+    n-gram. Each order subtracts an absolute discount D from its counts
+    and gives D times the number of continuations of a history to the
+    lower order. The discounted probabilities and the interpolation
+    weight of every history are computed when building, so scoring
+    looks up at most two entries per order.
+    """
+
+    def __init__(self, vocabulary=None, discount=None):
+        """Initiates the class.
+        param
+        ----
+        vocabulary: The size of vocabulary, the lowest order interpolates
+            with the uniform distribution over it. Defaults to the
+            number of unigrams.
+        discount: Discount D for all orders. By default, it is
+            n_1 / (n_1 + 2 n_2) for each order, where n_r is the number
+            of n-grams with count r.
+        """
+        self._vocabulary_count = vocabulary
+        self._discount = discount
+        self._probs = []
+        self._gammas = []
+        self._uniform = 0.
+        self._index = None
+
+    def _get_discount(self, table):
+        if self._discount is not None:
+            return self._discount
+
+        n_1 = 0
+        n_2 = 0
+        for f in table.itervalues():
+            if f == 1:
+                n_1 += 1
+            elif f == 2:
+                n_2 += 1
+
+        if n_1 == 0 or n_2 == 0:
+            return 0.5
+        return float(n_1) / (n_1 + 2 * n_2)
+
+    def build_probability(self, counts, start=None):
+        """Builds probability distribution from counts of all orders.
+
+        params
+        ----
+        counts: List of count tables of order 1 to N, e.g.
+        [model.get_counts(n) for n in range(1, N + 1)] for an NGram.
+        start: Key of the start marker, i.e. its id for id keyed tables.
+        The n-grams ending with it are not given any probability.
+        """
+        tables = _as_tables(counts, start)
+        self._probs = []
+        self._gammas = []
+        self._index = None
+
+        # Continuation counts for all the orders but the highest.
+        adjusted = []
+        for n, table in enumerate(tables[:-1]):
+            continuation = {}
+            for k in tables[n + 1]:
+                suffix = k[1:]
+                continuation[suffix] = continuation.get(suffix, 0) + 1
+            adjusted.append(continuation)
+        adjusted.append(tables[-1])
+
+        self._uniform = 1. / (self._vocabulary_count or len(tables[0]))
+
+        for table in adjusted:
+            discount = self._get_discount(table)
+            kept, types = _get_history_totals(table)
+            totals = kept
+            if table is tables[-1] and len(tables) > 1:
+                # The highest order uses counts, the lower orders
+                # continuation counts which are not kept by pruning.
+                totals = _get_history_counts(kept,
+                        _as_tables(counts[-2:-1])[0])
+
+            self._probs.append(dict(
+                (k, max(f - discount, 0.) / totals[k[:-1]])
+                for k, f in table.iteritems()))
+            self._gammas.append(dict(
+                (h, (discount * types[h] + totals[h] - kept[h]) / totals[h])
+                for h in totals))
+
+    def _score(self, key):
+        p = self._uniform
+        for n in range(1, min(len(key), len(self._probs)) + 1):
+            gram = key[len(key) - n:]
+            gamma = self._gammas[n - 1].get(gram[:-1])
+            if gamma is None:
+                # Longer histories are unseen as well.
+                break
+            p = self._probs[n - 1].get(gram, 0.) + gamma * p
+
+        return p
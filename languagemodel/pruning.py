@@ -0,0 +1,168 @@
+# Pruning of n-gram count tables.
+#
+# The functions here replace the count tables of an NGram by pruned
+# ones and are meant to run between NGram.build_ngrams and
+# build_probability of a distribution. Orders are pruned from the
+# highest down and an n-gram which is the history of a kept higher order
+# n-gram is always kept, so every history still has its count. The
+# backoff distributions take the count of a history from the table of
+# its order, so the mass of the pruned n-grams goes to the lower order.
+
+import copy
+import math
+
+def get_size(language_model):
+    """Returns the number of n-grams of all orders in the model."""
+    return sum(len(language_model.get_counts(n))
+            for n in range(1, language_model.get_order() + 1))
+
+def _prune(language_model, should_keep, orders):
+    """Removes the n-grams for which should_keep returns False.
+
+    param
+    ----
+    language_model: NGram to prune.
+    should_keep: Function of order, n-gram and count.
+    orders: Orders to prune.
+    """
+    histories = set()
+    for n in range(language_model.get_order(), 0, -1):
+        table = language_model.get_counts(n)
+        if n in orders:
+            # A new table, so that copies of the model sharing the
+            # tables are not changed, see evaluate_pruning.
+            table = dict((k, f) for k, f in table.iteritems()
+                    if k in histories or should_keep(n, k, f))
+            language_model.set_counts(table, n)
+
+        histories = set(k[:-1] for k in table)
+
+def prune_by_count(language_model, min_counts):
+    """Removes the n-grams seen less than a minimum number of times.
+
+    param
+    ----
+    language_model: NGram to prune.
+    min_counts: Dictionary from order to its minimum count.
+    """
+    _prune(language_model, lambda n, k, f: f >= min_counts[n],
+            set(min_counts))
+
+def prune_top_k(language_model, k, orders=None):
+    """Keeps only the k most frequent successors of each history.
+
+    param
+    ----
+    language_model: NGram to prune.
+    k: Number of successors to keep for a history.
+    orders: Orders to prune, defaults to all but unigrams.
+    """
+    if orders is None:
+        orders = range(2, language_model.get_order() + 1)
+
+    kept = set()
+    for n in orders:
+        successors = {}
+        for key, f in language_model.get_counts(n).iteritems():
+            successors.setdefault(key[:-1], []).append((f, key))
+
+        for items in successors.itervalues():
+            items.sort(reverse=True)
+            kept.update(key for f, key in items[:k])
+
+    _prune(language_model, lambda n, key, f: key in kept, set(orders))
+
+def get_relative_entropy(language_model, order):
+    """Returns the relative entropy contribution of n-grams of an order.
+
+    It uses the approximation of Stolcke (1998) with maximum likelihood
+    estimates: removing the n-gram 'h w' changes the model by about
+    P(h w) (log P(w|h) - log P(w|h')), where h' is h without its first
+    word and the changes to the backoff weights are ignored.
+
+    return
+    ----
+    Dictionary from n-gram to its contribution.
+    """
+    import probability
+
+    table = language_model.get_counts(order)
+    lower_table = language_model.get_counts(order - 1)
+    totals = probability._get_history_totals(table)[0]
+    lower_totals = probability._get_history_totals(lower_table)[0]
+    grand_total = float(sum(table.itervalues()))
+
+    entropies = {}
+    for k, f in table.iteritems():
+        h = k[:-1]
+        p = float(f) / totals[h]
+        lower_f = lower_table.get(k[1:], 0)
+        if lower_f == 0:
+            entropies[k] = float("inf")
+            continue
+
+        lower_p = float(lower_f) / lower_totals[h[1:]]
+        entropies[k] = f / grand_total * (math.log(p) - math.log(lower_p))
+
+    return entropies
+
+def prune_by_entropy(language_model, threshold, orders=None):
+    """Removes the n-grams whose removal changes the model little.
+
+    param
+    ----
+    language_model: NGram to prune.
+    threshold: N-grams with relative entropy contribution below it are
+        removed, see get_relative_entropy.
+    orders: Orders to prune, defaults to all but unigrams.
+    """
+    if orders is None:
+        orders = range(2, language_model.get_order() + 1)
+
+    entropies = {}
+    for n in orders:
+        entropies.update(get_relative_entropy(language_model, n))
+
+    _prune(language_model, lambda n, k, f: entropies[k] >= threshold,
+            set(orders))
+
+def evaluate_pruning(language_model, settings, testfile, build_distribution,
+        **kwargs):
+    """Reports the size and perplexity of a model under pruning settings.
+
+    Each setting is applied to a shallow copy of the model, which only
+    gets new tables for the pruned orders. So the settings must prune
+    with the functions of this module.
+
+    param
+    ----
+    language_model: NGram with calculated counts.
+    settings: List of (name, function) pairs where the function prunes
+        the given NGram in place, e.g.
+        ("min 2", lambda m: prune_by_count(m, {3: 2})).
+    testfile: Preprocessed test file.
+    build_distribution: Function which returns a distribution built from
+        a NGram, see evaluation.evaluate_perplexity.
+    kwargs: Passed to evaluation.evaluate_perplexity.
+
+    return
+    ----
+    List of dictionaries with the name, size and log perplexity of each
+    setting, starting with the unpruned model.
+    """
+    import evaluation
+
+    report = []
+    for name, prune in [("unpruned", None)] + list(settings):
+        model = copy.copy(language_model)
+        model._counts = list(language_model._counts)
+        if prune is not None:
+            prune(model)
+
+        result = evaluation.evaluate_perplexity(testfile,
+                build_distribution(model), model.get_vocabulary(),
+                model.get_order(), **kwargs)
+        report.append({"setting": name, "size": get_size(model),
+            "perplexity": result.get_perplexity()})
+
+    return report
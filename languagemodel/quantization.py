@@ -0,0 +1,399 @@
+# Compact storage of probability and count tables.
+#
+# The tables of the distributions and of NGram are dictionaries from
+# tuples of token ids to Python floats or ints, tens of bytes per entry.
+# A compact table packs each key into a 64 bit integer, or into the
+# bytes of its ids if it does not fit, as KeyIndex does, keeps the
+# packed keys in a sorted array and the values in a
+# typed array: counts as unsigned integers of the smallest sufficient
+# size, probabilities and backoff weights as 8 or 16 bit codes into a
+# codebook of log values. Every table has its own codebook, so each
+# order of a distribution and its backoff weights are quantized
+# separately. Compact tables are read only.
+
+import copy
+import sys
+
+from probability import GoodTuringDistribution, KatzBackoffDistribution, \
+        KneserNeyDistribution, LaplaceSmoothedDistribution, \
+        ProbabilityDistribution, _find_keys, _pack_keys, _unpack_keys
+
+_CODE_TYPES_ = {8: "uint8", 16: "uint16"}
+
+class Codebook(object):
+    """Maps real values to at most 2^bits levels.
+
+    The sorted values are split into bins of equal size and a bin is
+    represented by the mean of its values, so there are more levels
+    where there are more values. Values which are not finite, e.g. the
+    log of a zero probability, get the level -inf.
+    """
+
+    def __init__(self, values, bits=8):
+        """Builds the codebook.
+
+        param
+        ----
+        values: Values to be encoded.
+        bits: Size of a code, 8 or 16.
+        """
+        import numpy as np
+
+        if bits not in _CODE_TYPES_:
+            raise ValueError("Codes must have 8 or 16 bits")
+        self._dtype = np.dtype(_CODE_TYPES_[bits])
+
+        values = np.asarray(values, dtype=np.float64)
+        finite = np.sort(values[np.isfinite(values)])
+        levels = 2 ** bits
+        has_infinite = len(finite) < len(values)
+        if has_infinite:
+            levels -= 1
+
+        centers = np.zeros(0)
+        if len(finite) > 0:
+            bins = np.array_split(finite, min(levels, len(finite)))
+            centers = np.unique([b.mean() for b in bins])
+
+        # A value is encoded as the nearest center.
+        self._bounds = (centers[1:] + centers[:-1]) / 2
+        self._infinite_code = len(centers)
+        if has_infinite:
+            centers = np.append(centers, -np.inf)
+        self._centers = centers
+
+    def __len__(self):
+        """Returns the number of levels."""
+        return len(self._centers)
+
+    def encode(self, values):
+        """Returns the codes of values as an array of unsigned integers."""
+        import numpy as np
+
+        values = np.asarray(values, dtype=np.float64)
+        codes = np.where(np.isfinite(values),
+                np.searchsorted(self._bounds, values), self._infinite_code)
+        return codes.astype(self._dtype)
+
+    def decode(self, codes):
+        """Returns the values of the levels of codes."""
+        return self._centers[codes]
+
+    def get_memory(self):
+        """Returns the size of the codebook in bytes."""
+        return self._centers.nbytes + self._bounds.nbytes
+
+class _CompactTable(object):
+    """Read only table from tuples of token ids of one length to values.
+
+    It has the read methods of a dictionary and the lookup method of
+    KeyIndex, so it can replace both. Subclasses store the values.
+    """
+
+    def __init__(self, table):
+        """Builds the table.
+        param
+        ----
+        table: Dictionary from tuples of token ids of the same length
+            to numbers, e.g. NGram.get_counts.
+        """
+        import numpy as np
+
+        if any(not isinstance(k, tuple) for k in table):
+            raise ValueError("Compact tables require keys of token ids")
+
+        items = table.items()
+        keys = np.array([k for k, v in items], dtype=np.int64)
+        if len(items) == 0:
+            keys = keys.reshape(0, 0)
+        elif keys.ndim != 2:
+            raise ValueError("Keys of a compact table must have one length")
+
+        self._order = keys.shape[1]
+        self._base = int(keys.max()) + 1 if keys.size > 0 else 1
+
+        packed = _pack_keys(keys, self._base)
+        order = np.argsort(packed)
+        self._keys = packed[order]
+        self._set_values(np.array([v for k, v in items])[order])
+
+    def _find(self, key):
+        """Returns the position of key, -1 if it is not in the table."""
+        import numpy as np
+
+        if not isinstance(key, tuple) or len(key) != self._order:
+            return -1
+        base = self._base
+        if any(not 0 <= token_id < base for token_id in key):
+            return -1
+
+        if self._keys.dtype.kind == "V":
+            packed = _pack_keys(np.array([key], dtype=np.int64), base)[0]
+        else:
+            packed = 0
+            for token_id in key:
+                packed = packed * base + token_id
+
+        position = int(np.searchsorted(self._keys, packed))
+        if position < len(self._keys) and self._keys[position] == packed:
+            return position
+        return -1
+
+    def _get_keys(self):
+        """Returns the keys as a list of tuples in sorted order."""
+        if len(self._keys) == 0:
+            return []
+        return [tuple(k) for k in
+                _unpack_keys(self._keys, self._base, self._order).tolist()]
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, key):
+        return self._find(key) >= 0
+
+    def has_key(self, key):
+        return self._find(key) >= 0
+
+    def __getitem__(self, key):
+        position = self._find(key)
+        if position < 0:
+            raise KeyError(key)
+        return self._get_value(position)
+
+    def get(self, key, default=None):
+        position = self._find(key)
+        if position < 0:
+            return default
+        return self._get_value(position)
+
+    def iterkeys(self):
+        return iter(self._get_keys())
+
+    __iter__ = iterkeys
+
+    def itervalues(self):
+        return iter(self._get_values().tolist())
+
+    def iteritems(self):
+        return iter(zip(self._get_keys(), self._get_values().tolist()))
+
+    def keys(self):
+        return list(self.iterkeys())
+
+    def values(self):
+        return self._get_values().tolist()
+
+    def items(self):
+        return list(self.iteritems())
+
+    def lookup(self, ids):
+        """Looks up a batch of keys, see KeyIndex.lookup."""
+        import numpy as np
+
+        if ids.shape[1] != self._order or len(self._keys) == 0:
+            return (np.zeros(len(ids), dtype=bool),
+                    np.zeros(len(ids), dtype=np.float64))
+
+        found, positions = _find_keys(self._keys, ids, self._base)
+        return found, np.where(found, self._get_values(positions), 0.)
+
+    def get_memory(self):
+        """Returns the size of the arrays of the table in bytes."""
+        return self._keys.nbytes
+
+class CountTable(_CompactTable):
+    """Compact table of counts held in an unsigned integer array."""
+
+    def _set_values(self, values):
+        import numpy as np
+
+        largest = int(values.max()) if len(values) > 0 else 0
+        self._values = values.astype(np.min_scalar_type(largest))
+
+    def _get_value(self, position):
+        return int(self._values[position])
+
+    def _get_values(self, positions=None):
+        if positions is None:
+            return self._values
+        return self._values[positions]
+
+    def get_memory(self):
+        return super(CountTable, self).get_memory() + self._values.nbytes
+
+class QuantizedTable(_CompactTable):
+    """Compact table of probabilities quantized in the log domain."""
+
+    def __init__(self, table, bits=8):
+        """Builds the table.
+        param
+        ----
+        table: Dictionary from tuples of token ids of the same length
+            to probabilities or other non-negative weights.
+        bits: Size of the codes, 8 or 16.
+        """
+        self._bits = bits
+        super(QuantizedTable, self).__init__(table)
+
+    def _set_values(self, values):
+        import numpy as np
+
+        with np.errstate(divide="ignore"):
+            log_values = np.log(values.astype(np.float64))
+        self._codebook = Codebook(log_values, self._bits)
+        self._codes = self._codebook.encode(log_values)
+        self._levels = np.exp(self._codebook.decode(
+            np.arange(len(self._codebook))))
+
+    def _get_value(self, position):
+        return float(self._levels[self._codes[position]])
+
+    def _get_values(self, positions=None):
+        if positions is None:
+            return self._levels[self._codes]
+        return self._levels[self._codes[positions]]
+
+    def get_memory(self):
+        return super(QuantizedTable, self).get_memory() + \
+                self._codes.nbytes + self._codebook.get_memory()
+
+def get_memory(table):
+    """Returns the approximate size of a table in bytes.
+
+    For a dictionary, it is the size of the dictionary, its keys and its
+    values, without the token ids, which are shared by all the keys.
+    """
+    if isinstance(table, _CompactTable):
+        return table.get_memory()
+
+    size = sys.getsizeof(table)
+    for k, v in table.iteritems():
+        size += sys.getsizeof(k) + sys.getsizeof(v)
+    return size
+
+def _get_tables(distribution):
+    """Returns the names of the table attributes of a distribution."""
+    if isinstance(distribution, KatzBackoffDistribution):
+        return ["_probs", "_alphas"], []
+    if isinstance(distribution, KneserNeyDistribution):
+        return ["_probs", "_gammas"], []
+    if isinstance(distribution, GoodTuringDistribution):
+        return [], ["_ngrams"]
+    if isinstance(distribution, ProbabilityDistribution):
+        return ["_probability_distribution"], ["_ngram", "_subgram"]
+    raise ValueError("Unsupported distribution: %s" %
+            type(distribution).__name__)
+
+def get_distribution_memory(distribution):
+    """Returns the approximate size of the tables of a distribution."""
+    probability_names, count_names = _get_tables(distribution)
+    size = 0
+    for name in probability_names + count_names:
+        tables = getattr(distribution, name)
+        if not isinstance(tables, list):
+            tables = [tables]
+        size += sum(get_memory(t) for t in tables)
+    return size
+
+def quantize_distribution(distribution, bits=8):
+    """Returns a copy of a distribution with compact tables.
+
+    The probabilities and backoff weights are replaced by QuantizedTable
+    and the counts by CountTable. The copy scores the same n-grams as
+    the distribution, but it can not be built or updated anymore.
+
+    param
+    ----
+    distribution: Distribution built from id keyed tables.
+    bits: Size of the codes of the probabilities, 8 or 16.
+
+    return
+    ----
+    The quantized distribution.
+    """
+    probability_names, count_names = _get_tables(distribution)
+    if hasattr(distribution, "refresh"):
+        distribution.refresh()
+
+    quantized = copy.copy(distribution)
+    for name in probability_names:
+        tables = getattr(distribution, name)
+        if isinstance(tables, list):
+            setattr(quantized, name, [QuantizedTable(t, bits)
+                for t in tables])
+        else:
+            setattr(quantized, name, QuantizedTable(tables, bits))
+    for name in count_names:
+        setattr(quantized, name, CountTable(getattr(distribution, name)))
+
+    # The compact tables are their own batch indexes.
+    if isinstance(distribution, GoodTuringDistribution):
+        quantized._index = quantized._ngrams
+        quantized._frequency_count = dict(distribution._frequency_count)
+        quantized._changed_ngrams = set()
+    elif isinstance(distribution, ProbabilityDistribution):
+        quantized._index = quantized._probability_distribution
+        quantized._dirty_histories = set()
+        quantized._successors = None
+        quantized._new_ngrams = set()
+        if isinstance(distribution, LaplaceSmoothedDistribution):
+            quantized._history_index = quantized._subgram
+
+    return quantized
+
+def compact_counts(language_model):
+    """Replaces the count tables of a NGram by CountTable.
+
+    The model can still be read and distributions can be built from its
+    tables, but it can not count or be updated anymore.
+
+    param
+    ----
+    language_model: NGram with calculated counts.
+
+    return
+    ----
+    The model.
+    """
+    counts = [CountTable(t) for t in language_model._counts]
+    N = len(counts)
+    language_model._counts = counts
+    language_model._grams_count = counts[N - 1]
+    language_model._subgrams_count = counts[N - 2]
+    return language_model
+
+def evaluate_quantization(distribution, testfile, vocabulary, window_size,
+        bits=(16, 8), **kwargs):
+    """Reports the size and perplexity of a distribution when quantized.
+
+    param
+    ----
+    distribution: Distribution built from id keyed tables.
+    testfile: Preprocessed test file.
+    vocabulary: Vocabulary of the training model.
+    window_size: The N of N-grams.
+    bits: Sizes of the codes to evaluate.
+    kwargs: Passed to evaluation.evaluate_perplexity.
+
+    return
+    ----
+    List of dictionaries with the bits, the size of the tables in bytes
+    and the log perplexity, starting with the unquantized distribution
+    whose bits are None.
+    """
+    import evaluation
+
+    report = []
+    for b in [None] + list(bits):
+        quantized = distribution
+        if b is not None:
+            quantized = quantize_distribution(distribution, b)
+
+        result = evaluation.evaluate_perplexity(testfile, quantized,
+                vocabulary, window_size, **kwargs)
+        report.append({"bits": b,
+            "size": get_distribution_memory(quantized),
+            "perplexity": result.get_perplexity()})
+
+    return report
@@ -0,0 +1,215 @@
+# Scoring service for a loaded model.
+#
+# A SentenceScorer keeps two LRU caches: one from n-grams to their log
+# probabilities and one of sentence prefixes, so requests which share
+# prefixes (autocomplete, reranking of candidates) only score the part
+# after the longest cached prefix. The scorer is served over HTTP on
+# localhost by a threaded server:
+#
+#   POST /score  {"sentences": ["I am", ...]}
+#                -> {"log_probs": [...], "token_counts": [...]}
+#   GET  /stats  latency percentiles and cache statistics.
+
+import BaseHTTPServer
+import SocketServer
+import collections
+import itertools
+import json
+import math
+import threading
+import time
+
+from NGrams import NGram
+from evaluation import encode_sentence
+import util
+
+class SentenceScorer(object):
+    """Scores sentences with a distribution, caching prefix states.
+
+    A prefix is represented by a state number. The prefix cache maps a
+    state and the next token id to the state of the longer prefix and
+    its log probability, like the edges of a trie. A sentence walks the
+    cache from the empty prefix and is scored from the longest prefix
+    found, so no prefix is copied or hashed as a whole. A sentence
+    counts as a single hit or miss of the prefix cache.
+    """
+
+    def __init__(self, distribution, vocabulary, window_size,
+            prefix_cache_size=100000, ngram_cache_size=100000,
+            latency_window=10000):
+        """Initiates the class.
+        param
+        ----
+        distribution: Distribution built from id keyed tables or a
+            modelfile.MappedModel with probabilities.
+        vocabulary: Vocabulary of the training model.
+        window_size: The N of N-grams.
+        prefix_cache_size: Number of prefix states to keep.
+        ngram_cache_size: Number of n-gram log probabilities to keep.
+        latency_window: Number of recent requests used for the latency
+            percentiles.
+        """
+        self._distribution = distribution
+        self._vocabulary = vocabulary
+        self._window_size = window_size
+        self._starters = (vocabulary.get_id(NGram._START_MARKER_),) * \
+                (window_size - 1)
+        self._end_id = vocabulary.get_id(NGram._END_MARKER_)
+
+        self._prefix_cache = util.LRUCache(prefix_cache_size)
+        # State 0 is the empty prefix.
+        self._states = itertools.count(1)
+        self._ngram_cache = util.LRUCache(ngram_cache_size)
+        self._latencies = collections.deque(maxlen=latency_window)
+        self._requests = 0
+        self._lock = threading.Lock()
+
+    def _get_log_probability(self, ngram):
+        with self._lock:
+            log_prob = self._ngram_cache.get(ngram)
+        if log_prob is None:
+            prob = self._distribution.get_probability(ngram)
+            log_prob = math.log(prob) if prob > 0 else float("-inf")
+            with self._lock:
+                self._ngram_cache.put(ngram, log_prob)
+        return log_prob
+
+    def score_ids(self, ids):
+        """Returns the log probability of a sentence given as token ids.
+
+        Unknown tokens have the id -1, see evaluation.encode_sentence.
+        """
+        padded = self._starters + tuple(ids) + (self._end_id,)
+        N = self._window_size
+        cache = self._prefix_cache
+
+        # The last token of a prefix is at index end - 1 of padded, the
+        # whole sentence ends with the end marker.
+        state = 0
+        log_prob = 0.
+        end = N - 1
+        with self._lock:
+            while end < len(padded):
+                entry = cache.get((state, padded[end]), count=False)
+                if entry is None:
+                    break
+                state, log_prob = entry
+                end += 1
+
+            if end > N - 1:
+                cache.hits += 1
+            else:
+                cache.misses += 1
+
+        for end in xrange(end, len(padded)):
+            log_prob += self._get_log_probability(padded[end - N + 1:end + 1])
+            next_state = next(self._states)
+            with self._lock:
+                cache.put((state, padded[end]), (next_state, log_prob))
+            state = next_state
+
+        return log_prob
+
+    def score(self, sentences):
+        """Scores a batch of preprocessed sentences.
+
+        return
+        ----
+        Lists of the log probabilities and the token counts of the
+        sentences, counted as in evaluation.evaluate_perplexity.
+        """
+        start_time = time.time()
+        log_probs = []
+        token_counts = []
+        for sentence in sentences:
+            ids = encode_sentence(sentence, self._vocabulary)
+            log_probs.append(self.score_ids(ids))
+            # A sentence has an N-gram for each token and the end marker.
+            token_counts.append(util.get_token_count(len(ids) + 1,
+                self._window_size))
+
+        with self._lock:
+            self._latencies.append(time.time() - start_time)
+            self._requests += 1
+
+        return log_probs, token_counts
+
+    def get_stats(self):
+        """Returns the latency percentiles in seconds and cache stats."""
+        with self._lock:
+            latencies = sorted(self._latencies)
+            stats = {"requests": self._requests,
+                    "prefix_cache": self._prefix_cache.get_stats(),
+                    "ngram_cache": self._ngram_cache.get_stats()}
+
+        for name, percentile in [("latency_p50", 50), ("latency_p99", 99)]:
+            value = None
+            if latencies:
+                index = int(math.ceil(percentile / 100. * len(latencies)))
+                value = latencies[max(index - 1, 0)]
+            stats[name] = value
+
+        return stats
+
+class _RequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def _send_json(self, code, data):
+        body = json.dumps(data)
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path != "/stats":
+            self._send_json(404, {"error": "Unknown path"})
+            return
+        self._send_json(200, self.server.scorer.get_stats())
+
+    def do_POST(self):
+        if self.path != "/score":
+            self._send_json(404, {"error": "Unknown path"})
+            return
+
+        try:
+            length = int(self.headers.getheader("Content-Length", 0))
+            sentences = json.loads(self.rfile.read(length))["sentences"]
+        except (ValueError, KeyError, TypeError):
+            self._send_json(400, {"error": "Expected a list of sentences"})
+            return
+
+        log_probs, token_counts = self.server.scorer.score(sentences)
+        self._send_json(200, {"log_probs": log_probs,
+            "token_counts": token_counts})
+
+    def log_message(self, format, *args):
+        # Requests are counted in the stats instead.
+        pass
+
+class ScoringServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """HTTP server handling each request in its own thread."""
+
+    daemon_threads = True
+
+    def __init__(self, scorer, host="127.0.0.1", port=8000):
+        """Binds the server.
+        param
+        ----
+        scorer: SentenceScorer answering the requests.
+        host: Address to listen on.
+        port: Port to listen on, 0 picks a free one.
+        """
+        BaseHTTPServer.HTTPServer.__init__(self, (host, port),
+                _RequestHandler)
+        self.scorer = scorer
+
+def serve(scorer, host="127.0.0.1", port=8000):
+    """Serves the scorer until interrupted."""
+    server = ScoringServer(scorer, host, port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,262 @@
+# Approximate n-gram counting with fixed memory.
+
+import array
+import math
+
+from NGrams import NGram
+
+# Constants for mixing the 64 bit hash values.
+_MULTIPLIER_ = 0x9E3779B97F4A7C15
+_MASK_ = 0xFFFFFFFFFFFFFFFF
+
+class CountMinSketch(object):
+    """Count-Min sketch of Cormode and Muthukrishnan.
+
+    It keeps depth rows of width counters. A key is added to one counter
+    of each row and its estimate is the minimum of those counters. The
+    estimate is never less than the true count, and with a width of
+    ceil(e / epsilon) and a depth of ceil(ln(1 / delta)) it exceeds the
+    true count by more than epsilon * total with probability at most
+    delta, where total is the sum of all the added counts.
+    """
+
+    def __init__(self, width, depth):
+        """Initiates the class.
+        param
+        ----
+        width: Number of counters in a row.
+        depth: Number of rows.
+        """
+        self._width = width
+        self._depth = depth
+        self._counters = array.array("l", [0]) * (width * depth)
+        self.total = 0
+
+    @staticmethod
+    def get_dimensions(epsilon, delta):
+        """Returns the width and depth for given error bounds."""
+        return (int(math.ceil(math.e / epsilon)),
+                int(math.ceil(math.log(1. / delta))))
+
+    def get_error_bound(self):
+        """Returns the bound epsilon * total of the overestimate."""
+        return math.e / self._width * self.total
+
+    def _get_positions(self, key):
+        # Double hashing on the two halves of the mixed hash value gives
+        # an independent enough position per row.
+        h = (hash(key) * _MULTIPLIER_) & _MASK_
+        h1 = h >> 32
+        h2 = (h & 0xFFFFFFFF) | 1
+        width = self._width
+        return [row * width + (h1 + row * h2) % width
+                for row in range(self._depth)]
+
+    def add(self, key, count=1):
+        """Adds count to key and returns the new estimate."""
+        counters = self._counters
+        estimate = None
+        for position in self._get_positions(key):
+            value = counters[position] + count
+            counters[position] = value
+            if estimate is None or value < estimate:
+                estimate = value
+
+        self.total += count
+        return estimate
+
+    def estimate(self, key):
+        """Returns the estimated count of key."""
+        counters = self._counters
+        return min([counters[p] for p in self._get_positions(key)])
+
+    def merge(self, other):
+        """Adds the counters of a sketch with the same dimensions."""
+        if (other._width, other._depth) != (self._width, self._depth):
+            raise ValueError("Can not merge sketches of different size")
+
+        counters = self._counters
+        for position, value in enumerate(other._counters):
+            counters[position] += value
+        self.total += other.total
+
+class ApproximateNGram(NGram):
+    """N-gram model which counts with Count-Min sketches.
+
+    Each order has its own sketch, so memory does not grow with the
+    number of distinct n-grams. Besides, the n-grams with the largest
+    estimates are kept in a bounded heavy hitters table, which is what
+    get_counts and the other table getters return, so the distributions
+    in probability.py can be built from it. The frequency getters answer
+    from the sketch for any n-gram.
+
+    The sketches are keyed by the hash values of the tokens rather than
+    their ids, so models counted with different vocabularies, e.g. in
+    separate processes, can be merged.
+    """
+
+    def __init__(self, inputfile, N=3, vocabulary=None, width=2 ** 20,
+            depth=4, heavy_hitters=100000):
+        """Initializes the instance.
+
+        param:
+        ----
+        inputfile: Path of input file, see NGram.
+        N: Size of Markov memory, must be greater than 1.
+        vocabulary: Vocabulary to use for interning tokens.
+        width: Number of counters in a row of each sketch, see
+            CountMinSketch.get_dimensions.
+        depth: Number of rows of each sketch.
+        heavy_hitters: Number of n-grams to keep for each order.
+        """
+        NGram.__init__(self, inputfile, N, vocabulary)
+
+        self._sketches = [CountMinSketch(width, depth) for n in range(N)]
+        self._capacity = heavy_hitters
+        self._token_hashes = []
+
+    def _get_options(self):
+        sketch = self._sketches[0]
+        return {"width": sketch._width, "depth": sketch._depth,
+                "heavy_hitters": self._capacity}
+
+    def _get_token_hashes(self):
+        """Returns the list of the hash values of the tokens by id."""
+        token_hashes = self._token_hashes
+        get_token = self._vocabulary.get_token
+        for token_id in xrange(len(token_hashes), len(self._vocabulary)):
+            token_hashes.append(hash(get_token(token_id)))
+        return token_hashes
+
+    def _estimate(self, key):
+        token_hashes = self._get_token_hashes()
+        return self._sketches[len(key) - 1].estimate(
+                tuple([token_hashes[i] for i in key]))
+
+    def _count_padded(self, sentences):
+        """Adds the n-grams of all orders of sentences to the sketches."""
+        N = self._window_size
+        orders = [(N - order, self._sketches[order - 1],
+            self._counts[order - 1]) for order in range(1, N + 1)]
+        start_grams = [(self._starters[:order], self._sketches[order - 1],
+            self._counts[order - 1]) for order in range(1, N)]
+
+        token_hashes = self._get_token_hashes()
+        start_keys = [tuple([token_hashes[i] for i in gram])
+                for gram, sketch, table in start_grams]
+
+        for padded in sentences:
+            if len(token_hashes) < len(self._vocabulary):
+                self._get_token_hashes()
+            hashed = tuple([token_hashes[i] for i in padded])
+
+            for (gram, sketch, table), key in zip(start_grams, start_keys):
+                self._add_heavy_hitter(table, gram, sketch.add(key))
+
+            for index in xrange(len(padded) - N + 1):
+                window = padded[index : index + N]
+                hashed_window = hashed[index : index + N]
+                for offset, sketch, table in orders:
+                    self._add_heavy_hitter(table, window[offset:],
+                            sketch.add(hashed_window[offset:]))
+
+        self._add_histories()
+
+    def _add_heavy_hitter(self, table, gram, estimate):
+        table[gram] = estimate
+        if len(table) > 2 * self._capacity:
+            # Keep the largest estimates. Trimming only once the table
+            # doubles makes the cost of the sort O(log C) per n-gram.
+            kept = sorted(table.iteritems(), key=lambda item: item[1],
+                    reverse=True)[:self._capacity]
+            table.clear()
+            table.update(kept)
+
+    def _add_histories(self):
+        """Adds the histories of the heavy hitters which were trimmed.
+
+        Each order is trimmed on its own, so the history of a kept
+        n-gram can be missing from the table of the lower order. It is
+        added back with its estimate, so that every history has a count
+        as in NGram.
+
+        The estimates of the orders come from different sketches and
+        the stored ones from different times, so the count of a history
+        is also raised to the sum of its kept successors, as in
+        probability._get_history_counts. Otherwise a maximum likelihood
+        probability could exceed 1. The orders are visited from N down,
+        so a raised count is seen by the order below.
+        """
+        for n in range(self._window_size, 1, -1):
+            lower_table = self._counts[n - 2]
+            totals = {}
+            for gram, count in self._counts[n - 1].iteritems():
+                history = gram[:-1]
+                totals[history] = totals.get(history, 0) + count
+
+            for history, total in totals.iteritems():
+                count = lower_table.get(history)
+                if count is None:
+                    count = self._estimate(history)
+                lower_table[history] = max(count, total)
+
+    def get_error_bound(self, order=None):
+        """Returns the bound of the overestimate of counts of an order.
+
+        It holds with the probability given by the sketch depth, see
+        CountMinSketch.
+        """
+        if order is None:
+            order = self._window_size
+        return self._sketches[order - 1].get_error_bound()
+
+    def get_frequency(self, ngram):
+        """Returns estimated frequency for n-gram of any order up to N."""
+        key = self._to_key(ngram)
+        if key is None or not 1 <= len(key) <= self._window_size:
+            return 0
+        return self._estimate(key)
+
+    def get_ngrams_frequency(self, ngram):
+        """Returns estimated frequency count for n-gram"""
+        key = self._to_key(ngram)
+        if key is None or len(key) != self._window_size:
+            return 0
+        return self._estimate(key)
+
+    def get_subgrams_frequency(self, subgram):
+        """Returns estimated frequency count for n-1 gram"""
+        key = self._to_key(subgram)
+        if key is None or len(key) != self._window_size - 1:
+            return 0
+        return self._estimate(key)
+
+    def merge(self, other):
+        """Adds the sketches and heavy hitters of other model.
+
+        The models can use different vocabularies, the ids of the heavy
+        hitters of other are translated as in NGram.merge. The sketches
+        must have the same dimensions.
+        """
+        if other._window_size != self._window_size:
+            raise ValueError("Can not merge models with different N")
+
+        mapping = None
+        if other._vocabulary is not self._vocabulary:
+            add = self._vocabulary.add
+            mapping = [add(t) for t in other._vocabulary.get_tokens()]
+
+        for sketch, other_sketch, table, other_table in zip(self._sketches,
+                other._sketches, self._counts, other._counts):
+            sketch.merge(other_sketch)
+            grams = set(table)
+            if mapping is None:
+                grams.update(other_table)
+            else:
+                grams.update(tuple([mapping[i] for i in gram])
+                        for gram in other_table)
+            for gram in grams:
+                self._add_heavy_hitter(table, gram, self._estimate(gram))
+
+        self._add_histories()
+        return self
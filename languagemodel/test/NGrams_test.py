@@ -42,6 +42,81 @@ class TestNGrams(unittest.TestCase):
         assert language_model.get_ngrams_frequency("_START_ I _END_") == 1
         assert language_model.get_subgrams_frequency("_START_ I") == 2
 
+     def test_id_keyed_counts(self):
+        inputfile = "/tmp/1"
+        with open(inputfile, "w") as f:
+            f.write("I am walking .\nI am .\n")
+        language_model = NGrams.NGram(inputfile, N=2)
+        language_model.build_ngrams()
+
+        vocabulary = language_model.get_vocabulary()
+        key = vocabulary.encode("I am")
+        assert key == (vocabulary.get_id("I"), vocabulary.get_id("am"))
+        assert language_model.get_ngrams_counts()[key] == 2
+        assert language_model.get_ngrams_frequency(key) == 2
+        assert language_model.get_ngrams_frequency("I am") == 2
+        assert language_model.get_ngrams_frequency("am I") == 0
+        assert language_model.get_ngrams_frequency("blah am") == 0
+        assert "am walking" in language_model.get_ngrams()
+
+     def test_all_orders(self):
+        inputfile = "/tmp/1"
+        with open(inputfile, "w") as f:
+            f.write("I am walking .\nI am .\n")
+        language_model = NGrams.NGram(inputfile, N=4)
+        language_model.build_ngrams()
+
+        vocabulary = language_model.get_vocabulary()
+        assert language_model.get_frequency("I") == 2
+        assert language_model.get_frequency("_START_ I am") == 2
+        assert language_model.get_frequency("I am walking . _END_") == 0
+        assert language_model.get_counts(1)[vocabulary.encode(".")] == 2
+        assert language_model.get_subgrams_frequency("am . _END_") == 1
+        assert language_model.get_ngrams_frequency(
+                "_START_ _START_ _START_ I") == 2
+
+     def test_parallel_counting(self):
+        inputfile = "/tmp/1"
+        with open(inputfile, "w") as f:
+            for i in range(50):
+                f.write("I am walking .\nYou are %d .\n" % i)
+
+        serial_model = NGrams.NGram(inputfile)
+        serial_model.build_ngrams()
+
+        # Small shards so that lines are split across shard boundaries.
+        parallel_model = NGrams.count_ngrams([inputfile, inputfile], N=3,
+                processes=2, shard_size=37)
+
+        for ngram in serial_model.get_ngrams():
+            assert parallel_model.get_ngrams_frequency(ngram) == \
+                    2 * serial_model.get_ngrams_frequency(ngram)
+        assert len(parallel_model.get_ngrams()) == \
+                len(serial_model.get_ngrams())
+
+        parallel_model.merge(serial_model)
+        assert parallel_model.get_frequency("You are 7") == 3
+
+     def test_update(self):
+        inputfile = "/tmp/1"
+        with open(inputfile, "w") as f:
+            f.write("I am walking .\n")
+        language_model = NGrams.NGram(inputfile)
+        language_model.build_ngrams()
+
+        delta = language_model.update(["I am .\n", "You are .\n"])
+        assert delta.get_frequency("I am") == 1
+        assert delta.get_frequency("walking") == 0
+        assert language_model.get_frequency("I am") == 2
+        assert language_model.get_ngrams_frequency("_START_ You are") == 1
+
+        with open(inputfile, "w") as f:
+            f.write("I am walking .\nI am .\nYou are .\n")
+        full_model = NGrams.NGram(inputfile)
+        full_model.build_ngrams()
+        assert sorted(language_model.get_ngrams()) == \
+                sorted(full_model.get_ngrams())
+
 if __name__ == "__main__":
     unittest.main()
 
@@ -0,0 +1,68 @@
+# Test cases for benchmark.py
+
+from .. import benchmark
+
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+class TestBenchmark(unittest.TestCase):
+
+    def test_generate_corpus(self):
+        benchmark.generate_corpus("/tmp/1", 200, vocabulary_size=50, seed=3)
+        benchmark.generate_corpus("/tmp/2", 200, vocabulary_size=50, seed=3)
+        with open("/tmp/1") as f:
+            lines = f.readlines()
+        with open("/tmp/2") as f:
+            assert f.readlines() == lines
+
+        words = [w for l in lines for w in l.split()]
+        assert len(lines) == 200
+        assert set(words) <= set("w%d" % i for i in range(50))
+        assert words.count("w0") > words.count("w10")
+
+    def test_measure(self):
+        def allocate():
+            data = "x" * (50 * 2 ** 20)
+            time.sleep(0.1)
+            return len(data)
+
+        result, value = benchmark.measure("allocate", allocate)
+        assert value == 50 * 2 ** 20
+        if result["rss_before_kb"] is not None:
+            # The buffer is freed at the end of the stage, but the
+            # samples taken while it ran see it.
+            assert result["peak_rss_kb"] >= result["rss_before_kb"] + \
+                    40 * 1024
+            assert result["rss_after_kb"] < result["peak_rss_kb"]
+
+    def test_run_benchmarks(self):
+        profile_dir = tempfile.mkdtemp()
+        try:
+            report = benchmark.run_benchmarks(sizes=[50], orders=[2],
+                    vocabulary_size=30, lookups=100, outputfile="/tmp/1",
+                    profile_dir=profile_dir)
+            assert os.path.exists(os.path.join(profile_dir,
+                "build_ngrams_50_2.prof"))
+        finally:
+            shutil.rmtree(profile_dir)
+
+        stages = set(r["stage"] for r in report["results"])
+        assert "build_ngrams" in stages
+        assert "get_probability_kneser_ney" in stages
+        assert "calculate_perplexity" in stages
+        assert "evaluate_perplexity_quantized_katz" in stages
+        with open("/tmp/1") as f:
+            assert json.load(f)["results"] == report["results"]
+
+        assert benchmark.compare_results("/tmp/1", report) == []
+        for r in report["results"]:
+            r["seconds"] = r["seconds"] * 2 + 1
+        assert len(benchmark.compare_results("/tmp/1", report)) == \
+                len(report["results"])
+
+if __name__ == "__main__":
+    unittest.main()
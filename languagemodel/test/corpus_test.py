@@ -0,0 +1,95 @@
+# Test cases for corpus.py
+
+from .. import NGrams
+from .. import corpus
+from .. import evaluation
+from .. import probability
+
+import os
+import unittest
+
+class TestCorpus(unittest.TestCase):
+
+    def setUp(self):
+        self.inputfile = "/tmp/corpus_input"
+        self.path = self.inputfile + ".corpus"
+        with open(self.inputfile, "w") as f:
+            for i in range(10):
+                f.write("I am walking .\nI am .\n\nYou are walking .\n")
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def test_load_corpus(self):
+        c = corpus.load_corpus(self.inputfile)
+        assert len(c) == 40
+        assert c.get_token_count() == 10 * 11
+        assert c.get_vocabulary().get_tokens() == ["I", "am", "walking",
+                ".", "You", "are"]
+
+        sentences = list(c.iter_sentences())
+        assert sentences[:4] == [(0, 1, 2, 3), (0, 1, 3), (), (4, 5, 2, 3)]
+        assert list(c.iter_sentences(start=38, end=40)) == [(), (4, 5, 2, 3)]
+
+        shards = c.get_shards(16)
+        assert shards[0][0] == 0 and shards[-1][1] == len(c)
+        assert [s for start, end in shards
+                for s in c.iter_sentences(start=start, end=end)] == sentences
+        c.close()
+
+        # The file is reused until the source changes.
+        mtime = os.stat(self.path).st_mtime
+        c = corpus.load_corpus(self.inputfile)
+        assert os.stat(self.path).st_mtime == mtime
+        c.close()
+
+        with open(self.inputfile, "a") as f:
+            f.write("They are here .\n")
+        c = corpus.load_corpus(self.inputfile)
+        assert len(c) == 41
+        assert list(c.iter_sentences(start=40)) == [(6, 5, 7, 3)]
+        c.close()
+
+    def test_count_corpus(self):
+        for N in [2, 3]:
+            expected = NGrams.NGram(self.inputfile, N)
+            expected.build_ngrams()
+
+            language_model = NGrams.NGram(self.inputfile, N)
+            language_model.build_ngrams(use_corpus=True)
+            assert language_model.get_vocabulary().get_tokens() == \
+                    expected.get_vocabulary().get_tokens()
+            for n in range(1, N + 1):
+                assert language_model.get_counts(n) == expected.get_counts(n)
+
+            parallel_model = NGrams.NGram(self.inputfile, N)
+            parallel_model.build_ngrams(processes=2, shard_size=16,
+                    use_corpus=True)
+            for n in range(1, N + 1):
+                assert parallel_model.get_counts(n) == expected.get_counts(n)
+
+    def test_evaluate_corpus(self):
+        language_model = NGrams.NGram(self.inputfile, N=2)
+        language_model.build_ngrams()
+        vocabulary = language_model.get_vocabulary()
+
+        testfile = "/tmp/corpus_test"
+        with open(testfile, "w") as f:
+            for i in range(20):
+                f.write("I am walking .\nYou are blah .\n")
+
+        prob = probability.LaplaceSmoothedDistribution(len(vocabulary))
+        prob.build_probability(language_model.get_ngrams_counts(),
+                language_model.get_subgrams_counts())
+        expected = evaluation.evaluate_perplexity(testfile, prob, vocabulary,
+                2)
+
+        c = corpus.load_corpus(testfile)
+        result = evaluation.evaluate_perplexity(c, prob, vocabulary, 2,
+                batch_size=7)
+        assert result.log_probs == expected.log_probs
+        assert result.token_counts == expected.token_counts
+
+        parallel_result = evaluation.evaluate_perplexity(c, prob, vocabulary,
+                2, processes=2, shard_size=16)
+        assert parallel_result.log_probs == expected.log_probs
+        c.close()
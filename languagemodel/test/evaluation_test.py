@@ -0,0 +1,136 @@
+# Test cases for evaluation.py
+
+from .. import NGrams
+from .. import evaluation
+from .. import probability
+from .. import util
+
+import unittest
+
+class TestEvaluation(unittest.TestCase):
+
+    def test_evaluate_perplexity(self):
+        trainfile = "/tmp/1"
+        testfile = "/tmp/2"
+        with open(trainfile, "w") as f:
+            f.write("I am walking .\nI am .\nYou are walking .\n")
+        with open(testfile, "w") as f:
+            for i in range(20):
+                f.write("I am walking .\nYou are blah .\n")
+
+        language_model = NGrams.NGram(trainfile, N=2)
+        language_model.build_ngrams()
+        vocabulary = language_model.get_vocabulary()
+        ngrams = language_model.get_ngrams_counts()
+        subgrams = language_model.get_subgrams_counts()
+
+        prob = probability.LaplaceSmoothedDistribution(len(subgrams))
+        prob.build_probability(ngrams, subgrams)
+
+        # The same distribution keyed by strings.
+        string_prob = probability.LaplaceSmoothedDistribution(len(subgrams))
+        string_prob.build_probability(
+                dict((vocabulary.decode(k), f) for k, f in ngrams.items()),
+                dict((vocabulary.decode(k), f) for k, f in subgrams.items()))
+        expected = util.calculate_perplexity(testfile, string_prob, 2)
+
+        result = evaluation.evaluate_perplexity(testfile, prob, vocabulary,
+                2, batch_size=7)
+        self.assertAlmostEqual(result.get_perplexity(), expected)
+        assert len(result.get_sentence_perplexities()) == 40
+        assert result.token_count == 40 * 4
+
+        parallel_result = evaluation.evaluate_perplexity(testfile, prob,
+                vocabulary, 2, processes=2, shard_size=50)
+        assert parallel_result.log_prob_sum == result.log_prob_sum
+        assert parallel_result.get_sentence_perplexities() == \
+                result.get_sentence_perplexities()
+
+        # Blank lines have no tokens.
+        with open(testfile, "w") as f:
+            f.write("I am walking .\n\nI am here .\n")
+        result = evaluation.evaluate_perplexity(testfile, prob, vocabulary,
+                2)
+        assert result.token_counts == [4, 0, 4]
+        self.assertAlmostEqual(result.get_perplexity(),
+                util.calculate_perplexity(testfile, string_prob, 2))
+
+        language_model = NGrams.NGram(trainfile, N=3)
+        language_model.build_ngrams()
+        prob = probability.LaplaceSmoothedDistribution(len(vocabulary))
+        prob.build_probability(language_model.get_ngrams_counts(),
+                language_model.get_subgrams_counts())
+        result = evaluation.evaluate_perplexity(testfile, prob,
+                language_model.get_vocabulary(), 3)
+        assert result.token_counts == [3, 0, 3]
+
+    def test_stream_scorer(self):
+        trainfile = "/tmp/1"
+        with open(trainfile, "w") as f:
+            f.write("I am walking .\nI am .\nYou are walking .\n")
+
+        language_model = NGrams.NGram(trainfile, N=3)
+        language_model.build_ngrams()
+        vocabulary = language_model.get_vocabulary()
+        prob = probability.LaplaceSmoothedDistribution(len(vocabulary))
+        prob.build_probability(language_model.get_ngrams_counts(),
+                language_model.get_subgrams_counts())
+
+        sentences = ["I am walking .", "You are blah ."]
+        expected = evaluation.StreamScorer(prob, vocabulary, 3)
+        log_probs = []
+        for sentence in sentences:
+            log_prob = sum(expected.push(t) for t in sentence.split())
+            log_probs.append(log_prob + expected.end_sentence())
+
+        testfile = "/tmp/2"
+        with open(testfile, "w") as f:
+            f.write("\n".join(sentences) + "\n")
+        result = evaluation.evaluate_perplexity(testfile, prob, vocabulary, 3)
+        for log_prob, other in zip(log_probs, result.log_probs):
+            self.assertAlmostEqual(log_prob, other)
+        assert expected.get_token_count() == 10
+        self.assertAlmostEqual(expected.get_perplexity(),
+                -sum(log_probs) / 10)
+
+        # Branches do not share state.
+        scorer = evaluation.StreamScorer(prob, vocabulary, 3)
+        scorer.push("I")
+        branch = scorer.copy()
+        branch_log_prob = branch.push("am")
+        assert scorer.get_token_count() == 1
+        assert scorer.get_history() == (vocabulary.get_id(
+            NGrams.NGram._START_MARKER_), vocabulary.get_id("I"))
+        assert scorer.push("am") == branch_log_prob
+        assert scorer.get_log_prob() == branch.get_log_prob()
+
+        class TracedScorer(evaluation.StreamScorer):
+            pass
+        assert type(TracedScorer(prob, vocabulary, 3).copy()) is TracedScorer
+
+    def test_classify_documents(self):
+        vocabulary = None
+        distributions = []
+        for i, text in enumerate(["I am walking .\nI am .\n",
+                "You are walking .\nYou are here .\n"]):
+            trainfile = "/tmp/%d" % i
+            with open(trainfile, "w") as f:
+                f.write(text)
+
+            language_model = NGrams.NGram(trainfile, N=2,
+                    vocabulary=vocabulary)
+            language_model.build_ngrams()
+            vocabulary = language_model.get_vocabulary()
+
+            prob = probability.LaplaceSmoothedDistribution(len(vocabulary))
+            prob.build_probability(language_model.get_ngrams_counts(),
+                    language_model.get_subgrams_counts())
+            distributions.append(prob)
+
+        documents = [["I am here ."], ["You are ."], ["You are walking ."]]
+        results = evaluation.classify_documents(documents, distributions,
+                ["me", "you"], vocabulary, 2, batch_size=3)
+
+        assert [label for label, scores in results] == ["me", "you", "you"]
+        for label, scores in results:
+            assert len(scores) == 2
@@ -0,0 +1,31 @@
+# Test cases for external.py
+
+from .. import NGrams
+from .. import external
+from .. import modelfile
+
+import unittest
+
+class TestExternal(unittest.TestCase):
+
+    def test_count_to_model(self):
+        inputfile = "/tmp/1"
+        outputfile = "/tmp/1.lm"
+        with open(inputfile, "w") as f:
+            for i in range(3000):
+                f.write("I am walking %d .\n" % (i % 700))
+
+        runs = external.count_to_model(inputfile, outputfile, N=3,
+                max_entries=50)
+        assert runs > 1
+
+        language_model = NGrams.NGram(inputfile)
+        language_model.build_ngrams()
+        model = modelfile.load_model(outputfile)
+
+        assert model.get_vocabulary().get_tokens() == \
+                language_model.get_vocabulary().get_tokens()
+        for n in range(1, 4):
+            for key, count in language_model.get_counts(n).iteritems():
+                assert model.get_frequency(key) == count
+        model.close()
@@ -0,0 +1,26 @@
+# Test cases for generation.py
+
+from .. import NGrams
+from .. import generation
+
+import unittest
+
+class TestGeneration(unittest.TestCase):
+
+    def test_generate(self):
+        inputfile = "/tmp/1"
+        with open(inputfile, "w") as f:
+            f.write("I am walking .\nI am .\nYou are walking .\n")
+        language_model = NGrams.NGram(inputfile, N=3)
+        language_model.build_ngrams()
+
+        generator = generation.SentenceGenerator(language_model, seed=1)
+        sentences = generator.generate_many(50)
+        assert set(sentences) == set(["I am walking .", "I am .",
+            "You are walking ."])
+
+        # Same seed gives the same sentences.
+        generator.seed(1)
+        assert generator.generate_many(50) == \
+                generation.SentenceGenerator(language_model,
+                        seed=1).generate_many(50)
@@ -0,0 +1,59 @@
+# Test cases for metrics.py
+
+from .. import NGrams
+from .. import metrics
+from .. import probability
+from .. import util
+
+import json
+import os
+import unittest
+
+class TestMetrics(unittest.TestCase):
+
+    def test_metrics(self):
+        snapshots = []
+        jsonfile = "/tmp/2"
+        if os.path.exists(jsonfile):
+            os.remove(jsonfile)
+        job_metrics = metrics.Metrics([snapshots.append,
+            metrics.JSONFileSink(jsonfile), metrics.LogSink()], interval=0)
+
+        inputfile = "/tmp/1"
+        with open(inputfile, "w") as f:
+            f.write("I am walking .\nI am .\n")
+        language_model = NGrams.NGram(inputfile, N=3)
+        language_model.build_ngrams(metrics=job_metrics)
+
+        snapshot = snapshots[-1]
+        assert snapshot["counters"]["lines"] == 2
+        assert snapshot["counters"]["tokens"] == 7
+        assert snapshot["counters"]["bytes"] == 22
+        assert snapshot["gauges"]["ngrams_3"] == \
+                len(language_model.get_ngrams())
+        assert "build_ngrams" in snapshot["timers"]
+        assert snapshot["peak_memory_kb"] > 0
+
+        prob = probability.LaplaceSmoothedDistribution(10)
+        prob.build_probability(
+                dict((k, 1) for k in language_model.get_ngrams()),
+                dict((k, 1) for k in language_model.get_subgrams()))
+        util.calculate_perplexity(inputfile, prob, 3, metrics=job_metrics)
+        assert job_metrics.counters["lines"] == 4
+        assert "calculate_perplexity" in job_metrics.timers
+
+        with open(jsonfile) as f:
+            lines = f.readlines()
+        assert len(lines) == len(snapshots)
+        assert json.loads(lines[-1])["counters"] == job_metrics.counters
+
+    def test_null_metrics(self):
+        null_metrics = metrics.NULL_METRICS
+        assert not null_metrics
+        with null_metrics.timer("phase"):
+            null_metrics.increment("lines")
+            null_metrics.set_gauge("size", 1)
+        null_metrics.report()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+# Test cases for binary model files.
+
+from .. import NGrams
+from .. import modelfile
+from .. import probability
+
+import unittest
+
+class TestModelFile(unittest.TestCase):
+
+    def test_write_and_load(self):
+        inputfile = "/tmp/1"
+        outputfile = "/tmp/1.lm"
+        with open(inputfile, "w") as f:
+            f.write("I am walking .\nI am .\nYou are walking .\n")
+
+        language_model = NGrams.NGram(inputfile, N=2)
+        language_model.build_ngrams()
+        ngrams = language_model.get_ngrams_counts()
+        subgrams = language_model.get_subgrams_counts()
+
+        prob = probability.LaplaceSmoothedDistribution(len(subgrams))
+        prob.build_probability(ngrams, subgrams)
+
+        modelfile.write_model(outputfile, language_model, prob)
+        model = modelfile.load_model(outputfile)
+
+        assert model.get_order() == 2
+        assert model.get_ngrams_frequency("I am") == 2
+        assert model.get_subgrams_frequency("walking") == 2
+        assert model.get_frequency("_START_") == 3
+        assert model.get_frequency("am I") == 0
+        assert model.get_frequency("blah") == 0
+
+        vocabulary = language_model.get_vocabulary()
+        for ngram in ["I am", "am I", ". _END_", "_START_ You"]:
+            self.assertAlmostEqual(model.get_probability(ngram),
+                    prob.get_probability(vocabulary.encode(ngram)))
+        self.assertAlmostEqual(model.get_probability("blah am"),
+                1. / len(subgrams))
+        assert model.get_metadata() == {}
+
+        model.close()
+
+    def test_backoff_distributions(self):
+        inputfile = "/tmp/1"
+        outputfile = "/tmp/1.lm"
+        with open(inputfile, "w") as f:
+            f.write("I am walking .\nI am .\nYou are walking .\n"
+                    "I am here .\n")
+
+        language_model = NGrams.NGram(inputfile, N=3)
+        language_model.build_ngrams()
+        vocabulary = language_model.get_vocabulary()
+        start = vocabulary.get_id("_START_")
+        counts = [language_model.get_counts(n) for n in range(1, 4)]
+
+        ngrams = ["_START_ I am", "I am walking", "I am You", "You are .",
+                "blah am here", "am blah .", "am here blah"]
+        for prob in [probability.KatzBackoffDistribution(),
+                probability.KneserNeyDistribution()]:
+            prob.build_probability(counts, start=start)
+            modelfile.write_model(outputfile, language_model, prob)
+            model = modelfile.load_model(outputfile)
+
+            assert model.get_ngrams_frequency("I am walking") == 1
+            for ngram in ngrams:
+                key = tuple([vocabulary.get_id(t) if t in vocabulary
+                    else -1 for t in ngram.split()])
+                self.assertAlmostEqual(model.get_probability(ngram),
+                        prob.get_probability(key))
+            model.close()
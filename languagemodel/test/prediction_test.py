@@ -0,0 +1,63 @@
+# Test cases for prediction.py
+
+from .. import NGrams
+from .. import prediction
+from .. import probability
+
+import unittest
+
+class TestPrediction(unittest.TestCase):
+
+    def test_predict(self):
+        inputfile = "/tmp/1"
+        with open(inputfile, "w") as f:
+            f.write("I am walking .\nI am .\nI am walking home .\n"
+                    "You are walking .\n")
+        language_model = NGrams.NGram(inputfile, N=3)
+        language_model.build_ngrams()
+
+        index = prediction.NextWordIndex(language_model, k=2)
+        assert [w for w, p in index.predict("I am")] == ["walking", "."]
+        assert index.predict("")[0][0] == "I"
+        vocabulary = language_model.get_vocabulary()
+        assert [w for w, p in index.predict_ids(())] == \
+                [vocabulary.get_id("_END_"), vocabulary.get_id(".")]
+        assert len(index.predict("I am", k=1)) == 1
+        self.assertAlmostEqual(index.predict("I am")[0][1], 2./3)
+
+        # Unseen histories back off to shorter ones.
+        assert index.predict("They are")[0][0] == "walking"
+        assert [w for w, p in index.predict("blah blah")] == \
+                ["_END_", "."]
+
+        # Ranking by a distribution.
+        prob = probability.LaplaceSmoothedDistribution(len(vocabulary))
+        prob.build_probability(language_model.get_ngrams_counts(),
+                language_model.get_subgrams_counts())
+        index = prediction.NextWordIndex(language_model, k=2,
+                distribution=prob)
+        self.assertAlmostEqual(index.predict("I am")[0][1],
+                prob.get_probability(vocabulary.encode("I am walking")))
+
+        indexfile = "/tmp/2"
+        index.save(indexfile)
+        mapped_index = prediction.load_index(indexfile)
+        for context in ["I am", "", "They are", "You are walking", "blah"]:
+            expected = index.predict(context)
+            predicted = mapped_index.predict(context)
+            assert [w for w, p in predicted] == [w for w, p in expected]
+            for (w, p), (w, expected_p) in zip(predicted, expected):
+                self.assertAlmostEqual(p, expected_p)
+        mapped_index.close()
+
+        # The file stores the counts of the successors and k separately.
+        index = prediction.NextWordIndex(language_model, k=1)
+        index.save(indexfile)
+        mapped_index = prediction.load_index(indexfile)
+        assert [w for w, p in mapped_index.predict("I am")] == ["walking"]
+        assert mapped_index._model.get_frequency("I am walking") == 2
+        assert mapped_index._model.get_metadata() == {"k": 1}
+        mapped_index.close()
+
+if __name__ == "__main__":
+    unittest.main()
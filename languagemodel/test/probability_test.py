@@ -1,6 +1,9 @@
 # Test cases for probability distribution.
+from .. import NGrams
 from .. import probability
+from .. import vocabulary
 
+import math
 import unittest
 
 class TestProbability(unittest.TestCase):
@@ -43,3 +46,165 @@ class TestProbability(unittest.TestCase):
 
         self.assertAlmostEqual(prob.get_probability("I am"), 0.0625)
         self.assertAlmostEqual(prob.get_probability("blah do"), 1./2)
+
+    def test_batch_probabilities(self):
+        vocab = vocabulary.Vocabulary()
+        ngrams = dict((tuple(map(vocab.add, k.split())), f)
+                for k, f in TestProbability._ngrams.iteritems())
+        subgrams = dict((tuple(map(vocab.add, k.split())), f)
+                for k, f in TestProbability._subgrams.iteritems())
+
+        # Seen, unseen with known history and unknown history.
+        batch = [vocab.encode("I am"), vocab.encode("am do"),
+                (vocab.add("blah"), vocab.get_id("do"))]
+
+        distributions = [
+                probability.ProbabilityDistribution(len(subgrams)),
+                probability.LaplaceSmoothedDistribution(len(subgrams)),
+                probability.GoodTuringDistribution()]
+        for prob in distributions:
+            if isinstance(prob, probability.GoodTuringDistribution):
+                prob.build_probability(ngrams)
+            else:
+                prob.build_probability(ngrams, subgrams)
+
+            probs = prob.get_probabilities(batch)
+            log_probs = prob.get_log_probabilities(batch)
+            for i, ngram in enumerate(batch):
+                self.assertAlmostEqual(probs[i], prob.get_probability(ngram))
+                if probs[i] > 0:
+                    self.assertAlmostEqual(math.exp(log_probs[i]), probs[i])
+
+    def test_key_index(self):
+        # Keys of 5 ids up to 10000 do not fit in 64 bits.
+        table = {(0, 1, 2, 3, 4): 1., (10000, 0, 0, 0, 0): 2.,
+                (4, 3, 2, 1, 0): 3.}
+        for order in [5, 2]:
+            keys = dict((k[:order], v) for k, v in table.iteritems())
+            index = probability.KeyIndex(keys)
+            found, values = index.lookup(probability._as_id_array(
+                keys.keys() + [(5,) * order, (-1,) * order]))
+            assert found.tolist() == [True] * len(keys) + [False, False]
+            assert values.tolist() == keys.values() + [0., 0.]
+
+            # A new key with a larger id is inserted.
+            new_key = (20000,) * order
+            keys[new_key] = 4.
+            assert index.update({new_key: 4.})
+            found, values = index.lookup(probability._as_id_array(
+                keys.keys()))
+            assert found.all()
+            assert values.tolist() == keys.values()
+
+        # Packed keys are converted when they stop fitting in 64 bits.
+        keys = {(0, 1, 2, 3, 4): 1.}
+        index = probability.KeyIndex(keys)
+        keys[(20000,) * 5] = 2.
+        assert index.update({(20000,) * 5: 2.})
+        found, values = index.lookup(probability._as_id_array(keys.keys()))
+        assert values.tolist() == keys.values()
+
+    def test_good_turing_refit(self):
+        prob = probability.GoodTuringDistribution()
+        prob.build_probability(TestProbability._ngrams)
+        r_star = prob._prob_array
+
+        # Same frequency of frequency, the fitted tables are reused.
+        ngrams = dict(("x " + k, f)
+                for k, f in TestProbability._ngrams.iteritems())
+        prob.build_probability(ngrams)
+        assert prob._prob_array is r_star
+        self.assertAlmostEqual(prob.get_probability("x I am"), 0.0625)
+        self.assertAlmostEqual(prob.get_probability("I am"), 1./2)
+
+    def test_incremental_update(self):
+        inputfile = "/tmp/1"
+        with open(inputfile, "w") as f:
+            f.write("I am walking .\nYou are .\n")
+        language_model = NGrams.NGram(inputfile)
+        language_model.build_ngrams()
+        ngrams = language_model.get_ngrams_counts()
+        subgrams = language_model.get_subgrams_counts()
+
+        def build(prob, ngrams, subgrams):
+            if isinstance(prob, probability.GoodTuringDistribution):
+                prob.build_probability(ngrams)
+            else:
+                prob.build_probability(ngrams, subgrams)
+            return prob
+
+        factories = [
+                lambda: probability.ProbabilityDistribution(10),
+                lambda: probability.LaplaceSmoothedDistribution(10),
+                probability.GoodTuringDistribution]
+        distributions = [build(f(), ngrams, subgrams) for f in factories]
+
+        vocab = language_model.get_vocabulary()
+        indexes = []
+        for prob in distributions:
+            prob.get_probabilities([vocab.encode("I am walking")])
+            indexes.append(prob._index)
+
+        lines = ["I am .\n", "I am walking .\n", "They are here .\n"]
+        delta = language_model.update(lines).get_ngrams_counts()
+        batch = [vocab.encode(k) for k in ["_START_ I am", "I am walking",
+            "I am .", "You are .", "They are here", "are here ."]]
+
+        for factory, prob, index in zip(factories, distributions, indexes):
+            prob.update(delta)
+            updated = prob.get_probabilities(batch)
+            prob.refresh()
+            # The index is patched, not built again.
+            assert prob._index is index
+
+            # Same as building from scratch on the updated counts.
+            rebuilt = build(factory(), dict(ngrams), dict(subgrams))
+            for i, ngram in enumerate(batch):
+                expected = rebuilt.get_probability(ngram)
+                self.assertAlmostEqual(updated[i], expected)
+                self.assertAlmostEqual(prob.get_probability(ngram), expected)
+
+    def test_update_vocabulary(self):
+        inputfile = "/tmp/1"
+        with open(inputfile, "w") as f:
+            f.write("I am walking .\nYou are .\n")
+        language_model = NGrams.NGram(inputfile, N=2)
+        language_model.build_ngrams()
+        vocab = language_model.get_vocabulary()
+        ngrams = language_model.get_ngrams_counts()
+        subgrams = language_model.get_subgrams_counts()
+
+        prob = probability.LaplaceSmoothedDistribution(len(vocab))
+        prob.build_probability(ngrams, subgrams)
+        delta = language_model.update(["They are here .\n"])
+        prob.update(delta.get_ngrams_counts(), len(vocab))
+        prob.refresh()
+
+        rebuilt = probability.LaplaceSmoothedDistribution(len(vocab))
+        rebuilt.build_probability(dict(ngrams), dict(subgrams))
+        batch = [vocab.encode(k) for k in ["I am", "am walking",
+            "They are", "are here", "You here"]]
+        for ngram in batch:
+            self.assertAlmostEqual(prob.get_probability(ngram),
+                    rebuilt.get_probability(ngram))
+        for p, expected in zip(prob.get_probabilities(batch),
+                rebuilt.get_probabilities(batch)):
+            self.assertAlmostEqual(p, expected)
+
+    def test_backoff_distributions(self):
+        counts = [TestProbability._subgrams, TestProbability._ngrams]
+        words = [w for w in TestProbability._subgrams if w != "_START_"]
+
+        distributions = [
+                probability.KatzBackoffDistribution(len(words) + 1),
+                probability.KneserNeyDistribution(len(words))]
+        for prob in distributions:
+            prob.build_probability(counts, start="_START_")
+
+            for history in ["_START_", "I", "blah"]:
+                total = sum(prob.get_probability(history + " " + w)
+                        for w in words)
+                self.assertAlmostEqual(total, 1.)
+
+            assert prob.get_probability("I am") > \
+                    prob.get_probability("I .")
@@ -0,0 +1,85 @@
+# Test cases for pruning.py
+
+from .. import NGrams
+from .. import probability
+from .. import pruning
+
+import unittest
+
+class TestPruning(unittest.TestCase):
+
+    def setUp(self):
+        self._inputfile = "/tmp/1"
+        with open(self._inputfile, "w") as f:
+            f.write("I am walking .\nI am .\nI am here .\nYou are .\n")
+        self._language_model = NGrams.NGram(self._inputfile, N=3)
+        self._language_model.build_ngrams()
+
+    def test_prune_by_count(self):
+        language_model = self._language_model
+        pruning.prune_by_count(language_model, {2: 2, 3: 2})
+
+        assert language_model.get_ngrams_frequency("_START_ I am") == 3
+        assert language_model.get_ngrams_frequency("I am walking") == 0
+        assert language_model.get_subgrams_frequency("You are") == 0
+
+        # Histories of the kept trigrams are kept.
+        assert language_model.get_subgrams_frequency("_START_ _START_") == 4
+
+    def test_prune_top_k(self):
+        language_model = self._language_model
+        pruning.prune_top_k(language_model, 1, orders=[3])
+
+        assert language_model.get_ngrams_frequency("_START_ I am") == 3
+        assert len([k for k in language_model.get_ngrams()
+            if k.startswith("I am ")]) == 1
+        assert language_model.get_subgrams_frequency("am here") == 1
+
+    def test_backoff_after_pruning(self):
+        language_model = NGrams.NGram(self._inputfile, N=2)
+        language_model.build_ngrams()
+        vocabulary = language_model.get_vocabulary()
+        start = vocabulary.get_id("_START_")
+        am = vocabulary.get_id("am")
+        tokens = [vocabulary.get_id(t) for t in vocabulary.get_tokens()
+                if t != "_START_"]
+
+        def get_probabilities(cls):
+            prob = cls()
+            prob.build_probability([language_model.get_counts(1),
+                language_model.get_counts(2)], start=start)
+            return dict((w, prob.get_probability((am, w))) for w in tokens)
+
+        katz = get_probabilities(probability.KatzBackoffDistribution)
+        counts = language_model.get_counts(2)
+        pruning.prune_top_k(language_model, 1, orders=[2])
+        # The table is replaced, not changed in place.
+        assert len(counts) == 11
+        assert len(language_model.get_counts(2)) == 8
+
+        here = vocabulary.get_id("here")
+        walking = vocabulary.get_id("walking")
+        pruned_katz = get_probabilities(probability.KatzBackoffDistribution)
+        # The kept bigram keeps its probability, the pruned ones back off.
+        self.assertAlmostEqual(pruned_katz[here], katz[here])
+        assert 0 < pruned_katz[walking] < katz[walking]
+        self.assertAlmostEqual(sum(pruned_katz.values()), 1.)
+
+        kneser_ney = get_probabilities(probability.KneserNeyDistribution)
+        assert 0 < kneser_ney[walking] < kneser_ney[here] < 0.5
+        self.assertAlmostEqual(sum(kneser_ney.values()), 1.)
+
+    def test_evaluate_pruning(self):
+        def build_distribution(model):
+            prob = probability.KneserNeyDistribution()
+            prob.build_probability(
+                    [model.get_counts(n) for n in range(1, 4)])
+            return prob
+
+        report = pruning.evaluate_pruning(self._language_model,
+                [("entropy", lambda m: pruning.prune_by_entropy(m, 0.01))],
+                self._inputfile, build_distribution)
+
+        assert [r["setting"] for r in report] == ["unpruned", "entropy"]
+        assert report[1]["size"] < report[0]["size"]
+        assert report[1]["perplexity"] >= report[0]["perplexity"]
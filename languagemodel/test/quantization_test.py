@@ -0,0 +1,103 @@
+# Test cases for quantization.py
+
+from .. import NGrams
+from .. import probability
+from .. import quantization
+
+import math
+import unittest
+
+class TestQuantization(unittest.TestCase):
+
+    def setUp(self):
+        self._inputfile = "/tmp/1"
+        with open(self._inputfile, "w") as f:
+            f.write("I am walking .\nI am .\nI am here .\nYou are .\n")
+        self._testfile = "/tmp/2"
+        with open(self._testfile, "w") as f:
+            f.write("I am here .\nYou are walking .\nYou blah .\n")
+
+        self._language_model = NGrams.NGram(self._inputfile, N=3)
+        self._language_model.build_ngrams()
+
+    def test_codebook(self):
+        values = [math.log(p) for p in [0.5, 0.25, 0.125, 0.001]] + \
+                [float("-inf")]
+        codebook = quantization.Codebook(values, bits=8)
+        assert len(codebook) == 5
+        assert codebook.decode(codebook.encode(values)).tolist() == values
+
+        values = [i / 1000. for i in range(1000)]
+        codebook = quantization.Codebook(values, bits=8)
+        assert len(codebook) == 256
+        assert codebook.encode(values).dtype.itemsize == 1
+        decoded = codebook.decode(codebook.encode(values))
+        assert max(abs(a - b) for a, b in zip(decoded, values)) < 0.003
+
+        self.assertRaises(ValueError, quantization.Codebook, values, 4)
+
+    def test_count_table(self):
+        counts = self._language_model.get_counts(2)
+        table = quantization.CountTable(counts)
+        assert len(table) == len(counts)
+        assert dict(table.iteritems()) == counts
+        assert sorted(table) == sorted(counts)
+        for k, f in counts.iteritems():
+            assert table[k] == f
+            assert k in table
+        assert table.get((-1, 0)) is None
+        assert table.get((0,), 7) == 7
+        assert quantization.get_memory(table) < \
+                quantization.get_memory(counts)
+
+        # Keys of 5 ids up to 10000 do not fit in 64 bits.
+        counts = {(0, 1, 2, 3, 4): 1, (10000, 0, 0, 0, 0): 2,
+                (4, 3, 2, 1, 0): 3}
+        table = quantization.CountTable(counts)
+        assert dict(table.iteritems()) == counts
+        assert table[(10000, 0, 0, 0, 0)] == 2
+        assert table.get((5, 0, 0, 0, 0)) is None
+        found, values = table.lookup(probability._as_id_array(counts.keys()
+            + [(-1, 0, 0, 0, 0)]))
+        assert found.tolist() == [True, True, True, False]
+        assert values.tolist() == counts.values() + [0]
+
+        quantization.compact_counts(self._language_model)
+        assert self._language_model.get_ngrams_frequency("_START_ I am") == 3
+
+    def test_quantize_distribution(self):
+        language_model = self._language_model
+        vocabulary = language_model.get_vocabulary()
+        start = vocabulary.get_id(NGrams.NGram._START_MARKER_)
+        ngrams = language_model.get_ngrams_counts()
+        subgrams = language_model.get_subgrams_counts()
+        counts = [language_model.get_counts(n) for n in range(1, 4)]
+
+        laplace = probability.LaplaceSmoothedDistribution(len(vocabulary))
+        laplace.build_probability(ngrams, subgrams)
+        good_turing = probability.GoodTuringDistribution()
+        good_turing.build_probability(ngrams)
+        katz = probability.KatzBackoffDistribution()
+        katz.build_probability(counts, start=start)
+        kneser_ney = probability.KneserNeyDistribution()
+        kneser_ney.build_probability(counts, start=start)
+
+        keys = [k + (w,) for k in subgrams for w in range(len(vocabulary))]
+        for distribution in [laplace, good_turing, katz, kneser_ney]:
+            expected = distribution.get_probabilities(keys)
+            quantized = quantization.quantize_distribution(distribution, 16)
+            for k, p in zip(keys, expected):
+                self.assertAlmostEqual(quantized.get_probability(k), p)
+            probs = quantized.get_probabilities(keys)
+            for p, other in zip(probs, expected):
+                self.assertAlmostEqual(p, other)
+
+        report = quantization.evaluate_quantization(kneser_ney,
+                self._testfile, vocabulary, 3, bits=[8])
+        assert [r["bits"] for r in report] == [None, 8]
+        assert report[1]["size"] < report[0]["size"]
+        self.assertAlmostEqual(report[1]["perplexity"],
+                report[0]["perplexity"], places=2)
+
+if __name__ == "__main__":
+    unittest.main()
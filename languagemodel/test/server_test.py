@@ -0,0 +1,73 @@
+# Test cases for server.py
+
+from .. import NGrams
+from .. import evaluation
+from .. import probability
+from .. import server
+
+import json
+import threading
+import unittest
+import urllib2
+
+class TestServer(unittest.TestCase):
+
+    def test_scorer(self):
+        trainfile = "/tmp/1"
+        testfile = "/tmp/2"
+        with open(trainfile, "w") as f:
+            f.write("I am walking .\nI am .\nYou are walking .\n")
+        sentences = ["I am walking .", "I am .", "You are blah .",
+                "I am walking ."]
+        with open(testfile, "w") as f:
+            f.write("\n".join(sentences) + "\n")
+
+        language_model = NGrams.NGram(trainfile, N=3)
+        language_model.build_ngrams()
+        vocabulary = language_model.get_vocabulary()
+        subgrams = language_model.get_subgrams_counts()
+        prob = probability.LaplaceSmoothedDistribution(len(vocabulary))
+        prob.build_probability(language_model.get_ngrams_counts(), subgrams)
+
+        scorer = server.SentenceScorer(prob, vocabulary, 3)
+        log_probs, token_counts = scorer.score(sentences)
+
+        expected = evaluation.evaluate_perplexity(testfile, prob,
+                vocabulary, 3)
+        for log_prob, expected_log_prob in zip(log_probs,
+                expected.log_probs):
+            self.assertAlmostEqual(log_prob, expected_log_prob)
+        assert token_counts == expected.token_counts
+
+        # The repeated sentence and the shared prefix come from the cache.
+        stats = scorer.get_stats()
+        assert stats["requests"] == 1
+        assert stats["prefix_cache"]["hits"] == 2
+        assert stats["prefix_cache"]["misses"] == 2
+        # One entry per token and end marker of the distinct prefixes.
+        assert stats["prefix_cache"]["size"] == 5 + 2 + 5
+
+        # A cached sentence is scored again with the same value.
+        assert scorer.score(sentences[:1])[0] == log_probs[:1]
+        assert stats["latency_p50"] <= stats["latency_p99"]
+
+        http_server = server.ScoringServer(scorer, port=0)
+        thread = threading.Thread(target=http_server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        try:
+            url = "http://127.0.0.1:%d" % http_server.server_address[1]
+            response = json.load(urllib2.urlopen(url + "/score",
+                json.dumps({"sentences": sentences[:1]})))
+            self.assertAlmostEqual(response["log_probs"][0], log_probs[0])
+            stats = json.load(urllib2.urlopen(url + "/stats"))
+            assert stats["requests"] == 3
+        finally:
+            http_server.shutdown()
+            http_server.server_close()
+
+        # Blank sentences have no tokens, as in evaluate_perplexity.
+        assert scorer.score([""])[1] == [0]
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,136 @@
+# Test cases for sketch.py
+
+from .. import NGrams
+from .. import probability
+from .. import sketch
+
+import unittest
+
+class TestSketch(unittest.TestCase):
+
+    def test_count_min_sketch(self):
+        width, depth = sketch.CountMinSketch.get_dimensions(0.01, 0.01)
+        counter = sketch.CountMinSketch(width, depth)
+        for i in range(1000):
+            counter.add((i % 100, 1))
+
+        for i in range(100):
+            estimate = counter.estimate((i, 1))
+            assert 10 <= estimate <= 10 + counter.get_error_bound()
+
+    def test_approximate_ngram(self):
+        inputfile = "/tmp/1"
+        with open(inputfile, "w") as f:
+            for i in range(20):
+                f.write("I am walking .\nYou are %d .\n" % i)
+
+        exact_model = NGrams.NGram(inputfile)
+        exact_model.build_ngrams()
+        language_model = sketch.ApproximateNGram(inputfile, width=1024,
+                depth=4, heavy_hitters=8)
+        language_model.build_ngrams()
+
+        for ngram in exact_model.get_ngrams():
+            exact = exact_model.get_ngrams_frequency(ngram)
+            estimate = language_model.get_ngrams_frequency(ngram)
+            assert exact <= estimate <= exact + \
+                    language_model.get_error_bound()
+
+        # The heavy hitters table keeps the frequent n-grams.
+        assert len(language_model.get_ngrams()) <= 16
+        assert "I am walking" in language_model.get_ngrams()
+
+        prob = probability.LaplaceSmoothedDistribution(
+                len(language_model.get_vocabulary()))
+        prob.build_probability(language_model.get_ngrams_counts(),
+                language_model.get_subgrams_counts())
+        assert prob.get_probability(
+                language_model.get_vocabulary().encode("I am walking")) > 0
+
+    def test_heavy_hitter_histories(self):
+        inputfile = "/tmp/1"
+        with open(inputfile, "w") as f:
+            f.write("a b c\na b c\n")
+            for i in range(30):
+                f.write("r%d p%d q%d\n" % (i, i, i))
+
+        language_model = sketch.ApproximateNGram(inputfile, width=1024,
+                depth=4, heavy_hitters=4)
+        language_model.build_ngrams()
+
+        ngrams = language_model.get_ngrams_counts()
+        subgrams = language_model.get_subgrams_counts()
+        assert all(k[:-1] in subgrams for k in ngrams)
+
+        prob = probability.LaplaceSmoothedDistribution(
+                len(language_model.get_vocabulary()))
+        prob.build_probability(ngrams, subgrams)
+
+    def test_merge(self):
+        models = []
+        for i, text in enumerate(["I am walking .\n", "You are here .\n"]):
+            inputfile = "/tmp/%d" % i
+            with open(inputfile, "w") as f:
+                f.write(text * 3)
+            language_model = sketch.ApproximateNGram(inputfile, width=1024,
+                    depth=4, heavy_hitters=100)
+            language_model.build_ngrams()
+            models.append(language_model)
+
+        language_model = models[0].merge(models[1])
+        assert language_model.get_ngrams_frequency("I am walking") >= 3
+        assert language_model.get_ngrams_frequency("You are here") >= 3
+        assert language_model.get_frequency("_START_ _START_") >= 6
+        assert "You are here" in language_model.get_ngrams()
+
+    def test_parallel_and_update(self):
+        inputfile = "/tmp/1"
+        with open(inputfile, "w") as f:
+            for i in range(20):
+                f.write("I am walking .\nYou are %d .\n" % i)
+
+        expected = sketch.ApproximateNGram(inputfile, width=1024, depth=4,
+                heavy_hitters=100)
+        expected.build_ngrams()
+
+        for use_corpus in [False, True]:
+            language_model = sketch.ApproximateNGram(inputfile, width=1024,
+                    depth=4, heavy_hitters=100)
+            language_model.build_ngrams(processes=2, shard_size=64,
+                    use_corpus=use_corpus)
+            assert language_model.get_ngrams_frequency("I am walking") \
+                    == expected.get_ngrams_frequency("I am walking")
+            assert language_model.get_ngrams_counts() == \
+                    expected.get_ngrams_counts()
+
+        delta = expected.update(["I am walking .\n", "They are here .\n"])
+        assert isinstance(delta, sketch.ApproximateNGram)
+        assert delta.get_ngrams_frequency("I am walking") >= 1
+        assert expected.get_ngrams_frequency("I am walking") >= 21
+        assert "They are here" in expected.get_ngrams()
+
+    def test_history_counts(self):
+        inputfile = "/tmp/1"
+        with open(inputfile, "w") as f:
+            for i in range(300):
+                f.write(" ".join("w%d" % ((i * j * 7 + j) % 31)
+                    for j in range(6)) + "\n")
+
+        # Small sketches overestimate a lot and trim often.
+        language_model = sketch.ApproximateNGram(inputfile, width=64,
+                depth=2, heavy_hitters=20)
+        language_model.build_ngrams()
+
+        for n in range(2, 4):
+            histories = language_model.get_counts(n - 1)
+            totals = {}
+            for k, f in language_model.get_counts(n).iteritems():
+                totals[k[:-1]] = totals.get(k[:-1], 0) + f
+            assert all(histories[h] >= f for h, f in totals.iteritems())
+
+        prob = probability.ProbabilityDistribution(
+                len(language_model.get_vocabulary()))
+        prob.build_probability(language_model.get_ngrams_counts(),
+                language_model.get_subgrams_counts())
+        assert all(prob.get_probability(k) <= 1
+                for k in language_model.get_ngrams_counts())
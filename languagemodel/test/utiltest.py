@@ -29,6 +29,87 @@ def test_preprocess_text():
             line = l.strip()
             assert line == expected[i]
 
+    # Reading in small chunks with a worker pool gives the same result.
+    util.preprocess_text(inputfile, outputfile, chunk_size=100,
+            processes=2)
+
+    with open(outputfile) as f:
+        assert [l.strip() for l in f] == expected
+
+
+def test_lemma_cache():
+
+    class Lemmatizer(object):
+        def lemmatize(self, token):
+            return token.rstrip("s")
+
+    cache = util.LemmaCache(max_size=2, lemmatizer=Lemmatizer())
+    assert cache.lemmatize("cats") == "cat"
+    assert cache.lemmatize("cats") == "cat"
+    assert cache.lemmatize("dogs") == "dog"
+    assert cache.lemmatize("birds") == "bird"
+    assert len(cache) == 2
+    assert cache.get_stats()["hits"] == 1
+
+    cachefile = "/tmp/lemmas.json"
+    cache.save(cachefile)
+    loaded_cache = util.LemmaCache(lemmatizer=Lemmatizer())
+    loaded_cache.load(cachefile)
+    assert loaded_cache.lemmatize("birds") == "bird"
+    assert loaded_cache.lemmatize("cats") == "cat"
+    assert loaded_cache.get_stats()["misses"] == 1
+
+def _split(sentence):
+    return sentence.replace(".", " .").split()
+
+def test_preprocessor():
+    from nltk.tokenize.punkt import PunktSentenceTokenizer
+
+    class Lemmatizer(object):
+        def lemmatize(self, token):
+            return token.rstrip("s")
+
+    # Neither of these need nltk data.
+    cache = util.LemmaCache(lemmatizer=Lemmatizer())
+    preprocessor = util.Preprocessor(lemma_cache=cache,
+            sentence_tokenizer=PunktSentenceTokenizer(),
+            word_tokenizer=_split)
+
+    text = "The cats sleep. The dogs bark at cats."
+    expected = ["The cat sleep .", "The dog bark at cat ."]
+    assert preprocessor.process_text(text) == expected
+
+    paths = []
+    for i in range(5):
+        paths.append("/tmp/preprocessor_%d.txt" % i)
+        with open(paths[-1], "w") as f:
+            f.write(text)
+
+    outputs = preprocessor.process_many(paths)
+    assert outputs == [p + ".processed" for p in paths]
+
+    # Workers get a copy of the warm cache, so they do not need the
+    # lemmatizer, which is not pickled. They send back what they learn.
+    cold_cache = util.LemmaCache(lemmatizer=Lemmatizer())
+    with util.Preprocessor(processes=2, lemma_cache=cold_cache,
+            sentence_tokenizer=PunktSentenceTokenizer(),
+            word_tokenizer=_split) as pool_preprocessor:
+        pool_preprocessor.process_many(paths, [p + ".pool" for p in paths])
+    assert cold_cache.get("cats", count=False) == "cat"
+    stats = cold_cache.get_stats()
+    assert stats["hits"] + stats["misses"] == 5 * 10
+
+    with util.Preprocessor(processes=2, lemma_cache=cache,
+            sentence_tokenizer=PunktSentenceTokenizer(),
+            word_tokenizer=_split) as pool_preprocessor:
+        assert pool_preprocessor.process_text(" ".join([text] * 3)) == \
+                expected * 3
+        pool_outputs = pool_preprocessor.process_many(paths,
+                [p + ".pool" for p in paths])
+
+    for output in outputs + pool_outputs:
+        with open(output) as f:
+            assert [l.strip() for l in f] == expected
 
 def test_ngrams_from_line():
 
@@ -47,6 +128,21 @@ def test_ngrams_from_line():
     assert expected_ngrams == actual_ngrams
     assert expected_subgrams == actual_subgrams
 
+def test_ngram_ids_from_line():
+
+    # Ids of _START_, _END_, I, am, walking and .
+    ids = [2, 3, 4, 5]
+    expected_ngrams = [(0, 0, 2), (0, 2, 3), (2, 3, 4), (3, 4, 5),
+            (4, 5, 1)]
+
+    assert util.get_ngram_ids_from_line(ids, 3, 0, 1) == expected_ngrams
+    assert util.get_ngram_ids_from_line([], 2, 0, 1) == [(0, 1)]
+
+    # Short lines only give the N-grams of the padded line.
+    assert util.get_ngrams_from_line("", 3, "<s>", "</s>") == \
+            ["<s> <s> </s>", "<s> </s>"]
+    assert util.get_ngram_ids_from_line([], 3, 0, 1) == [(0, 0, 1)]
+
 def test_calculate_perplexity():
 
     inputfile = "/tmp/2.txt"
@@ -0,0 +1,93 @@
+# Test cases for vocabulary.py
+
+from .. import NGrams
+from .. import evaluation
+from .. import modelfile
+from .. import probability
+from .. import util
+from .. import vocabulary
+
+import unittest
+
+class TestVocabulary(unittest.TestCase):
+
+    def test_is_nontrivial(self):
+        assert vocabulary.is_nontrivial("walking")
+        assert not vocabulary.is_nontrivial("<div>")
+        assert not vocabulary.is_nontrivial("aaa")
+        assert not vocabulary.is_nontrivial("xyz")
+        assert not vocabulary.is_nontrivial("2nd")
+
+    def test_build_vocabulary(self):
+        inputfile = "/tmp/1"
+        with open(inputfile, "w") as f:
+            f.write("<html> I am walking .\nI am .\nYou are walking .\n"
+                    "I am here .\n")
+
+        vocab = vocabulary.build_vocabulary([inputfile], min_count=2)
+        assert vocab.is_frozen()
+        assert vocab.get_tokens()[:3] == ["_START_", "_END_", "UNK"]
+        assert vocab.get_tokens()[3:] == [".", "I", "am", "walking"]
+        assert vocab.get_id("here") == vocab.get_id("UNK")
+        assert vocab.add("new") == vocab.get_id("UNK")
+        assert len(vocab) == 7
+
+        vocab = vocabulary.build_vocabulary([inputfile], max_size=2,
+                unknown_tokens=2, nontrivial=True)
+        assert vocab.get_tokens()[4:] == [".", "am"]
+        assert vocab.get_id("walking") == vocab.get_id("UNK_NONTRIV")
+        assert vocab.get_id("<html>") == vocab.get_id("UNK")
+        assert vocab.map_line("I am here !") == "UNK am UNK_NONTRIV UNK"
+        assert vocab.has_nontrivial_class()
+
+    def test_training_with_vocabulary(self):
+        trainfile = "/tmp/1"
+        testfile = "/tmp/2"
+        with open(trainfile, "w") as f:
+            f.write("I am walking .\nI am .\nYou are walking .\n")
+        with open(testfile, "w") as f:
+            f.write("I am running .\nThey are walking .\n")
+
+        vocab = vocabulary.build_vocabulary([trainfile], min_count=2,
+                nontrivial=True)
+        language_model = NGrams.NGram(trainfile, N=2, vocabulary=vocab)
+        language_model.build_ngrams()
+        assert len(vocab) == 8
+        assert language_model.get_frequency("UNK_NONTRIV") == 2
+        assert language_model.get_frequency("You are") == 1
+
+        prob = probability.LaplaceSmoothedDistribution(len(vocab))
+        prob.build_probability(language_model.get_ngrams_counts(),
+                language_model.get_subgrams_counts())
+        string_prob = probability.LaplaceSmoothedDistribution(len(vocab))
+        string_prob.build_probability(
+                dict((vocab.decode(k), f) for k, f in
+                    language_model.get_ngrams_counts().iteritems()),
+                dict((vocab.decode(k), f) for k, f in
+                    language_model.get_subgrams_counts().iteritems()))
+
+        result = evaluation.evaluate_perplexity(testfile, prob, vocab, 2)
+        self.assertAlmostEqual(result.get_perplexity(),
+                util.calculate_perplexity(testfile, string_prob, 2,
+                    vocabulary=vocab))
+
+        modelfile.write_model("/tmp/3", language_model, prob)
+        model = modelfile.load_model("/tmp/3")
+        assert model.get_vocabulary().is_frozen()
+        self.assertAlmostEqual(model.get_probability("I running"),
+                prob.get_probability(vocab.encode("I UNK_NONTRIV")))
+        model.close()
+
+        # A literal UNK token does not freeze the vocabulary of the file.
+        with open(trainfile, "w") as f:
+            f.write("I am UNK .\n")
+        language_model = NGrams.NGram(trainfile, N=2)
+        language_model.build_ngrams()
+        modelfile.write_model("/tmp/3", language_model)
+        model = modelfile.load_model("/tmp/3")
+        assert not model.get_vocabulary().is_frozen()
+        assert model.get_frequency("am UNK") == 1
+        model.close()
+
+if __name__ == "__main__":
+    unittest.main()
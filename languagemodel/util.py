@@ -1,8 +1,17 @@
 # Miscellaneous utility functions.
 
 from NGrams import NGram
+from metrics import NULL_METRICS
 
-def preprocess_text(inputfile, outputfile):
+# Size of the chunks read by preprocess_text (1 MB).
+_CHUNK_SIZE_ = 1024 * 1024
+
+# Number of sentences sent to the worker pool at a time, and between
+# updates of the metrics.
+_BATCH_SIZE_ = 10000
+
+def preprocess_text(inputfile, outputfile, chunk_size=None, processes=None,
+        lemma_cache=None, metrics=None):
     """Performs preprocessing on raw text for creating vocabulary.
 
     This method performs sentence segmentation, tokenizer and
@@ -16,39 +25,404 @@ def preprocess_text(inputfile, outputfile):
     After preprocessing, it writes back the resultant sentences
     to outputfile, where each line represents a single sentence.
 
+    The input is read in chunks and the sentences are written as soon
+    as they are complete, so the memory usage does not depend on the
+    size of the input.
+
     param:
     ----
     inputfile: Path to input file.
     outputfile: Path to output file.
+    chunk_size: Number of bytes to read at a time. A sentence longer
+        than this is split.
+    processes: Number of worker processes for tokenization and
+        lemmatization. The order of the sentences is kept.
+    lemma_cache: LemmaCache to use for lemmatization. With a worker
+        pool, each worker starts with a copy of it.
+    metrics: metrics.Metrics to which the sentences and tokens written
+        and the bytes read are reported.
+
+    To process many files or texts, use a single Preprocessor instead,
+    this function loads the resources on every call.
     """
 
-    import nltk
-
-    # Load Punkt sentence segmenter model
-    punkt_model = "nltk:tokenizers/punkt/english.pickle"
-    sentence_tokenizer = nltk.data.load(punkt_model)
+    with Preprocessor(chunk_size, processes, lemma_cache) as preprocessor:
+        preprocessor.process_file(inputfile, outputfile, metrics)
 
-    # Initilize lemmatizer
-    lemmatizer = nltk.WordNetLemmatizer()
+class Preprocessor(object):
+    """Sentence segmentation, tokenization and lemmatization of text.
 
-    with open(inputfile) as f:
-        raw_data = f.read()
+    The Punkt model, the lemmatizer and the worker pool are loaded once
+    and reused for every text and file given to the instance, so many
+    small documents can be processed without paying for the setup each
+    time. See preprocess_text for the steps.
+    """
 
-    # Sentence segmentation
-    lines = sentence_tokenizer.tokenize(raw_data)
+    def __init__(self, chunk_size=None, processes=None, lemma_cache=None,
+            sentence_tokenizer=None, word_tokenizer=None):
+        """Loads the resources.
+
+        param
+        ----
+        chunk_size: Number of bytes to read at a time. A sentence longer
+            than this is split.
+        processes: Number of worker processes. Each worker gets a copy
+            of this instance once, when the pool starts, and sends the
+            new lemmas back with its results.
+        lemma_cache: LemmaCache to use for lemmatization.
+        sentence_tokenizer: Sentence segmenter, defaults to the Punkt
+            model of nltk data.
+        word_tokenizer: Function splitting a sentence into tokens,
+            defaults to nltk.word_tokenize.
+        """
+        import nltk
+
+        if sentence_tokenizer is None:
+            # Load Punkt sentence segmenter model
+            punkt_model = "nltk:tokenizers/punkt/english.pickle"
+            sentence_tokenizer = nltk.data.load(punkt_model)
+
+        self._chunk_size = chunk_size if chunk_size is not None \
+                else _CHUNK_SIZE_
+        self._sentence_tokenizer = sentence_tokenizer
+        self._word_tokenizer = word_tokenizer or nltk.word_tokenize
+        self._lemma_cache = lemma_cache if lemma_cache is not None \
+                else LemmaCache()
+        self._processes = processes
+        self._pool = None
+
+    def __getstate__(self):
+        # Workers process their share serially.
+        state = self.__dict__.copy()
+        state["_processes"] = None
+        state["_pool"] = None
+        return state
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+        return False
+
+    def close(self):
+        """Stops the worker pool."""
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def _get_pool(self):
+        if self._pool is None and self._processes is not None and \
+                self._processes > 1:
+            import copy
+            import multiprocessing
+
+            # The copy has no pool, see __getstate__.
+            self._pool = multiprocessing.Pool(self._processes,
+                    _set_preprocessor, (copy.copy(self),))
+        return self._pool
+
+    def normalize(self, sentence):
+        """Returns the lemmas of a sentence separated by a single space."""
+        lemmatize = self._lemma_cache.lemmatize
+        return " ".join([lemmatize(t) for t in self._word_tokenizer(sentence)])
+
+    def _normalize_all(self, sentences):
+        pool = self._get_pool()
+        if pool is None:
+            return [self.normalize(l) for l in sentences]
+        return self._merge_changes(pool.imap(_normalize_in_worker,
+            sentences, chunksize=256))
+
+    def _merge_changes(self, results):
+        """Adds the lemmas learned by the workers to the cache."""
+        for result, changes in results:
+            self._lemma_cache.merge_changes(changes)
+            yield result
+
+    def process_text(self, text):
+        """Returns the normalized sentences of a text, see normalize."""
+        return list(self._normalize_all(
+            self._sentence_tokenizer.tokenize(text)))
+
+    def process_file(self, inputfile, outputfile, metrics=None):
+        """Writes the normalized sentences of a file, one per line.
+
+        The input is read in chunks and the sentences are written as
+        soon as they are complete, so the memory usage does not depend
+        on the size of the input.
+
+        param
+        ----
+        inputfile: Path to input file.
+        outputfile: Path to output file.
+        metrics: metrics.Metrics to which the sentences and tokens
+            written and the bytes read are reported.
+        """
+        if metrics is None:
+            metrics = NULL_METRICS
+
+        with metrics.timer("preprocess_text"), open(inputfile) as f_in, \
+                open(outputfile, "w") as f:
+            lines = iter_sentences(f_in, self._sentence_tokenizer,
+                    self._chunk_size)
+            for batch in _get_batches(lines, _BATCH_SIZE_):
+                # Writing the sentence back where each word is separated
+                # by a single space
+                tokens = 0
+                for l in self._normalize_all(batch):
+                    f.write(l)
+                    f.write("\n")
+                    if metrics:
+                        tokens += l.count(" ") + 1
+
+                metrics.increment("sentences", len(batch))
+                metrics.increment("tokens", tokens)
+                metrics.set_gauge("bytes_read", f_in.tell())
+                metrics.maybe_report()
+
+        metrics.report()
+
+    def process_many(self, paths, outputs=None, metrics=None):
+        """Processes many files, see process_file.
+
+        With a worker pool, each worker processes whole files, which
+        suits many small files better than sharing out sentences. The
+        lemmas learned by the workers are added to the cache.
+
+        param
+        ----
+        paths: Paths of the input files.
+        outputs: Paths of the output files, by default the input paths
+            with ".processed" appended.
+        metrics: metrics.Metrics to which the number of files is
+            reported.
+
+        return
+        ----
+        List of the output paths.
+        """
+        if outputs is None:
+            outputs = [p + ".processed" for p in paths]
+        if len(outputs) != len(paths):
+            raise ValueError("Number of outputs must match the inputs")
+        if metrics is None:
+            metrics = NULL_METRICS
+
+        pool = self._get_pool()
+        jobs = zip(paths, outputs)
+        with metrics.timer("preprocess_text"):
+            if pool is None:
+                results = (self.process_file(*job) for job in jobs)
+            else:
+                results = self._merge_changes(
+                        pool.imap(_process_file_in_worker, jobs))
+
+            for result in results:
+                metrics.increment("files")
+                metrics.maybe_report()
+
+        metrics.report()
+        return outputs
+
+_preprocessor = None
+
+def _set_preprocessor(preprocessor):
+    global _preprocessor
+    _preprocessor = preprocessor
+    preprocessor._lemma_cache.track_changes()
+
+def _normalize_in_worker(sentence):
+    return (_preprocessor.normalize(sentence),
+            _preprocessor._lemma_cache.pop_changes())
+
+def _process_file_in_worker(job):
+    _preprocessor.process_file(*job)
+    return job[1], _preprocessor._lemma_cache.pop_changes()
+
+def iter_sentences(f, sentence_tokenizer, chunk_size):
+    """Yields the sentences of a file using bounded memory.
+
+    The file is read in chunks. After segmenting the buffer, all but the
+    last sentence are yielded and the last one is carried over to the
+    next chunk, as it might continue there. A carry-over larger than
+    chunk_size is yielded as it is.
 
-    with open(outputfile, "w") as f:
-        for l in lines:
-            # get words
-            tokens = nltk.word_tokenize(l)
+    param
+    ----
+    f: File object to read.
+    sentence_tokenizer: Punkt sentence segmenter.
+    chunk_size: Number of bytes to read at a time.
+    """
+    buffer = ""
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            break
+
+        buffer += chunk
+        spans = list(sentence_tokenizer.span_tokenize(buffer))
+        if not spans:
+            continue
+
+        for start, end in spans[:-1]:
+            yield buffer[start:end]
+        buffer = buffer[spans[-1][0]:]
+
+        if len(buffer) > chunk_size:
+            yield buffer.strip()
+            buffer = ""
+
+    for l in sentence_tokenizer.tokenize(buffer):
+        yield l
+
+def _get_batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+class LRUCache(object):
+    """Bounded dictionary which evicts the least recently used keys.
+
+    It counts the hits and misses of get, see get_stats.
+    """
 
-            # Doing lemmatization.
-            normalized_tokens = [lemmatizer.lemmatize(t) for t in tokens]
+    def __init__(self, max_size=100000):
+        """Initiates the class.
+        param
+        ----
+        max_size: Maximum number of keys to keep.
+        """
+        import collections
+
+        self._max_size = max_size
+        self._data = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None, count=True):
+        """Returns the value of key and marks it as recently used.
+
+        param
+        ----
+        count: Count the lookup in the hits and misses. Callers which
+            look up many keys for one request count it themselves.
+        """
+        try:
+            value = self._data.pop(key)
+        except KeyError:
+            if count:
+                self.misses += 1
+            return default
+
+        self._data[key] = value
+        if count:
+            self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """Stores the value, evicting the oldest key if required."""
+        if key in self._data:
+            del self._data[key]
+        elif len(self._data) >= self._max_size:
+            self._data.popitem(last=False)
+        self._data[key] = value
+
+    def get_stats(self):
+        """Returns the size, hits, misses and hit rate."""
+        lookups = self.hits + self.misses
+        return {"size": len(self._data), "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": float(self.hits) / lookups if lookups else 0.}
+
+class LemmaCache(LRUCache):
+    """Memoizes the lemmas given by WordNet lemmatizer.
+
+    As the token frequencies follow Zipf's law, a small cache answers
+    most of the lookups. The cache can be saved to a file and loaded
+    in later runs or in worker processes.
+    """
 
-            # Writing the sentence back where each word is separated
-            # by a single space
-            f.write(" ".join(normalized_tokens))
-            f.write("\n")
+    def __init__(self, max_size=100000, lemmatizer=None):
+        """Initiates the class.
+        param
+        ----
+        max_size: Maximum number of tokens to keep.
+        lemmatizer: Lemmatizer to use, defaults to nltk.WordNetLemmatizer.
+        """
+        super(LemmaCache, self).__init__(max_size)
+        self._lemmatizer = lemmatizer
+        self._new_lemmas = None
+
+    def __getstate__(self):
+        # The lemmatizer is created again after unpickling.
+        state = self.__dict__.copy()
+        state["_lemmatizer"] = None
+        return state
+
+    def lemmatize(self, token):
+        """Returns the lemma of token."""
+        lemma = self.get(token)
+        if lemma is None:
+            if self._lemmatizer is None:
+                import nltk
+                self._lemmatizer = nltk.WordNetLemmatizer()
+
+            lemma = self._lemmatizer.lemmatize(token)
+            self.put(token, lemma)
+            if self._new_lemmas is not None:
+                self._new_lemmas.append((token, lemma))
+
+        return lemma
+
+    def track_changes(self):
+        """Starts keeping the new lemmas and stats, see pop_changes."""
+        self._new_lemmas = []
+        self._popped_stats = (self.hits, self.misses)
+
+    def pop_changes(self):
+        """Returns the changes since the previous call, see merge_changes.
+
+        It is used by worker processes, whose caches are copies, to send
+        what they learned back to the cache of the parent process.
+        """
+        hits, misses = self._popped_stats
+        changes = (self._new_lemmas, self.hits - hits, self.misses - misses)
+        self.track_changes()
+        return changes
+
+    def merge_changes(self, changes):
+        """Adds the lemmas and the stats returned by pop_changes."""
+        lemmas, hits, misses = changes
+        for token, lemma in lemmas:
+            self.put(token, lemma)
+        self.hits += hits
+        self.misses += misses
+
+    def save(self, path):
+        """Writes the cached lemmas to path in json format."""
+        import json
+
+        with open(path, "w") as f:
+            json.dump(self._data.items(), f)
+
+    def load(self, path):
+        """Adds the lemmas saved in path to the cache."""
+        import json
+
+        with open(path) as f:
+            for token, lemma in json.load(f):
+                self.put(token.encode("utf-8"), lemma.encode("utf-8"))
 
 
 def get_ngrams_from_line(sentence, window_size, start_symbol, end_symbol):
@@ -92,7 +466,44 @@ def get_ngrams_from_line(sentence, window_size, start_symbol, end_symbol):
     return ngrams
 
 
-def calculate_perplexity(filename, prob_distribution, window_size):
+def get_ngram_ids_from_line(ids, window_size, start_id, end_id):
+    """Retrieves NGrams of token ids from given line.
+
+    It works on a list of token ids and returns each n-gram as a tuple
+    of ids. For a line of at least N - 2 tokens, the n-grams are the
+    same as of get_ngrams_from_line. For a shorter line, e.g. an empty
+    one with N = 3, get_ngrams_from_line also gives n-grams shorter
+    than N, which end at the end marker, while only the N-grams of the
+    padded line are given here, so that every n-gram has N ids.
+
+    params:
+    ids: List of token ids of the line, see vocabulary.Vocabulary.
+    window_size: The value of N in N-grams.
+    start_id: Id of the start symbol.
+    end_id: Id of the end symbol.
+
+    return
+    ----
+    A list of tuples in the order of the appearance.
+    """
+    padded = (start_id,) * (window_size - 1) + tuple(ids) + (end_id,)
+
+    return [padded[index : index + window_size]
+            for index in range(len(padded) - window_size + 1)]
+
+
+def get_token_count(ngram_count, window_size):
+    """Returns the number of tokens of a sentence for perplexity.
+
+    As specified in book (pg. 96), that token count should not include
+    start symbol, so it is the number of n-grams less N - 1. A sentence
+    shorter than N - 2 tokens counts as 0 tokens, whether its n-grams
+    come from get_ngrams_from_line or get_ngram_ids_from_line.
+    """
+    return max(ngram_count - (window_size - 1), 0)
+
+def calculate_perplexity(filename, prob_distribution, window_size,
+        metrics=None, vocabulary=None):
     """Calculates the perplexity of test data.
 
     It returns the log of the eqn. (4.18) for better accuracy.
@@ -105,6 +516,11 @@ def calculate_perplexity(filename, prob_distribution, window_size):
     prob_distribution: Distribution from training data, see
         LaplaceSmoothedDistribution for more details.
     window_size: The N of N-grams.
+    metrics: metrics.Metrics to which the lines and tokens scored are
+        reported.
+    vocabulary: Frozen vocabulary of the training model. If given, the
+        unknown tokens are replaced by their unknown word class, see
+        vocabulary.build_vocabulary.
 
     returns
     ----
@@ -115,17 +531,29 @@ def calculate_perplexity(filename, prob_distribution, window_size):
 
     import math
 
-    with open(filename) as f:
-        for line in f:
-            ngrams = get_ngrams_from_line(line, window_size,
-                    NGram._START_MARKER_, NGram._END_MARKER_)
+    if metrics is None:
+        metrics = NULL_METRICS
+
+    with metrics.timer("calculate_perplexity"), open(filename) as f:
+        for batch in _get_batches(f, _BATCH_SIZE_):
+            batch_token_count = 0
+            for line in batch:
+                if vocabulary is not None:
+                    line = vocabulary.map_line(line)
+                ngrams = get_ngrams_from_line(line, window_size,
+                        NGram._START_MARKER_, NGram._END_MARKER_)
+
+                for n in ngrams:
+                    prob = prob_distribution.get_probability(n)
+                    prob_sum += math.log(prob)
 
-            for n in ngrams:
-                prob = prob_distribution.get_probability(n)
-                prob_sum += math.log(prob)
+                batch_token_count += get_token_count(len(ngrams),
+                        window_size)
 
-            # As specified in book (pg. 96), that token count
-            # should not include start symbol.
-            token_count += len(ngrams) - (window_size - 1)
+            token_count += batch_token_count
+            metrics.increment("lines", len(batch))
+            metrics.increment("tokens", batch_token_count)
+            metrics.maybe_report()
 
+    metrics.report()
     return -1./token_count * prob_sum
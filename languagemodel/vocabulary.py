@@ -0,0 +1,200 @@
+# Vocabulary for language models.
+
+# Classes of the unknown words, see Vocabulary.freeze.
+UNKNOWN = "UNK"
+UNKNOWN_NONTRIVIAL = "UNK_NONTRIV"
+
+_VOWELS_ = frozenset("aeiouAEIOU")
+
+def is_nontrivial(token):
+    """Tells if a token looks like a word.
+
+    A token made only of letters with at least one vowel and one
+    consonant is nontrivial, as in the unknown word handling of the
+    report. Others are mostly markup and punctuation.
+    """
+    if not token.isalpha():
+        return False
+
+    vowels = sum(1 for c in token if c in _VOWELS_)
+    return 0 < vowels < len(token)
+
+class Vocabulary(object):
+    """Interned vocabulary mapping tokens to integer ids.
+
+    Ids are assigned in the order in which the tokens are first seen,
+    starting from 0. The count tables in NGrams.py use tuples of these
+    ids as keys, so each token string is stored only once no matter how
+    many n-grams it appears in.
+
+    A frozen vocabulary does not grow anymore, tokens which are not in
+    it are mapped to the id of their unknown word class.
+    """
+
+    def __init__(self, tokens=None):
+        """Initiates the class.
+
+        param
+        ----
+        tokens: Optional iterable of tokens to add in order.
+        """
+        self._token_to_id = {}
+        self._id_to_token = []
+        self._unknown_id = None
+        self._nontrivial_id = None
+
+        if tokens is not None:
+            for t in tokens:
+                self.add(t)
+
+    def __len__(self):
+        return len(self._id_to_token)
+
+    def __contains__(self, token):
+        return token in self._token_to_id
+
+    def add(self, token):
+        """Returns the id of token, assigning a new one if required.
+
+        A frozen vocabulary returns the id of the unknown word class of
+        a new token instead.
+        """
+        token_id = self._token_to_id.get(token)
+        if token_id is None:
+            if self._unknown_id is not None:
+                return self._get_unknown_id(token)
+
+            token_id = len(self._id_to_token)
+            self._token_to_id[token] = token_id
+            self._id_to_token.append(token)
+
+        return token_id
+
+    def get_id(self, token):
+        """Returns the id of token.
+
+        For a token which is not in vocabulary, it is None, or the id
+        of its unknown word class if the vocabulary is frozen.
+        """
+        token_id = self._token_to_id.get(token)
+        if token_id is None and self._unknown_id is not None:
+            return self._get_unknown_id(token)
+        return token_id
+
+    def _get_unknown_id(self, token):
+        if self._nontrivial_id is not None and is_nontrivial(token):
+            return self._nontrivial_id
+        return self._unknown_id
+
+    def freeze(self, nontrivial=False):
+        """Stops adding tokens, new ones are mapped to unknown words.
+
+        param
+        ----
+        nontrivial: If true, the tokens which look like words (see
+            is_nontrivial) are mapped to UNKNOWN_NONTRIVIAL and the
+            others to UNKNOWN. Otherwise, all of them are mapped to
+            UNKNOWN.
+        """
+        self._unknown_id = self.add(UNKNOWN)
+        if nontrivial:
+            self._nontrivial_id = self.add(UNKNOWN_NONTRIVIAL)
+
+    def is_frozen(self):
+        return self._unknown_id is not None
+
+    def has_nontrivial_class(self):
+        """Tells if the vocabulary was frozen with nontrivial."""
+        return self._nontrivial_id is not None
+
+    def map_line(self, line):
+        """Replaces the tokens of a line which are not in vocabulary.
+
+        They are replaced by their unknown word class if the vocabulary
+        is frozen, so that string keyed tables built from the decoded
+        n-grams can score the line.
+        """
+        if self._unknown_id is None:
+            return line
+
+        id_to_token = self._id_to_token
+        return " ".join([id_to_token[self.get_id(t)] for t in line.split()])
+
+    def get_token(self, token_id):
+        """Returns the token for given id."""
+        return self._id_to_token[token_id]
+
+    def get_tokens(self):
+        """Returns all tokens ordered by their ids."""
+        return self._id_to_token
+
+    def encode(self, ngram):
+        """Converts a space separated n-gram to a tuple of ids.
+
+        return
+        ----
+        Tuple of ids or None if any of the tokens is not in vocabulary,
+        see get_id.
+        """
+        ids = []
+        for t in ngram.split():
+            token_id = self.get_id(t)
+            if token_id is None:
+                return None
+            ids.append(token_id)
+
+        return tuple(ids)
+
+    def decode(self, ids):
+        """Converts a tuple of ids back to a space separated n-gram."""
+        return " ".join([self._id_to_token[i] for i in ids])
+
+def build_vocabulary(files, min_count=1, max_size=None, unknown_tokens=0,
+        nontrivial=False):
+    """Builds a frozen vocabulary from the token frequencies of files.
+
+    param
+    ----
+    files: Paths of preprocessed files, see NGram.
+    min_count: Tokens seen less often are left out.
+    max_size: If given, only this many of the most frequent tokens are
+        kept, ties are broken alphabetically.
+    unknown_tokens: The tokens among the first unknown_tokens tokens of
+        the corpus are left out, as in the unknown word handling of the
+        report which used 15.
+    nontrivial: Use two classes of unknown words, see Vocabulary.freeze.
+
+    return
+    ----
+    Frozen Vocabulary with the markers of NGram, the unknown word
+    classes and the kept tokens, in that order.
+    """
+    import collections
+
+    from NGrams import NGram
+
+    counts = collections.Counter()
+    first_tokens = []
+    for path in files:
+        with open(path) as f:
+            for l in f:
+                tokens = l.split()
+                counts.update(tokens)
+                if len(first_tokens) < unknown_tokens:
+                    first_tokens.extend(tokens[:unknown_tokens -
+                        len(first_tokens)])
+
+    reserved = set(first_tokens)
+    reserved.update([NGram._START_MARKER_, NGram._END_MARKER_, UNKNOWN,
+        UNKNOWN_NONTRIVIAL])
+    kept = sorted((t for t, c in counts.iteritems()
+        if c >= min_count and t not in reserved),
+        key=lambda t: (-counts[t], t))
+    if max_size is not None:
+        kept = kept[:max_size]
+
+    classes = [UNKNOWN, UNKNOWN_NONTRIVIAL] if nontrivial else [UNKNOWN]
+    vocabulary = Vocabulary([NGram._START_MARKER_, NGram._END_MARKER_] +
+            classes + kept)
+    vocabulary.freeze(nontrivial)
+    return vocabulary